@@ -0,0 +1,108 @@
+"""attacks.py contains attack tables which are precomputed once when the module is imported.
+   For each square, the tables give the bitboard of the squares a piece standing there attacks, so finding the moves of a piece
+   costs a few table lookups instead of scanning the board.
+"""
+from position import WHITE, BLACK, SQUARE_BITS
+
+
+# Directions on the board, as (file step, rank step) tuples
+NORTH = 0
+NORTH_EAST = 1
+EAST = 2
+SOUTH_EAST = 3
+SOUTH = 4
+SOUTH_WEST = 5
+WEST = 6
+NORTH_WEST = 7
+
+DIRECTION_STEPS = [(0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0), (-1, 1)] # Step of each direction, indexed by the direction number
+
+ORTHOGONAL_DIRECTIONS = [NORTH, EAST, SOUTH, WEST] # Directions in which rooks slide
+DIAGONAL_DIRECTIONS = [NORTH_EAST, SOUTH_EAST, SOUTH_WEST, NORTH_WEST] # Directions in which bishops slide
+
+# Directions which go toward the higher squares. On a ray going in one of these directions, the nearest blocker is the lowest bit.
+POSITIVE_DIRECTIONS = {NORTH, NORTH_EAST, EAST, NORTH_WEST}
+
+KNIGHT_STEPS = [(1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2)] # The 'L'-like jumps of a knight
+
+
+def _step_targets(square, steps):
+    "Returns the bitboard of the squares which can be reached from a square with a single step of each (file step, rank step) tuple"
+    file, rank = square & 7, square >> 3 # File (column) and rank (row) of the square
+    targets = 0
+    for file_step, rank_step in steps: # For each step
+        target_file, target_rank = file + file_step, rank + rank_step
+        if 0 <= target_file < 8 and 0 <= target_rank < 8: # If the step doesn't go out of the board
+            targets |= SQUARE_BITS[target_rank * 8 + target_file]
+    return targets
+
+
+def _ray(square, direction):
+    "Returns the bitboard of the squares met when sliding from a square in a direction until the edge of the board"
+    file_step, rank_step = DIRECTION_STEPS[direction]
+    file, rank = (square & 7) + file_step, (square >> 3) + rank_step
+    ray = 0
+    while 0 <= file < 8 and 0 <= rank < 8: # While we are still on the board
+        ray |= SQUARE_BITS[rank * 8 + file]
+        file += file_step
+        rank += rank_step
+    return ray
+
+
+KNIGHT_ATTACKS = [_step_targets(square, KNIGHT_STEPS) for square in range(64)] # Squares attacked by a knight, indexed by its square
+KING_ATTACKS = [_step_targets(square, DIRECTION_STEPS) for square in range(64)] # Squares attacked by a king, indexed by its square
+
+# Squares attacked by a pawn, indexed by its color and its square. White pawns capture upward and black pawns downward.
+PAWN_ATTACKS = [[_step_targets(square, [(-1, 1), (1, 1)]) for square in range(64)],
+                [_step_targets(square, [(-1, -1), (1, -1)]) for square in range(64)]]
+
+RAYS = [[_ray(square, direction) for square in range(64)] for direction in range(8)] # Rays of each direction, indexed by direction and square
+
+
+
+def _aligned_tables():
+    """Returns the BETWEEN and LINE tables, indexed by two squares. For two squares on the same row, column or diagonal,
+       BETWEEN gives the squares strictly between them and LINE the whole line which goes through both of them. Both are 0 otherwise."""
+    between = [[0] * 64 for square in range(64)]
+    line = [[0] * 64 for square in range(64)]
+    for square in range(64):
+        for direction in range(8):
+            full_line = RAYS[direction][square] | RAYS[(direction + 4) % 8][square] | SQUARE_BITS[square] # The opposite direction is 4 directions further
+            for other in range(64):
+                if RAYS[direction][square] & SQUARE_BITS[other]:
+                    between[square][other] = RAYS[direction][square] & ~RAYS[direction][other] & ~SQUARE_BITS[other]
+                    line[square][other] = full_line
+    return between, line
+
+
+BETWEEN, LINE = _aligned_tables() # Used to find the pinned pieces and the cells which block a check
+
+def _slider_attacks(square, occupancy, directions):
+    "Returns the squares attacked by a sliding piece, which stops on the first occupied square of each ray"
+    attacks = 0
+    for direction in directions: # For each direction in which the piece slides
+        ray = RAYS[direction][square]
+        blockers = ray & occupancy # Occupied squares on the ray
+        if blockers: # If the ray is blocked, cut it after the nearest blocker
+            if direction in POSITIVE_DIRECTIONS:
+                nearest = (blockers & -blockers).bit_length() - 1 # Lowest bit
+            else:
+                nearest = blockers.bit_length() - 1 # Highest bit
+            ray ^= RAYS[direction][nearest] # Remove the squares behind the blocker
+        attacks |= ray
+    return attacks
+
+
+def bishop_attacks(square, occupancy):
+    "Returns the squares attacked by a bishop on a square, given the bitboard of the occupied squares"
+    return _slider_attacks(square, occupancy, DIAGONAL_DIRECTIONS)
+
+
+def rook_attacks(square, occupancy):
+    "Returns the squares attacked by a rook on a square, given the bitboard of the occupied squares"
+    return _slider_attacks(square, occupancy, ORTHOGONAL_DIRECTIONS)
+
+
+def queen_attacks(square, occupancy):
+    "Returns the squares attacked by a queen on a square, given the bitboard of the occupied squares"
+    return _slider_attacks(square, occupancy, ORTHOGONAL_DIRECTIONS) | _slider_attacks(square, occupancy, DIAGONAL_DIRECTIONS)
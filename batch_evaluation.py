@@ -0,0 +1,199 @@
+"""batch_evaluation.py scores many positions at once with NumPy, for bulk jobs such as annotating a database of games or tuning the weights.
+   The positions are encoded as an array of 12 planes of 64 squares each (one plane per color and piece type), and every term of the score
+   is computed for the whole batch in a few array operations, instead of looping over the pieces of each position in Python.
+   The mobility and pawn structure terms pack the planes back into one 64 bits integer per plane, so the attacks of every piece of a type
+   in every position are found with a few shifts of the whole array.
+
+   The score is the material and piece-square tables of evaluation.py, plus mobility and pawn structure terms. With those two terms
+   turned off, the scores are exactly the ones of evaluation.evaluate. Scores are in centipawns, seen from the side to move.
+
+   Example :
+       python batch_evaluation.py --count 5000        Compare the speed of the batch evaluation with evaluation.evaluate
+"""
+import argparse
+import random
+import sys
+import time
+import numpy as np
+from position import * # Import position.py for colors, piece types and the Position class
+from evaluation import PIECE_SQUARE_VALUES, evaluate # Import evaluation.py for the piece-square tables, shared with the search
+
+
+PLANE_COUNT = 2 * len(PIECE_NAMES) # One plane for each color and piece type: plane = color * 6 + piece type
+
+# Material and piece-square values of each plane on each square, counted negatively for the enemy's planes
+PLANE_WEIGHTS = np.array([[value if color == WHITE else -value for value in PIECE_SQUARE_VALUES[color][piece_type]]
+                          for color in (WHITE, BLACK) for piece_type in range(len(PIECE_NAMES))], dtype=np.int32)
+
+MOBILITY_WEIGHTS = [0, 4, 3, 2, 1, 0] # Bonus for each square attacked by the pieces of each type and not occupied by their own pieces
+DOUBLED_PAWN_PENALTY = 10 # For each pawn behind another pawn of its color on the same file
+ISOLATED_PAWN_PENALTY = 10 # For each pawn without any pawn of its color on the files next to it
+PASSED_PAWN_BONUS = np.array([0, 5, 10, 20, 35, 60, 100, 0], dtype=np.int32) # For each passed pawn, by rank as seen from its side
+
+# The mobility works on one 64 bits integer per board, square n being bit n. Each step is a shift of the square index, and the mask
+# keeps the squares a piece can reach with it without going around the edge of the board.
+NOT_FILE_A = np.uint64(0xFEFEFEFEFEFEFEFE)
+NOT_FILE_H = np.uint64(0x7F7F7F7F7F7F7F7F)
+NOT_FILES_AB = np.uint64(0xFCFCFCFCFCFCFCFC)
+NOT_FILES_GH = np.uint64(0x3F3F3F3F3F3F3F3F)
+ALL_SQUARES = np.uint64(0xFFFFFFFFFFFFFFFF)
+KNIGHT_STEPS = [(17, NOT_FILE_A), (15, NOT_FILE_H), (10, NOT_FILES_AB), (6, NOT_FILES_GH),
+                (-6, NOT_FILES_AB), (-10, NOT_FILES_GH), (-15, NOT_FILE_A), (-17, NOT_FILE_H)] # (square step, mask)
+BISHOP_STEPS = [(9, NOT_FILE_A), (7, NOT_FILE_H), (-7, NOT_FILE_A), (-9, NOT_FILE_H)]
+ROOK_STEPS = [(8, ALL_SQUARES), (-8, ALL_SQUARES), (1, NOT_FILE_A), (-1, NOT_FILE_H)]
+SLIDING_STEPS = {BISHOP: BISHOP_STEPS, ROOK: ROOK_STEPS, QUEEN: BISHOP_STEPS + ROOK_STEPS}
+FILE_MASKS = np.array([0x0101010101010101 << file for file in range(8)], dtype=np.uint64)
+RANK_MASKS = np.array([0xFF << (8 * rank) for rank in range(8)], dtype=np.uint64)
+POPCOUNT_8 = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.int32) # Number of squares of each byte, without np.bitwise_count
+
+
+def encode_positions(positions):
+    """Encodes a list of positions as NumPy arrays and returns a (planes, side_to_move) tuple.
+       planes is an array of booleans of shape (positions, 12, 64), and side_to_move an array of the color to move in each position."""
+    bitboards = np.array([[position.bitboards[color][piece_type] for color in (WHITE, BLACK) for piece_type in range(len(PIECE_NAMES))]
+                          for position in positions], dtype="<u8").reshape(len(positions), PLANE_COUNT)
+    planes = np.unpackbits(bitboards.view(np.uint8), bitorder="little").reshape(len(positions), PLANE_COUNT, 64) # Bit n is square n
+    side_to_move = np.array([position.side_to_move for position in positions], dtype=np.int8)
+    return planes.astype(bool), side_to_move
+
+
+def _step(bitboards, step):
+    "Moves every square of an array of 64 bits boards by a square step, dropping what leaves the board at the top or the bottom"
+    return bitboards << np.uint64(step) if step > 0 else bitboards >> np.uint64(-step)
+
+
+def _popcount(bitboards):
+    "Returns the number of squares of each board of an array of 64 bits boards"
+    if hasattr(np, "bitwise_count"): # NumPy 2.0 and later
+        return np.bitwise_count(bitboards).astype(np.int32)
+    return POPCOUNT_8[bitboards.view(np.uint8)].reshape(*bitboards.shape, 8).sum(axis=-1)
+
+
+def _slide(pieces, empty, step, mask):
+    """Returns the squares attacked by sliding pieces in one direction, stopping on the first occupied square, for a whole array of boards.
+       The rays are filled by doubling their length three times (Kogge-Stone fill), instead of moving them one square at a time."""
+    open_squares = empty & mask # Squares a ray can go through without going around the edge
+    pieces = pieces | (open_squares & _step(pieces, step))
+    open_squares = open_squares & _step(open_squares, step)
+    pieces = pieces | (open_squares & _step(pieces, 2 * step))
+    open_squares = open_squares & _step(open_squares, 2 * step)
+    pieces = pieces | (open_squares & _step(pieces, 4 * step))
+    return _step(pieces, step) & mask
+
+
+def _mobility(bitboards, color):
+    """Returns the mobility score of a color in each position, from 64 bits boards of shape (positions, 12).
+       The squares attacked by all the pieces of one type are counted once, even if several pieces of that type attack them."""
+    not_own = ~np.bitwise_or.reduce(bitboards[:, color * 6:color * 6 + 6], axis=1)
+    empty = ~np.bitwise_or.reduce(bitboards, axis=1)
+    score = np.zeros(len(bitboards), dtype=np.int32)
+
+    knights = bitboards[:, color * 6 + KNIGHT]
+    attacked = np.zeros_like(knights)
+    for step, mask in KNIGHT_STEPS:
+        attacked |= _step(knights, step) & mask
+    score += MOBILITY_WEIGHTS[KNIGHT] * _popcount(attacked & not_own)
+
+    for piece_type, steps in SLIDING_STEPS.items():
+        pieces = bitboards[:, color * 6 + piece_type]
+        attacked = np.zeros_like(pieces)
+        for step, mask in steps:
+            attacked |= _slide(pieces, empty, step, mask)
+        score += MOBILITY_WEIGHTS[piece_type] * _popcount(attacked & not_own)
+    return score
+
+
+def _pawn_structure(pawns, enemy_pawns):
+    """Returns the pawn structure score of a side in each position, from arrays of 64 bits boards oriented so the side's pawns
+       move towards the higher ranks"""
+    file_counts = _popcount(pawns[:, None] & FILE_MASKS) # Pawns on each file
+    doubled = np.maximum(file_counts - 1, 0).sum(axis=1)
+
+    has_pawn = file_counts > 0
+    neighbours = np.zeros_like(has_pawn)
+    neighbours[:, 1:] |= has_pawn[:, :-1]
+    neighbours[:, :-1] |= has_pawn[:, 1:]
+    isolated = (file_counts * ~neighbours).sum(axis=1)
+
+    guarded = enemy_pawns | (_step(enemy_pawns, 1) & NOT_FILE_A) | (_step(enemy_pawns, -1) & NOT_FILE_H) # Enemy pawns on the same file or the files next to it
+    for step in (-8, -16, -32): # Each square below an enemy pawn on the same rank or a higher one
+        guarded |= _step(guarded, step)
+    passed = pawns & ~_step(guarded, -8) # No enemy pawn on a higher rank can stop the pawn
+    passed_bonus = _popcount(passed[:, None] & RANK_MASKS) @ PASSED_PAWN_BONUS
+
+    return passed_bonus - DOUBLED_PAWN_PENALTY * doubled - ISOLATED_PAWN_PENALTY * isolated
+
+
+def evaluate_planes(planes, side_to_move, mobility=True, pawn_structure=True):
+    """Returns the scores of encoded positions as an array of integers, in centipawns seen from the side to move.
+    - planes and side_to_move are the arrays given by encode_positions
+    - mobility and pawn_structure add those terms to the material and piece-square score"""
+    scores = np.einsum("nps,ps->n", planes.astype(np.int32), PLANE_WEIGHTS) # Material and piece-square tables of both sides
+    if mobility or pawn_structure:
+        bitboards = np.packbits(planes, axis=2, bitorder="little").view("<u8").reshape(len(planes), PLANE_COUNT) # Back to one integer per plane
+        if mobility:
+            scores += _mobility(bitboards, WHITE) - _mobility(bitboards, BLACK)
+        if pawn_structure:
+            white_pawns, black_pawns = bitboards[:, PAWN], bitboards[:, 6 + PAWN]
+            # The enemy's pawns move down: reversing the bytes of a board puts its ranks upside down
+            scores += _pawn_structure(white_pawns, black_pawns) - _pawn_structure(black_pawns.byteswap(), white_pawns.byteswap())
+    return np.where(side_to_move == WHITE, scores, -scores)
+
+
+def evaluate_batch(positions, mobility=True, pawn_structure=True):
+    "Returns the scores of a list of positions as an array of integers, in centipawns seen from the side to move"
+    planes, side_to_move = encode_positions(positions)
+    return evaluate_planes(planes, side_to_move, mobility, pawn_structure)
+
+
+def random_positions(count, seed=0, max_plies=80):
+    "Returns a list of positions reached by playing random legal moves from the starting position, to benchmark the evaluation"
+    from rules import starting_position, legal_moves, make_move # Imported here, the evaluation itself doesn't need the rules
+    generator = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        position = starting_position()
+        for _ in range(generator.randrange(max_plies)):
+            moves = legal_moves(position)
+            if not moves:
+                break
+            make_move(position, generator.choice(moves))
+        position.history = [] # The undo records aren't needed
+        positions.append(position)
+    return positions
+
+
+def main(arguments=None):
+    "Read the command line and compare the speed of the batch evaluation with the evaluation of the positions one by one"
+    parser = argparse.ArgumentParser(description="Benchmark the NumPy batch evaluation.")
+    parser.add_argument("--count", type=int, default=2000, help="number of random positions to score (default: 2000)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random games")
+    options = parser.parse_args(arguments)
+
+    positions = random_positions(options.count, options.seed)
+
+    start = time.perf_counter()
+    single_scores = [evaluate(position) for position in positions]
+    single_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    planes, side_to_move = encode_positions(positions)
+    encode_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    material_scores = evaluate_planes(planes, side_to_move, mobility=False, pawn_structure=False)
+    material_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    evaluate_planes(planes, side_to_move)
+    full_seconds = time.perf_counter() - start
+
+    print(f"{len(positions)} positions")
+    print(f"evaluation.evaluate, one by one : {single_seconds:.4f} s ({len(positions) / single_seconds:,.0f} positions/s)")
+    print(f"encoding : {encode_seconds:.4f} s")
+    print(f"batch, material and tables : {material_seconds:.4f} s ({len(positions) / material_seconds:,.0f} positions/s), "
+          f"same scores: {material_scores.tolist() == single_scores}")
+    print(f"batch, all terms : {full_seconds:.4f} s ({len(positions) / full_seconds:,.0f} positions/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,27 +1,41 @@
 "board.py contains a Board class which represent the graphical game board"
 import pygame # Import the pygame module
+from position import Position, square_index # The Position class stores which cells of the board are occupied
+from instrumentation import get_logger # Messages are sent to a logger, which is off by default
+
+logger = get_logger("board")
 
 class Board:
-    def __init__(self, window, grid=[]):
-        "A graphical chess board for the game based on a grid list"
+    def __init__(self, window, grid=[], position=None):
+        """A graphical chess board for the game based on a grid list.
+        - grid gives the dimensions of the board
+        - position is the Position object which stores the pieces standing on the board. A new empty position is created if it's None."""
         self.window = window # The game window in which we must display the graphical board
         self.grid = grid # The grid on which the graphical board is based
+        self.position = position if position is not None else Position() # The bitboard position of the pieces on the board
 
         self.square_colors = [(255, 228, 196 ), (0, 0, 0)] # Colors for the squares on the board, in RGB encoding. The first one stands for "bisque", and the second one for "black".
 
-        self.square_surfs = [] # List of all squares in the board, where each square is a surface
+        self.square_surfs = [] # List of all squares in the board, where each square is a surface. It is filled once by render_background.
 
-        print(f"Board dimensions : {self.get_dimensions()}")
+        logger.debug("Board dimensions : %s", self.get_dimensions())
 
         self.square_size = 75 # Size of each square
 
         self.square_spacing = 1 # Spacing between each square on the board
 
-    def draw_squares(self):
-        "Draws all board squares based on the length of the grid"
+        self.background = None # Surface on which the whole board is pre-rendered, so it's only drawn once
+        self.dirty_rects = [] # Rects of the window which changed since the last display update
+
+        self.piece_index = [None] * 64 # GamePiece standing on each square, kept up to date by GamePiece.set_position and GamePiece.move_to
+
+    def render_background(self):
+        "Pre-renders the window background and all board squares on a cached surface"
+        self.background = pygame.Surface(self.window.get_size()) # Surface with the dimensions of the window
+        self.background.fill((255,255,255))
+        self.square_surfs = [] # The squares are created only once
 
         for row in range(len(self.grid)): # For each row of the grid
-            #print(self.grid[row])
             for col in range(len(self.grid[row])): # For each column of the row
                 square_surf = pygame.Surface((self.square_size, self.square_size)) # Create a surface to contain the square
 
@@ -34,43 +48,86 @@ class Board:
 
 
                 self.square_surfs.append((square_surf, x, y)) # Append the square's surface  and position to the list of surfaces
+                self.background.blit(square_surf, (x, y)) # Draw the square on the cached background
+
+    def draw_squares(self):
+        "Draws the whole board by copying the cached background on the window"
+        if self.background is None: # The background is rendered the first time the board is drawn
+            self.render_background()
+        self.window.blit(self.background, (0, 0))
+        self.dirty_rects = [self.window.get_rect()] # The whole window must be updated
+
+
+    def cell_at_pixel(self, pixel_position):
+        "Returns the (grid_x, grid_y) cell which contains a pixel position, or None if the position is outside the board"
+        cell_x = pixel_position[0] // (self.square_size + self.square_spacing) # Each cell takes the size of a square plus the spacing
+        cell_y = pixel_position[1] // (self.square_size + self.square_spacing)
+        width, height = self.get_dimensions()
+        if 0 <= cell_x < width and 0 <= cell_y < height:
+            return (cell_x, cell_y)
+        return None
 
 
-            self.window.fill((255,255,255))
-            for surf, x,y in self.square_surfs:
-                self.window.blit(surf, (x,y))
+    def piece_at_cell(self, cell):
+        "Returns the GamePiece standing on a (grid_x, grid_y) cell, or None if the cell is free"
+        return self.piece_index[square_index(cell[0], cell[1])]
 
 
     def get_surface_at_position(self, position=(0,0)):
         "Returns a surface representing a square which have the specified position"
-        
-        position_rect = pygame.Rect(position[0], position[1], 1, 1) # Create a rect object corresponding to the given position
-        for surf_object, x, y in self.square_surfs: # For each surface representing a square
-            surf_rect = surf_object.get_rect() # Get the rect of the surface
-            if pygame.Rect.colliderect(surf_rect, position_rect): # If the surface is in collision with the position's rect, then it is the surface we're looking for
-                return surf_object # Return the surface
+        if not self.square_surfs: # The squares are created with the background
+            self.render_background()
+        cell = self.cell_at_pixel(position) # The cell is found with a division instead of a collision test on every square
+        if cell is not None:
+            return self.square_surfs[cell[1] * len(self.grid[0]) + cell[0]][0] # The squares are stored row by row
 
 
     
     def draw_on_square(self, width=10, height=10, color=(255,255,255), square_pos=(0,0)):
-        "Draws a form on a square"
+        "Draws a form on the square which contains the pixel position square_pos"
         surface = self.get_surface_at_position(square_pos) # Get the surface object which corresponds to the given position
         #print(f"Drawing on surface {surface} located at {square_pos}")
 
         if surface: # If there is a surface at the given position
             #print(f"A surface was found at {square_pos}")
-            rect = (square_pos[0], square_pos[1], width,height) # Create a tuple containing the attributes of the rect object to be drawn
-            # Draw the rect
-            displayed_rect = pygame.draw.rect(surface, color, rect)
-            # Update the display
-            pygame.display.update(displayed_rect)   
-            self.window.blit(surface, square_pos) # Draw the up-to-dates surface
+            rect = pygame.Rect(square_pos[0], square_pos[1], width,height) # Create a rect object for the form to be drawn
+            # Draw the rect on the window, and remember to update this part of the display
+            displayed_rect = pygame.draw.rect(self.window, color, rect)
+            self.dirty_rects.append(displayed_rect)
              
 
 
 
         else: # If there is no surface at the given position
-            print(f"No surface found at {square_pos}")    
+            logger.debug("No surface found at %s", square_pos)    
+
+
+    def cell_rect(self, cell):
+        "Returns the rect of a cell of the grid, given as a (grid_x, grid_y) tuple"
+        return pygame.Rect(cell[0] * (self.square_size + self.square_spacing), cell[1] * (self.square_size + self.square_spacing), self.square_size + self.square_spacing, self.square_size + self.square_spacing)
+
+
+    def restore_cell(self, cell):
+        "Repaints a single cell from the cached background and marks it as dirty, so the next display update shows it"
+        if self.background is None:
+            self.render_background()
+        rect = self.cell_rect(cell)
+        self.window.blit(self.background, rect, rect) # Only copy the part of the background under the cell
+        self.dirty_rects.append(rect)
+
+
+    def update_display(self):
+        "Updates only the dirty parts of the display, then forgets them"
+        if self.dirty_rects: # If nothing changed, there is nothing to send to the screen
+            pygame.display.update(self.dirty_rects)
+            self.dirty_rects = []
+
+
+    def highlight_square(self, cell, color=(255,184,89)):
+        "Draws a colored frame around a cell of the grid, given as a (grid_x, grid_y) tuple"
+        x = cell[0] * (self.square_size + self.square_spacing) # x position of the cell
+        y = cell[1] * (self.square_size + self.square_spacing) # y position of the cell
+        self.dirty_rects.append(pygame.draw.rect(self.window, color, (x, y, self.square_size, self.square_size), 4)) # Draw the frame on the window
 
     
     def get_dimensions(self):
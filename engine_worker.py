@@ -0,0 +1,120 @@
+"""engine_worker.py contains an EngineWorker class which runs the search in the background, so the window keeps responding while the computer thinks.
+   The game sends "think about this position" jobs to the worker, then checks a queue at each frame without waiting:
+   the worker streams a progress report after each depth, then the best move. A job can be cancelled, or stopped early
+   with "move now", in which case the best move of the last finished depth is sent at once.
+   A ponder job searches without any time limit, while the player thinks, the position after the reply the computer expects.
+   If the player plays that reply, ponderhit turns it into a normal job, whose time budget counts from the start of the pondering.
+"""
+import multiprocessing
+import queue
+import threading
+import time
+from search import Search # Import search.py for the search itself
+from tablebase import Tablebases # Import tablebase.py so the worker plays the endgames it covers perfectly
+from instrumentation import configure_logging, get_logger, metrics # Import instrumentation.py to log the metrics of the worker
+
+logger = get_logger("engine_worker")
+
+
+# Kinds of messages sent back by the worker
+PROGRESS = "progress" # A depth was finished: (PROGRESS, job_id, report)
+BEST_MOVE = "bestmove" # The search is over: (BEST_MOVE, job_id, move, summary)
+
+
+def _summary(result):
+    "Returns a small dictionary describing a SearchResult, which can be sent through a queue"
+    return {"depth": result.depth, "score": result.score, "nodes": result.nodes, "seconds": result.seconds,
+            "nps": result.nodes_per_second(), "pv": result.pv}
+
+
+def _worker_main(jobs, results, stop_job_id, hash_mb, tablebase_directory=None, ponderhit_job_id=None):
+    """Main loop of the worker: it waits for jobs and searches them, until it receives None.
+    - jobs is the queue of the jobs, as (job_id, position, time_limit, max_depth, ponder) tuples
+    - results is the queue on which the messages are sent
+    - stop_job_id is a shared integer: the jobs whose id is lower or equal must stop
+    - ponderhit_job_id is a shared integer: a ponder job whose id is lower or equal follows its time budget
+    - hash_mb is the size of the transposition table, which is kept warm from one job to the next
+    - tablebase_directory is the directory of the endgame tablebases, or None to search the endgames too"""
+    configure_logging() # A worker process starts without the logging settings of the game, but with its environment variables
+    engine = Search(hash_mb=hash_mb, tablebases=Tablebases(tablebase_directory) if tablebase_directory else None)
+    while True:
+        job = jobs.get()
+        if job is None: # The worker must close
+            logger.debug("Metrics of the worker:\n%s", metrics.report())
+            break
+        job_id, position, time_limit, max_depth, ponder = job
+        if stop_job_id.value >= job_id: # The job was cancelled before it started
+            continue
+
+        if ponder: # No time limit until the ponderhit, then the time spent pondering counts in the budget
+            start = time.perf_counter()
+            engine.stop_condition = lambda: stop_job_id.value >= job_id or (ponderhit_job_id.value >= job_id and time_limit is not None and time.perf_counter() - start >= time_limit)
+        else:
+            engine.stop_condition = lambda: stop_job_id.value >= job_id # Checked by the search with its clock
+        result = engine.search(position, max_depth=max_depth, time_limit=None if ponder else time_limit,
+                               on_iteration=lambda report: results.put((PROGRESS, job_id, report)))
+        results.put((BEST_MOVE, job_id, result.best_move, _summary(result)))
+
+
+class EngineWorker:
+    """The EngineWorker class searches positions in a background process, or in a background thread.
+       - hash_mb is the size of the transposition table of the worker, in megabytes
+       - use_process runs the search in a separate process, so it doesn't slow down the window. If it's False, a thread is used.
+       - tablebase_directory is the directory of the endgame tablebases, or None to search the endgames too
+    """
+    def __init__(self, hash_mb=16, use_process=True, tablebase_directory=None):
+        "Start the worker"
+        self.use_process = use_process
+        self.jobs = multiprocessing.Queue() # Jobs sent to the worker
+        self.results = multiprocessing.Queue() # Messages sent back by the worker
+        self.stop_job_id = multiprocessing.Value("q", 0, lock=False) # Jobs with an id lower or equal to this value stop
+        self.ponderhit_job_id = multiprocessing.Value("q", 0, lock=False) # Ponder jobs with an id lower or equal to this value follow their time budget
+        self.last_job_id = 0 # Id of the last job sent
+        self.cancelled_up_to = 0 # Messages of the jobs with an id lower or equal to this value are ignored
+
+        worker_class = multiprocessing.Process if use_process else threading.Thread
+        self.worker = worker_class(target=_worker_main, args=(self.jobs, self.results, self.stop_job_id, hash_mb, tablebase_directory, self.ponderhit_job_id), daemon=True)
+        self.worker.start()
+
+    def think(self, position, time_limit=None, max_depth=None, ponder=False):
+        """Sends a position to search and returns the id of the job.
+        - position is the Position to search. It is copied, with its history, so the game can go on modifying its own position.
+        - time_limit is the time budget in seconds, and max_depth the depth limit. The search stops at the first one reached.
+        - ponder searches without any time limit until ponderhit is called, or until the job is cancelled"""
+        self.last_job_id += 1
+        arguments = (self.last_job_id, position.copy(), time_limit, max_depth if max_depth is not None else 127, ponder)
+        self.jobs.put(arguments)
+        return self.last_job_id
+
+    def ponderhit(self):
+        "The player played the expected move: the current ponder job follows its time budget, counted from the start of the pondering"
+        self.ponderhit_job_id.value = self.last_job_id
+
+    def move_now(self):
+        "Stops the current job as soon as possible. Its best move is still sent."
+        self.stop_job_id.value = self.last_job_id
+
+    def cancel(self):
+        "Stops the current job and all the jobs waiting. Their messages won't be returned by poll."
+        self.stop_job_id.value = self.last_job_id
+        self.cancelled_up_to = self.last_job_id # The ids only grow, so one number is enough
+
+    def poll(self):
+        "Returns the list of the messages sent by the worker since the last call, without waiting"
+        messages = []
+        while True:
+            try:
+                message = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if message[1] > self.cancelled_up_to:
+                messages.append(message)
+        return messages
+
+    def close(self):
+        "Stops the worker and waits for it to finish"
+        self.cancel()
+        self.jobs.put(None)
+        self.worker.join(timeout=5)
+        if self.use_process and self.worker.is_alive(): # The search didn't notice the stop in time
+            self.worker.terminate()
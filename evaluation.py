@@ -0,0 +1,86 @@
+"""evaluation.py gives a score to a position without searching, from the material of each side and piece-square tables.
+   Scores are in centipawns (a pawn is worth 100) and are seen from the side to move: a positive score is good for the side to move.
+"""
+from position import * # Import position.py for colors, piece types and square helpers
+
+
+PIECE_VALUES = [100, 320, 330, 500, 900, 0] # Value of each piece type in centipawns. The king can't be captured, so it has no material value.
+
+# Piece-square tables: a bonus for each square, as seen by the player, written row by row from the top of the board (rank 8) to the bottom (rank 1)
+_PIECE_SQUARE_ROWS = [
+    [ 0,  0,  0,  0,  0,  0,  0,  0, # Pawn
+     50, 50, 50, 50, 50, 50, 50, 50,
+     10, 10, 20, 30, 30, 20, 10, 10,
+      5,  5, 10, 25, 25, 10,  5,  5,
+      0,  0,  0, 20, 20,  0,  0,  0,
+      5, -5,-10,  0,  0,-10, -5,  5,
+      5, 10, 10,-20,-20, 10, 10,  5,
+      0,  0,  0,  0,  0,  0,  0,  0],
+    [-50,-40,-30,-30,-30,-30,-40,-50, # Knight
+     -40,-20,  0,  0,  0,  0,-20,-40,
+     -30,  0, 10, 15, 15, 10,  0,-30,
+     -30,  5, 15, 20, 20, 15,  5,-30,
+     -30,  0, 15, 20, 20, 15,  0,-30,
+     -30,  5, 10, 15, 15, 10,  5,-30,
+     -40,-20,  0,  5,  5,  0,-20,-40,
+     -50,-40,-30,-30,-30,-30,-40,-50],
+    [-20,-10,-10,-10,-10,-10,-10,-20, # Bishop
+     -10,  0,  0,  0,  0,  0,  0,-10,
+     -10,  0,  5, 10, 10,  5,  0,-10,
+     -10,  5,  5, 10, 10,  5,  5,-10,
+     -10,  0, 10, 10, 10, 10,  0,-10,
+     -10, 10, 10, 10, 10, 10, 10,-10,
+     -10,  5,  0,  0,  0,  0,  5,-10,
+     -20,-10,-10,-10,-10,-10,-10,-20],
+    [ 0,  0,  0,  0,  0,  0,  0,  0, # Rook
+      5, 10, 10, 10, 10, 10, 10,  5,
+     -5,  0,  0,  0,  0,  0,  0, -5,
+     -5,  0,  0,  0,  0,  0,  0, -5,
+     -5,  0,  0,  0,  0,  0,  0, -5,
+     -5,  0,  0,  0,  0,  0,  0, -5,
+     -5,  0,  0,  0,  0,  0,  0, -5,
+      0,  0,  0,  5,  5,  0,  0,  0],
+    [-20,-10,-10, -5, -5,-10,-10,-20, # Queen
+     -10,  0,  0,  0,  0,  0,  0,-10,
+     -10,  0,  5,  5,  5,  5,  0,-10,
+      -5,  0,  5,  5,  5,  5,  0, -5,
+       0,  0,  5,  5,  5,  5,  0, -5,
+     -10,  5,  5,  5,  5,  5,  0,-10,
+     -10,  0,  5,  0,  0,  0,  0,-10,
+     -20,-10,-10, -5, -5,-10,-10,-20],
+    [-30,-40,-40,-50,-50,-40,-40,-30, # King
+     -30,-40,-40,-50,-50,-40,-40,-30,
+     -30,-40,-40,-50,-50,-40,-40,-30,
+     -30,-40,-40,-50,-50,-40,-40,-30,
+     -20,-30,-30,-40,-40,-30,-30,-20,
+     -10,-20,-20,-20,-20,-20,-20,-10,
+      20, 20,  0,  0,  0,  0, 20, 20,
+      20, 30, 10,  0,  0, 10, 30, 20]]
+
+
+def _square_table(rows, color):
+    "Turns a table written from the top row into a list indexed by square number, for a color. The enemy sees the board upside down."
+    table = [0] * 64
+    for index, bonus in enumerate(rows):
+        grid_x, grid_y = index % 8, index // 8 # Cell of the bonus, as seen by the player
+        square = square_index(grid_x, grid_y)
+        table[square if color == WHITE else square ^ 56] = bonus # Flipping the rank mirrors the board for the enemy
+    return table
+
+
+# Value of each piece of each color on each square, material included, indexed by color, piece type and square
+PIECE_SQUARE_VALUES = [[[PIECE_VALUES[piece_type] + bonus for bonus in _square_table(_PIECE_SQUARE_ROWS[piece_type], color)]
+                        for piece_type in range(len(PIECE_NAMES))] for color in (WHITE, BLACK)]
+
+
+def evaluate(position):
+    "Returns the score of a position in centipawns, seen from the side to move"
+    score = 0
+    for piece_type in range(len(PIECE_NAMES)):
+        white_values = PIECE_SQUARE_VALUES[WHITE][piece_type]
+        for square in iterate_squares(position.bitboards[WHITE][piece_type]):
+            score += white_values[square]
+        black_values = PIECE_SQUARE_VALUES[BLACK][piece_type]
+        for square in iterate_squares(position.bitboards[BLACK][piece_type]):
+            score -= black_values[square]
+    return score if position.side_to_move == WHITE else -score
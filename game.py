@@ -6,31 +6,60 @@
    and detecting any user event that happens while playing.
 """
 import pygame
-pygame.init() # Init pygame to access its content
-from tkinter import messagebox # Import messagebox from tkinter 
 from board import * # The board.py script contains a Board class which represent the graphical board for the game
 from piece import * # The piece.py script contains a GamePiece class which allows to add a piece (pawn, king,...) to the game
+from position import * # The position.py script contains a Position class which stores the pieces as bitboards
+from sprites import build_atlas, piece_image_path # The sprites.py script shares the images of the pieces between all GamePiece objects
+from rules import * # The rules.py script contains the rules of chess, which work without any window
+from search import MAX_PLY, format_score # The search.py script contains the search which lets the computer play
+from engine_worker import * # The engine_worker.py script runs the search in the background, so the window keeps responding
+from opening_book import OpeningBook # The opening_book.py script gives the computer its moves in the opening without searching
+from tablebase import Tablebases, describe # The tablebase.py script gives the exact result of the small endgames
+from instrumentation import get_logger, metrics # The instrumentation.py script logs the messages of the game and measures where the time goes
 import os
+import time
+
+logger = get_logger("game") # Messages of the game, which are off by default
 
 win_width = 600 # The width of a game window
 win_height = 600 # The height of a game window
 
+engine_move_time = 1.0 # Time the computer thinks about each move, in seconds
+engine_hash_mb = 16 # Size of the transposition table of the computer, in megabytes
+opening_book_path = "book.bin" # Book of opening moves of the computer, built with opening_book.py. The computer searches every move if the file doesn't exist.
+frame_rate = 60 # Highest number of frames drawn in a second while the computer thinks
+idle_wait = True # When nothing happens, wait for the next event instead of drawing frames, so a game waiting for the player uses almost no CPU
+show_performance = False # Show the frames per second and the CPU use of the window in its caption. F3 shows or hides them during the game.
+performance_period = 1.0 # Time between two measures of the frames per second and the CPU use, in seconds
+ponder = True # The computer keeps searching while the player thinks, on the reply it expects, and answers at once if the player plays it
+tablebase_directory = "tablebases" # Endgame tablebases generated with tablebase.py. The endgames are searched like the rest of the game if the directory doesn't exist.
+
 
 
 
 
 def ask_quit():
     "Ask the player if he wants to quit the game and returns a boolean"
+    from tkinter import messagebox # Import messagebox from tkinter only when a dialog box is needed, so the game logic can be imported without tkinter
     # Ask the player if he wants to quit
     quit = messagebox.askyesno("Do you really want to quit ?", "If you quit the game, all progress will be lost. Are you sure you want to do this ?")
 
     return quit # Return the player's answer as a boolean
 
+def ask_replay():
+    "Ask the player if he wants to play a new game and returns a boolean"
+    from tkinter import messagebox # Import messagebox only when the dialog box is shown, so tkinter isn't loaded before the first frame
+    return messagebox.askyesno("Replay ?", "Do you want to replay ?")
+
 class Game:
     def __init__(self):
         "The Game class represents an instance of the game which is independent of the others."
         self.window = pygame.display.set_mode((win_width, win_height)) # Create a game window with the win_width, win_height dimensions
-        pygame.display.set_caption("Chess !") # Set a caption for the game window
+        self.caption = "Chess !" # Caption of the window, without the performance readout
+        self.show_performance = show_performance # Show the frames per second and the CPU use in the caption
+        self.performance_readout = "" # Last measure of the frames per second and the CPU use
+        self.clock = pygame.time.Clock() # Limits the number of frames drawn in a second
+        self.set_caption("Chess !") # Set a caption for the game window
 
         self.grid = [[0,0,0,0,0,0,0,0],
                      [0,0,0,0,0,0,0,0],
@@ -39,10 +68,26 @@ class Game:
                      [0,0,0,0,0,0,0,0],
                      [0,0,0,0,0,0,0,0],
                      [0,0,0,0,0,0,0,0],
-                     [0,0,0,0,0,0,0,0]] # The grid which represent the game board for the program. Here, 0 means a cell is empty. Eeach list in the grid represent a row.
+                     [0,0,0,0,0,0,0,0]] # The grid which gives the dimensions of the game board. Eeach list in the grid represent a row.
     
+        self.position = Position() # The bitboard position which stores the pieces on the board. Pieces update it when they are placed or moved.
+
+        self.board = Board(self.window, self.grid, self.position) # Create a new graphical game board
 
-        self.board = Board(self.window, self.grid) # Create a new graphical game board
+        build_atlas(PIECE_NAMES, [(255,255,255), (76,39,40)]) # Load the image of each piece once, color it for both sides, and pack everything in a single surface
+
+        has_tablebases = os.path.isdir(tablebase_directory)
+        self.engine = EngineWorker(hash_mb=engine_hash_mb, tablebase_directory=tablebase_directory if has_tablebases else None) # The background search which plays the enemy's pieces. Its tables are kept during the whole game.
+        self.engine_job = None # Id of the search job the game waits for, or None if the computer isn't thinking
+        self.engine_color = BLACK # The side played by the computer, or None to let the player move both sides
+        self.engine_time = engine_move_time # Time budget of the computer for each move, in seconds
+        self.engine_depth = MAX_PLY - 1 # Depth limit of the computer for each move
+        self.engine_start = None # Time at which the computer started looking for its move, to measure how long the player waits
+        self.ponder_job = None # Id of the job searching while the player thinks, or None if the computer isn't pondering
+        self.ponder_move = None # Reply of the player which the ponder job expects
+        self.book = OpeningBook(opening_book_path) if os.path.exists(opening_book_path) else None # Opening moves of the computer, or None without a book
+        self.tablebases = Tablebases(tablebase_directory) if has_tablebases else None # Exact results of the small endgames, shown in the caption
+        self.result = None # (result, reason) tuple once the game is over, such as ('1-0', 'checkmate'), or None while it goes on
 
 
     def spawn_player_pieces(self):
@@ -139,8 +184,286 @@ class Game:
         "Place game pieces on the board"
         self.spawn_player_pieces() # Spawn the pieces of the player
         self.spawn_enemy_pieces() # Spawn the pieces of the enemy
-           
-            
+        self.position.side_to_move = WHITE # The player plays first
+        self.position.castling_rights = ALL_CASTLING_RIGHTS # No piece moved yet, so every castling is available
+        self.position.refresh_hash() # The hash must include the side to move and the castling rights
+
+
+    def pieces_of_side(self, color):
+        "Returns the list of the pieces of a side"
+        return self.player_pieces if color == WHITE else self.enemy_pieces
+
+
+    def play_move(self, piece, move):
+        """Play a legal move: apply it to the bitboard position with the rules engine, then move the pieces on the screen.
+        - piece is the GamePiece which moves
+        - move is a Move given by the rules engine
+        Returns the list of the cells which changed, so only them have to be redrawn."""
+        color = self.position.side_to_move # The side which plays the move
+        changed_cells = [square_coordinates(move.from_square), square_coordinates(move.to_square)] # Cells which must be redrawn
+        captured_square = None # Square of the captured piece, if there is one
+        if move.flags & EN_PASSANT: # The captured pawn stands behind the target cell
+            captured_square = move.to_square - PAWN_PUSH[color]
+        elif move.flags & CAPTURE:
+            captured_square = move.to_square
+
+        if captured_square is not None: # Remove the captured piece from the screen
+            captured_piece = self.board.piece_at_cell(square_coordinates(captured_square)) # Found with the square index of the board
+            captured_piece.remove()
+            changed_cells.append(square_coordinates(captured_square))
+
+        if move.flags & CASTLING: # The rook moves with the king
+            rook_square, rook_target = CASTLING_ROOK_MOVES[move.to_square]
+            rook = self.board.piece_at_cell(square_coordinates(rook_square))
+            rook.move_to(*square_coordinates(rook_target))
+            changed_cells += [square_coordinates(rook_square), square_coordinates(rook_target)]
+
+        make_move(self.position, move) # Update the bitboard position, and remember the move so it can be taken back
+        piece.move_to(*square_coordinates(move.to_square)) # Move the piece on the screen
+        if move.promotion is not None: # The pawn becomes a new piece
+            piece.promote(PIECE_NAMES[move.promotion])
+        self.check_game_end() # The rules are checked after every move
+        return changed_cells
+
+
+    def create_piece(self, color, piece_type):
+        "Creates a GamePiece of a side and a type, without placing it on the board"
+        if color == WHITE:
+            return GamePiece(window=self.window, board=self.board, name=PIECE_NAMES[piece_type], color=(255,255,255), direction=1, image_path=piece_image_path(PIECE_NAMES[piece_type]), group=self.player_pieces)
+        return GamePiece(window=self.window, board=self.board, name=PIECE_NAMES[piece_type], color=(76,39,40), direction=-1, image_path=piece_image_path(PIECE_NAMES[piece_type]), group=self.enemy_pieces)
+
+
+    def sync_pieces(self):
+        "Creates the pieces on the screen again from the bitboard position, for example after a move was taken back"
+        self.player_pieces.clear()
+        self.enemy_pieces.clear()
+        self.board.piece_index = [None] * 64
+        for square, piece in enumerate(self.position.mailbox): # For each occupied square of the position
+            if piece is not None:
+                game_piece = self.create_piece(piece[0], piece[1])
+                game_piece.show_at(*square_coordinates(square)) # Only show the piece, since the position already has it
+                self.pieces_of_side(piece[0]).append(game_piece)
+
+
+    def take_back(self):
+        """Takes back the last move. If the computer plays a side, the moves are taken back until the player must play again.
+           Returns True if a move was taken back."""
+        if not self.position.history: # No move was played yet
+            return False
+        self.cancel_engine() # The computer mustn't play a move for a position which no longer exists
+        unmake_move(self.position) # Revert the move in constant time with the undo stack
+        while self.position.history and self.position.side_to_move == self.engine_color: # Also take back the computer's reply
+            unmake_move(self.position)
+        self.sync_pieces()
+        self.result = None # A finished game goes on after a take back
+        self.show_idle_caption()
+        return True
+
+
+    def start_engine(self):
+        """Asks the background worker to search the current position for the computer's move.
+           If the computer was pondering on the move the player just played, its search goes on instead, with the work already done."""
+        self.engine_start = time.perf_counter()
+        if self.ponder_job is not None:
+            if self.position.history and self.position.history[-1].move == self.ponder_move: # The player played the expected move
+                self.engine.ponderhit()
+                self.engine_job, self.ponder_job = self.ponder_job, None
+                metrics.count("ponder_hits")
+                self.set_caption("Chess ! - The computer is thinking...")
+                return
+            self.stop_pondering()
+            metrics.count("ponder_misses")
+        self.engine_job = self.engine.think(self.position, time_limit=self.engine_time, max_depth=self.engine_depth)
+        self.set_caption("Chess ! - The computer is thinking...")
+
+
+    def start_pondering(self, pv):
+        """Searches, while the player thinks, the position after the reply the computer expects: the second move of its principal variation.
+           Nothing is done if pondering is off, if the game is over, or if the search didn't see that far."""
+        if not ponder or self.result is not None or len(pv) < 2 or pv[1] not in legal_moves(self.position):
+            return
+        self.ponder_move = pv[1]
+        position = self.position.copy()
+        make_move(position, self.ponder_move)
+        self.ponder_job = self.engine.think(position, time_limit=self.engine_time, max_depth=self.engine_depth, ponder=True)
+        logger.debug("Computer ponders on %s", move_to_uci(self.ponder_move))
+
+
+    def stop_pondering(self):
+        "Drops the search made while the player thinks, if any"
+        if self.ponder_job is not None:
+            self.engine.cancel()
+            self.ponder_job = None
+            self.ponder_move = None
+
+
+    def play_book_move(self):
+        """Plays a move of the opening book for the computer, if the current position is in the book.
+           Returns the list of the cells which changed, which is empty if the computer must search its move."""
+        if self.book is None:
+            return []
+        move = self.book.pick(self.position)
+        if move is None: # The game left the book
+            return []
+        logger.info("Computer played %s from the opening book", move_to_uci(move))
+        return self.play_move(self.board.piece_at_cell(square_coordinates(move.from_square)), move)
+
+
+    def set_caption(self, caption):
+        "Sets the caption of the window, followed by the performance readout if it's shown"
+        self.caption = caption
+        if self.show_performance and self.performance_readout:
+            caption += f" - {self.performance_readout}"
+        pygame.display.set_caption(caption)
+
+
+    def measure_performance(self, frames, elapsed, cpu_time):
+        """Updates the performance readout from the frames drawn during a period.
+        - elapsed is the duration of the period and cpu_time the CPU time used by the window during it, in seconds"""
+        self.performance_readout = f"{frames / elapsed:.0f} fps, CPU {cpu_time / elapsed:.0%}"
+        logger.debug("Performance: %s", self.performance_readout)
+        if self.show_performance:
+            self.set_caption(self.caption)
+
+
+    def is_idle(self):
+        "Returns True if nothing can change on the screen until the player does something"
+        return idle_wait and self.engine_job is None and (self.result is not None or self.position.side_to_move != self.engine_color)
+
+
+    def wait_for_events(self):
+        """Returns the events of the next frame. When the game is idle, it waits for the next event without using the CPU.
+           Otherwise, it waits just enough to keep the frame rate under its limit."""
+        if self.is_idle():
+            if self.show_performance: # Wake up regularly to keep the readout up to date
+                events = [pygame.event.wait(int(performance_period * 1000))]
+            else:
+                events = [pygame.event.wait()]
+            return events + pygame.event.get()
+        self.clock.tick(frame_rate)
+        return pygame.event.get()
+
+
+    def show_idle_caption(self):
+        "Shows the normal caption of the window, with the check and the exact result of the position if the tablebases cover it"
+        caption = "Chess !"
+        if MoveFilter(self.position).checkers: # The king of the side to move is attacked
+            caption += " - Check !"
+        probe_result = self.tablebases.probe(self.position) if self.tablebases is not None else None
+        if probe_result is not None:
+            caption += f" - Tablebase: {describe(self.position, probe_result)}"
+        self.set_caption(caption)
+
+
+    def check_game_end(self):
+        """Ends the game if the rules say it's over: checkmate, stalemate, fifty-move rule, threefold repetition or insufficient material.
+           The result is shown in the caption, and the computer stops playing."""
+        self.result = game_result(self.position)
+        if self.result is None:
+            if self.engine_job is None: # The caption of the computer's search is kept while it thinks
+                self.show_idle_caption()
+            return
+        self.cancel_engine()
+        result, reason = self.result
+        if result == "1/2-1/2":
+            text = f"Draw by {reason}"
+        else:
+            winner = WHITE if result == "1-0" else BLACK
+            if self.engine_color is None:
+                text = f"Checkmate, {'white' if winner == WHITE else 'black'} wins"
+            else:
+                text = "Checkmate, the computer wins" if winner == self.engine_color else "Checkmate, you win"
+        self.set_caption(f"Chess ! - {text} !")
+        logger.info("Game over: %s by %s", result, reason)
+
+
+    def cancel_engine(self):
+        "Cancels the search of the computer, if it's thinking or pondering"
+        self.stop_pondering()
+        if self.engine_job is not None:
+            self.engine.cancel()
+            self.engine_job = None
+            self.show_idle_caption()
+
+
+    def check_engine(self):
+        """Checks the messages of the background worker without waiting.
+           Returns the list of the cells which changed if the computer played its move."""
+        changed_cells = []
+        for message in self.engine.poll():
+            if message[1] != self.engine_job: # A message from an old job
+                continue
+            if message[0] == PROGRESS: # Show the progress of the search in the caption of the window
+                report = message[2]
+                self.set_caption(f"Chess ! - The computer is thinking... depth {report['depth']}, {format_score(report['score'])}, {report['nps']:,.0f} nodes/s")
+            elif message[0] == BEST_MOVE:
+                move, summary = message[2], message[3]
+                logger.info("Computer searched depth %d in %.2f s, %d nodes (%.0f nodes/s), score %s",
+                            summary['depth'], summary['seconds'], summary['nodes'], summary['nps'], format_score(summary['score']))
+                metrics.count("nodes_searched", summary['nodes']) # The search runs in another process, which has its own metrics
+                metrics.record("engine_response", time.perf_counter() - self.engine_start) # Time the player waited for the move
+                self.engine_job = None
+                if move is not None: # If the computer isn't checkmated or stalemated
+                    changed_cells += self.play_move(self.board.piece_at_cell(square_coordinates(move.from_square)), move) # Also shows the new caption
+                    self.start_pondering(summary['pv'])
+                else:
+                    self.show_idle_caption()
+        return changed_cells
+
+
+    def piece_at_cell(self, cell):
+        "Returns the piece standing on a cell of the grid, or None if the cell is free"
+        return self.board.piece_at_cell(cell) # Constant time lookup in the square index of the board
+
+
+    def draw_everything(self, highlighted_cells):
+        "Draws the whole board, the highlighted cells and all the pieces"
+        self.board.draw_squares() # Draw the cached board
+        for cell_pos in highlighted_cells: # Highlight each cell on which the selected piece can move
+            self.board.highlight_square(cell_pos)
+        for piece in self.player_pieces + self.enemy_pieces: # Draw all the pieces
+            piece.draw()
+
+
+    def redraw_cells(self, cells, highlighted_cells):
+        """Redraws only some cells of the board, with their highlight and the piece standing on them.
+        - cells is the list of the cells to redraw, as (grid_x, grid_y) tuples
+        - highlighted_cells is the list of the cells on which the selected piece can move"""
+        for cell in set(cells): # Each cell is redrawn only once
+            self.board.restore_cell(cell) # Repaint the square from the cached background
+            if cell in highlighted_cells:
+                self.board.highlight_square(cell)
+            piece = self.piece_at_cell(cell)
+            if piece is not None:
+                piece.draw()
+
+
+    def start(self):
+        "Places the pieces and draws the first frame of the game"
+        self.place_pieces()
+        self.result = None
+        self.draw_everything([]) # The whole window is drawn once, then only the cells which change are redrawn
+        pygame.display.flip()
+
+
+    def reset(self):
+        """Prepares a new game in the same window. The window, the images of the pieces, the opening book, the tablebases
+           and the background worker, with its transposition table, are kept, so a new game starts without loading anything again."""
+        self.cancel_engine()
+        self.position.clear() # The board and the pieces share this position, so it's emptied instead of being replaced
+        self.board.piece_index = [None] * 64
+        self.player_pieces = []
+        self.enemy_pieces = []
+        self.set_caption("Chess !")
+
+
+    def close(self):
+        "Stops the background worker and closes the files of the game, once no more games will be played"
+        self.engine.close()
+        if self.book is not None:
+            self.book.close()
+        if self.tablebases is not None:
+            self.tablebases.close()
 
 
     def run(self): 
@@ -149,57 +472,77 @@ class Game:
                        # otherwise it stops.
 
 
-        self.place_pieces()
-
-        print(f"Piece at position {(7, 6)} :", identify_piece_by_position(position=(7,6), pieces_list=self.player_pieces, return_object=True))
+        self.start()
 
         #piece = GamePiece(self.window, board=self.board, name="king", color=(255,255,255), image_path="assets/images/king.jpg")          
         #piece.set_position(1,7)   
 
-        player_move = pygame.USEREVENT + 1 # Event which allow the player to move a piece
-        pygame.time.set_timer(player_move, 100) # The player_move event will occur every 100 milliseconds  
 
+        selected_piece = None # The piece selected by the player
+        possible_cells = [] # List of cells where the selected piece can move to
+
+        period_start, period_cpu, period_frames = time.perf_counter(), time.process_time(), 0 # Start of the measure of the performance
         while running: # While the game is still running
+            events = self.wait_for_events() # Wait for something to happen, without spinning
+            frame_start = time.perf_counter()
+            period_frames += 1
+            if frame_start - period_start >= performance_period:
+                self.measure_performance(period_frames, frame_start - period_start, time.process_time() - period_cpu)
+                period_start, period_cpu, period_frames = frame_start, time.process_time(), 0
+
+            changed_cells = [] # Cells which must be redrawn during this frame
             
-            self.window.fill((255, 255, 255)) # Fill the window
-            
-            self.board.draw_squares() # Draw the squares of the board
+            keys = pygame.key.get_pressed() # Get the keys pressed by the player
+            for event in events: # Handle any event that happened since the last frame
+                if event.type == pygame.QUIT: # If the player wants to stop playing
+                    if self.result is not None or ask_quit(): # If the game is over, or if the player confirmed his choice
+                        running = False 
+                    self.draw_everything(possible_cells) # The dialog box may have hidden the window
 
 
+                elif event.type == pygame.KEYDOWN and (event.key == pygame.K_BACKSPACE or (event.key == pygame.K_z and event.mod & pygame.KMOD_CTRL)): # Backspace or Ctrl+Z takes back the last move
+                    if self.take_back():
+                        selected_piece = None
+                        possible_cells = []
+                        self.draw_everything(possible_cells)
 
-            
-            mouse_position = pygame.mouse.get_pos() # Get the position of the mouse
-            #print(f"Mouse position : {mouse_position}")
 
-            mouse_rect = pygame.Rect(mouse_position[0], mouse_position[1], 1, 1) # Create a Rect object representing the rect of the mouse based on its position
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_SPACE: # Space asks the computer to play its best move now
+                    if self.engine_job is not None:
+                        self.engine.move_now()
+
+
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3: # F3 shows or hides the frames per second and the CPU use
+                    self.show_performance = not self.show_performance
+                    self.set_caption(self.caption)
 
-            keys = pygame.key.get_pressed() # Get the keys pressed by the player
-            for event in pygame.event.get(): # Capture any event that happens during the game
-                if event.type == pygame.QUIT: # If the player wants to stop playing
-                    if ask_quit(): # If the player confirmed his choice
-                        running = False 
+
+                elif event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED): # If the window must be drawn again, for example after being hidden
+                    self.draw_everything(possible_cells)
 
 
                 elif event.type == pygame.MOUSEBUTTONDOWN: # If the player clicked a button of the mouse
-                        print("Player clicked a button of the mouse")
-                        print(f"Mouse rect : {mouse_rect}")
+                        logger.debug("Player clicked a button of the mouse at %s", event.pos)
+                        changed_cells += possible_cells # The previous highlights must be erased
+                        clicked_cell = self.board.cell_at_pixel(event.pos) # The cell under the mouse, found with a division
+                        moved = False # Becomes True if the click played a move
+                        if selected_piece is not None and clicked_cell in possible_cells: # If the player clicked a cell on which the selected piece can move
+                            move = find_move(self.position, square_index(*selected_piece.get_position()), square_index(*clicked_cell)) # Find the move of the rules engine which goes to this cell
+                            changed_cells += self.play_move(selected_piece, move) # Move the piece to this cell
+                            moved = True
+
+                        selected_piece = None
                         possible_cells = [] # List of cells where a piece selected by the player can move to
-                        for piece in self.player_pieces: # For each piece of the player
-                            if pygame.Rect.colliderect(piece.rect, mouse_rect): # If the mouse is in collision with the piece
-                                selected_piece = identify_piece_by_rect(rect=piece.rect, pieces_list=self.player_pieces, return_object=True) # Identify the selected piece by its rect and return the corresponding usable object
-                                print(f"The player clicked on {selected_piece}") 
+                        if not moved and clicked_cell is not None:
+                            piece = self.board.piece_at_cell(clicked_cell) # The piece under the mouse
+                            if piece is not None and self.result is None and piece.side == self.position.side_to_move and piece.side != self.engine_color: # Only the pieces of the side which must play can be selected, unless the computer plays them
+                                selected_piece = piece
+                                logger.debug("The player clicked on %s", selected_piece)
                                 possible_cells = piece.calculate_moves() # Get the position of the cells to which the piece can move
+                                changed_cells += possible_cells # The new highlights must be drawn
 
 
-                                print(f"{piece.name} can move to {possible_cells}")
-
-                        for cell_pos in possible_cells: # For each cell on which the selected piece can move
-                                print(cell_pos)
-
-                                self.board.draw_on_square(width=80, height=50, color=(255,184,89), square_pos=cell_pos)
-                                cell_rect = pygame.Rect(cell_pos, (self.board.square_size, self.board.square_spacing)) # Create a rect object for the cell 
-                                if pygame.mouse.get_pressed() and pygame.Rect.colliderect(cell_rect, mouse_rect): # If the mouse is in collision with the cell
-                                    piece.set_position(cell_pos[0], cell_pos[1]) # Move the piece to this cell
+                                logger.debug("%s can move to %s", piece.name, possible_cells)
 
 
                 """if keys[pygame.K_UP] or keys[pygame.K_z] and event.type == player_move: # If the player presses the up arrow key or the Z key
@@ -216,15 +559,29 @@ class Game:
                 """
 
 
-            for piece in self.player_pieces: # For each piece of the player
-                    piece.draw() # Draw the piece
-            
-            for piece in self.enemy_pieces: # For each piece of the enemy
-                piece.draw() # Draw the piece    
+            if changed_cells: # Only redraw the cells touched by a move or a highlight
+                self.redraw_cells(changed_cells, possible_cells)
+
+            self.board.update_display() # Send only the changed parts of the window to the screen
+
+            if running and self.result is None and self.engine_job is None and self.position.side_to_move == self.engine_color: # The computer starts thinking once the player's move is on the screen
+                book_cells = self.play_book_move() if self.ponder_job is None else [] # No need to search a move of the opening book. The computer only ponders once out of the book.
+                if book_cells:
+                    self.redraw_cells(book_cells, possible_cells)
+                    self.board.update_display()
+                else:
+                    self.start_engine()
+
+            if self.engine_job is not None: # Check if the computer found its move, without waiting for it
+                engine_cells = self.check_engine()
+                if engine_cells:
+                    self.redraw_cells(engine_cells, possible_cells)
+                    self.board.update_display()
 
-            #piece.draw()
+            metrics.record("frame", time.perf_counter() - frame_start) # Time spent drawing the frame, without the wait
 
-            pygame.display.flip() # Update the display                    
+        self.cancel_engine() # The worker is kept for the next game, but mustn't keep searching this one
+        logger.info("Metrics of the game:\n%s", metrics.report())
 
 
 
@@ -0,0 +1,180 @@
+"""instrumentation.py contains the logging and the measures of the game, to see where the time goes without slowing it down.
+   - The messages of the game go to loggers named "chesspy.<module>". They are off by default, and are turned on
+     with the CHESSPY_LOG environment variable (for example CHESSPY_LOG=debug) or with configure_logging.
+   - metrics holds counters (move generations, nodes searched, images loaded,...) and timers (frame time,...),
+     which cost a dictionary update each and can be printed with metrics.report().
+   - A profiler can be started with the CHESSPY_PROFILE environment variable or with start_profiling: "cprofile" records
+     every call with cProfile, and "sample" looks at the running function of the main thread every few milliseconds,
+     which costs much less. The report is logged and written to a file when stop_profiling is called.
+
+   Example :
+       CHESSPY_LOG=debug CHESSPY_PROFILE=sample python main.py
+"""
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+LOGGER_NAME = "chesspy" # Parent of the loggers of every module
+LOG_ENVIRONMENT_VARIABLE = "CHESSPY_LOG" # Level of the messages shown, such as "debug" or "info"
+PROFILE_ENVIRONMENT_VARIABLE = "CHESSPY_PROFILE" # Profiler started with the game: "cprofile" or "sample"
+PROFILE_OUTPUT = "profile.txt" # File in which the report of the profiler is written
+SAMPLE_INTERVAL = 0.005 # Time between two samples of the sampling profiler, in seconds
+
+logging.getLogger(LOGGER_NAME).addHandler(logging.NullHandler()) # Nothing is shown until logging is configured
+
+
+def get_logger(module_name):
+    "Returns the logger of a module, such as get_logger('board') for the messages of board.py"
+    return logging.getLogger(f"{LOGGER_NAME}.{module_name}")
+
+
+def configure_logging(level=None):
+    """Shows the messages of the game on the error output, from a level such as "debug", "info" or "warning".
+       The level is read from the CHESSPY_LOG environment variable if it isn't given. Nothing is done without any level."""
+    level = level or os.environ.get(LOG_ENVIRONMENT_VARIABLE)
+    if not level:
+        return
+    os.environ[LOG_ENVIRONMENT_VARIABLE] = level # The processes started later, such as the search worker, use the same level
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(level.upper())
+    if not any(isinstance(handler, logging.StreamHandler) for handler in logger.handlers):
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(relativeCreated)8.0f ms %(name)s %(levelname)s: %(message)s"))
+        logger.addHandler(handler)
+
+
+class Metrics:
+    """The Metrics class holds named counters and timers.
+       - counters gives the value of each counter
+       - timers gives the [count, total seconds, longest seconds] of each timer"""
+    def __init__(self):
+        "Init the metrics with every counter and timer at zero"
+        self.counters = Counter()
+        self.timers = {}
+
+    def count(self, name, amount=1):
+        "Adds an amount to a counter"
+        self.counters[name] += amount
+
+    def record(self, name, seconds):
+        "Adds a measured duration to a timer"
+        timer = self.timers.get(name)
+        if timer is None:
+            self.timers[name] = [1, seconds, seconds]
+        else:
+            timer[0] += 1
+            timer[1] += seconds
+            if seconds > timer[2]:
+                timer[2] = seconds
+
+    @contextmanager
+    def timer(self, name):
+        "Measures the duration of a with block and adds it to a timer"
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def reset(self):
+        "Set every counter and timer back to zero"
+        self.counters.clear()
+        self.timers.clear()
+
+    def report(self):
+        "Returns the counters and the timers as readable lines"
+        lines = [f"{name}: {value:,}" for name, value in sorted(self.counters.items())]
+        for name, (count, total, longest) in sorted(self.timers.items()):
+            lines.append(f"{name}: {count:,} times, {total:.3f} s in total, {total / count * 1000:.3f} ms on average, {longest * 1000:.3f} ms at most")
+        return "\n".join(lines)
+
+
+metrics = Metrics() # The metrics of the process
+
+
+class SamplingProfiler:
+    """The SamplingProfiler class counts which function the main thread is running, every interval seconds, from a background thread.
+       - interval is the time between two samples, in seconds"""
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        "Init the profiler without starting it"
+        self.interval = interval
+        self.samples = Counter() # Number of samples of each (file, line, function)
+        self.running = False
+        self.thread = None
+        self.main_thread_id = threading.main_thread().ident
+
+    def start(self):
+        "Start taking samples"
+        self.running = True
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+        self.thread.start()
+
+    def _sample(self):
+        "Take samples until the profiler is stopped"
+        while self.running:
+            frame = sys._current_frames().get(self.main_thread_id)
+            if frame is not None:
+                code = frame.f_code
+                self.samples[(os.path.basename(code.co_filename), frame.f_lineno, code.co_name)] += 1
+            time.sleep(self.interval)
+
+    def stop(self):
+        "Stop taking samples"
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+    def report(self, limit=30):
+        "Returns the places where the main thread was found the most often, as readable lines"
+        total = sum(self.samples.values()) or 1
+        return "\n".join(f"{count / total:6.1%} {count:6} samples  {file_name}:{line} {function}"
+                         for (file_name, line, function), count in self.samples.most_common(limit))
+
+
+_profiler = None # The profiler running, if any
+
+
+def start_profiling(kind=None):
+    """Start a profiler: "cprofile" or "sample". The kind is read from the CHESSPY_PROFILE environment variable if it isn't given.
+       Nothing is done without any kind."""
+    global _profiler
+    kind = kind or os.environ.get(PROFILE_ENVIRONMENT_VARIABLE)
+    if not kind or _profiler is not None:
+        return
+    if kind == "sample":
+        _profiler = SamplingProfiler()
+    else:
+        _profiler = cProfile.Profile()
+    get_logger("instrumentation").info("%s profiler started", kind)
+    if isinstance(_profiler, cProfile.Profile):
+        _profiler.enable()
+    else:
+        _profiler.start()
+
+
+def stop_profiling(output_path=PROFILE_OUTPUT):
+    "Stop the profiler, if one is running, and write its report, followed by the metrics, to a file. Returns the path of the file, or None."
+    global _profiler
+    if _profiler is None:
+        return None
+    if isinstance(_profiler, cProfile.Profile):
+        _profiler.disable()
+        stream = io.StringIO()
+        pstats.Stats(_profiler, stream=stream).sort_stats("cumulative").print_stats(40)
+        report = stream.getvalue()
+    else:
+        _profiler.stop()
+        report = _profiler.report()
+    _profiler = None
+    with open(output_path, "w", encoding="utf-8") as output:
+        output.write(report + "\n\nMetrics:\n" + metrics.report() + "\n")
+    get_logger("instrumentation").info("profile written to %s", output_path)
+    return output_path
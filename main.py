@@ -1,32 +1,89 @@
 """main.py is the starting point for the game.
-   It starts a first game, and when finished, it enters a loop which allows the player to play as many times as they want."""
+   It starts a first game, and when finished, it enters a loop which allows the player to play as many times as they want.
+   The window, the images of the pieces and the background worker are created once and reused by every new game.
+
+   Options :
+       --log LEVEL          Show the messages of the game from a level such as debug or info (same as the CHESSPY_LOG environment variable)
+       --profile KIND       Profile the game with cprofile or sample, and write the report to profile.txt (same as CHESSPY_PROFILE)
+       --benchmark N        Measure the time to the first frame and the time to start a new game N times, without playing, then quit
+       --uci                Speak the UCI protocol on the standard input and output instead of opening a window (see uci.py)
+"""
+import time
+launch_time = time.perf_counter() # Start of the program, to measure the time to the first frame
+import argparse
+import os
+import sys
+
+
+parser = argparse.ArgumentParser(description="Play chess against the computer.")
+parser.add_argument("--log", default=None, help="show the messages of the game from this level: debug, info, warning,...")
+parser.add_argument("--profile", default=None, choices=["cprofile", "sample"], help="profile the game and write the report to profile.txt")
+parser.add_argument("--benchmark", type=int, default=None, metavar="N", help="measure the time to the first frame and to start a new game N times, then quit")
+parser.add_argument("--uci", action="store_true", help="speak the UCI protocol on the standard input and output, without any window")
+options = parser.parse_args() # The options are read before pygame is loaded, so --help answers at once
+if options.uci: # The window isn't needed, so pygame isn't even loaded
+    from instrumentation import configure_logging
+    configure_logging(options.log)
+    import uci
+    sys.exit(uci.main([]))
+if options.benchmark is not None:
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy") # The benchmark doesn't need a visible window, unless a video driver is given
+
 import pygame # Import pygame to ensure all required functionalities are present
-pygame.init() # Init pygame
+pygame.display.init() # Only the display is needed: it also gives the events, the keyboard and the clock. pygame.init() would also open the sound device and the joysticks, which the game doesn't use.
 from game import * # Import game.py, which is the script that handles the logic of the game
-from tkinter import messagebox # We'll use the messagebox module from tkinter to display dialog boxes to the player
+from instrumentation import configure_logging, start_profiling, stop_profiling # Import instrumentation.py to turn on the logging and the profiler
+import sprites # Import sprites.py to empty the cache of the images when the benchmark starts games from scratch
 
+configure_logging(options.log)
+start_profiling(options.profile)
 
 
-# Let's start and run a first game immediatly
-game = Game()
-game.run() 
-pygame.quit() # Quit pygame
+def benchmark(replays):
+    """Prints the time from the start of the program to the first frame, then the time to start a new game in the same window,
+       and, to compare, the time to start it by quitting pygame and creating a new Game as the previous versions did."""
+    game = Game()
+    game.start()
+    first_frame = time.perf_counter() - launch_time
+    reused, rebuilt = [], []
+    for replay in range(replays):
+        start = time.perf_counter()
+        game.reset()
+        game.start()
+        reused.append(time.perf_counter() - start)
+    game.close()
+    for replay in range(replays):
+        start = time.perf_counter()
+        pygame.quit()
+        sprites.clear_cache() # The previous versions loaded and colored the images of the pieces again with each new game
+        pygame.init()
+        game = Game()
+        game.start()
+        rebuilt.append(time.perf_counter() - start)
+        game.close()
+    print(f"first frame: {first_frame * 1000:.1f} ms after the start of the program")
+    if replays:
+        print(f"new game in the same window: {sum(reused) / replays * 1000:.1f} ms on average, {max(reused) * 1000:.1f} ms at most")
+        print(f"new game with a new window: {sum(rebuilt) / replays * 1000:.1f} ms on average, {max(rebuilt) * 1000:.1f} ms at most")
 
 
-# After the first game has ended, enter a loop to allow the player to replay
+if options.benchmark is not None:
+    benchmark(options.benchmark)
 
-while True:
-    replay = messagebox.askyesno("Replay ?", "Do you want to replay ?") # Ask the player if he wants to play a new game
-    if replay: # If the player answered 'yes'
-        # Start a new game
-        pygame.init()
-        game = Game() 
+else:
+    # Let's start and run a first game immediatly
+    game = Game()
+    game.run()
+
+
+    # After the first game has ended, enter a loop to allow the player to replay
+
+    while ask_replay(): # Ask the player if he wants to play a new game
+        game.reset() # Start a new game in the same window
         game.run()
 
-    else: # If the player answered 'no'
-        pygame.quit() # Quit pygame
-        break # Break the loop and then completely stop the program    
-        
-    
+    game.close() # Stop the background worker
+pygame.quit() # Quit pygame
+
 
-    
\ No newline at end of file
+stop_profiling() # Write the report of the profiler, if one was started
@@ -0,0 +1,89 @@
+"""movegen.py generates the cells a piece can move to, based on the attack tables of attacks.py.
+   Each move type named in GamePiece.pieces_moves is handled by a function which returns a bitboard of target squares.
+"""
+from position import * # Import position.py for colors, piece types and square helpers
+from attacks import * # Import attacks.py for the precomputed attack tables
+
+
+PAWN_PUSH = [8, -8] # Square offset of a one-cell pawn push, indexed by color
+PAWN_START_RANKS = [0x000000000000FF00, 0x00FF000000000000] # Ranks on which the pawns of each color start, indexed by color
+
+# Move types of each piece type, indexed by the piece type. These are the same names as in GamePiece.pieces_moves.
+PIECE_MOVE_TYPES = [["vert-1", "vert-2", "angled-1"], # Pawn
+                    ["L"], # Knight
+                    ["angled-any"], # Bishop
+                    ["vert-any"], # Rook
+                    ["any-any"], # Queen
+                    ["any-1"]] # King
+
+
+def _vert_1_targets(position, square, color):
+    "A pawn can move vertically by one cell if that cell is free"
+    target = square + PAWN_PUSH[color]
+    if 0 <= target < 64 and position.is_free(target):
+        return SQUARE_BITS[target]
+    return 0
+
+
+def _vert_2_targets(position, square, color):
+    "A pawn which is still on its starting rank can move vertically by two cells if both cells are free"
+    if not PAWN_START_RANKS[color] & SQUARE_BITS[square]: # If the pawn already left its starting rank
+        return 0
+    first_cell = square + PAWN_PUSH[color]
+    second_cell = first_cell + PAWN_PUSH[color]
+    if position.is_free(first_cell) and position.is_free(second_cell):
+        return SQUARE_BITS[second_cell]
+    return 0
+
+
+def _angled_1_targets(position, square, color):
+    "A pawn captures an enemy piece by moving in angle by one cell, forward"
+    return PAWN_ATTACKS[color][square] & position.occupancy[color ^ 1]
+
+
+def _l_targets(position, square, color):
+    "A knight can jump to any cell of its 'L'-like move which isn't held by its own side"
+    return KNIGHT_ATTACKS[square] & ~position.occupancy[color]
+
+
+def _angled_any_targets(position, square, color):
+    "A bishop slides in angle until it meets a piece, which it can capture if it belongs to the other side"
+    return bishop_attacks(square, position.all_occupancy) & ~position.occupancy[color]
+
+
+def _vert_any_targets(position, square, color):
+    "A rook slides vertically or horizontally until it meets a piece, which it can capture if it belongs to the other side"
+    return rook_attacks(square, position.all_occupancy) & ~position.occupancy[color]
+
+
+def _any_1_targets(position, square, color):
+    "A king can move to any neighbouring cell which isn't held by its own side"
+    return KING_ATTACKS[square] & ~position.occupancy[color]
+
+
+def _any_any_targets(position, square, color):
+    "A queen slides in any direction until it meets a piece, which it can capture if it belongs to the other side"
+    return queen_attacks(square, position.all_occupancy) & ~position.occupancy[color]
+
+
+# Function which generates the targets of each move type
+MOVE_TYPE_TARGETS = {"vert-1": _vert_1_targets,
+                     "vert-2": _vert_2_targets,
+                     "angled-1": _angled_1_targets,
+                     "L": _l_targets,
+                     "angled-any": _angled_any_targets,
+                     "vert-any": _vert_any_targets,
+                     "any-1": _any_1_targets,
+                     "any-any": _any_any_targets}
+
+
+def generate_targets(position, square, color, move_types):
+    """Returns the bitboard of the squares a piece can move to.
+    - position is the Position object in which the piece stands
+    - square is the square number of the piece
+    - color is the side of the piece (WHITE or BLACK)
+    - move_types is the list of the move types available for the piece, such as ["L"] for a knight"""
+    targets = 0
+    for move_type in move_types: # For each move the piece can make
+        targets |= MOVE_TYPE_TARGETS[move_type](position, square, color)
+    return targets
@@ -0,0 +1,161 @@
+"""opening_book.py contains an OpeningBook class which gives the moves usually played in the opening, so the computer doesn't spend time searching them.
+   A book is a binary file of fixed-size records (position hash, move, weight), sorted by hash. It is read through mmap:
+   a lookup is a binary search which only touches the few pages it reads, so even a book of millions of moves answers
+   in microseconds and uses almost no memory.
+
+   Each record takes RECORD_SIZE bytes, in big-endian order: the Zobrist hash of the position (8 bytes), the key of the move
+   given by rules.move_key (2 bytes) and its weight (4 bytes). The moves of a position are all next to each other.
+
+   Examples :
+       python opening_book.py build games.pgn --output book.bin --plies 16      Build a book from the first 16 plies of the games of a PGN file
+       python opening_book.py probe book.bin --fen "<FEN>"                        List the book moves of a position
+"""
+import argparse
+import mmap
+import os
+import random
+import struct
+import sys
+import time
+from position import * # Import position.py for the Position class
+from rules import legal_moves, move_key, move_to_san # Import rules.py to turn the keys of the book back into legal moves
+from pgn import read_games, replay # Import pgn.py to read the games the book is made from
+
+
+RECORD = struct.Struct(">QHI") # Hash of the position, key of the move, weight
+RECORD_SIZE = RECORD.size
+HASH = struct.Struct(">Q") # The first field of a record, read alone during the binary search
+MAX_WEIGHT = 0xFFFFFFFF
+
+# Weight added to a move for each game, by result of the game for the side which played the move
+WIN_WEIGHT = 2
+DRAW_WEIGHT = 1
+LOSS_WEIGHT = 0
+RESULT_POINTS = {"1-0": (WIN_WEIGHT, LOSS_WEIGHT), "0-1": (LOSS_WEIGHT, WIN_WEIGHT), "1/2-1/2": (DRAW_WEIGHT, DRAW_WEIGHT), "*": (DRAW_WEIGHT, DRAW_WEIGHT)} # Indexed by color
+
+
+class OpeningBook:
+    """The OpeningBook class reads a book file through mmap.
+       - path is the path of the book file"""
+    def __init__(self, path):
+        "Open the book. Only the pages read by the lookups are loaded in memory."
+        self.path = path
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        self.record_count = size // RECORD_SIZE
+        self.memory = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else None # An empty file can't be mapped
+
+    def __len__(self):
+        "Returns the number of records of the book"
+        return self.record_count
+
+    def _first_record(self, hash_key):
+        "Returns the index of the first record whose hash is greater or equal to a hash, by binary search"
+        low, high = 0, self.record_count
+        memory = self.memory
+        while low < high:
+            middle = (low + high) // 2
+            if HASH.unpack_from(memory, middle * RECORD_SIZE)[0] < hash_key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def entries(self, hash_key):
+        "Returns the list of the (move_key, weight) tuples stored for the hash of a position"
+        entries = []
+        index = self._first_record(hash_key)
+        while index < self.record_count:
+            record_hash, key, weight = RECORD.unpack_from(self.memory, index * RECORD_SIZE)
+            if record_hash != hash_key:
+                break
+            entries.append((key, weight))
+            index += 1
+        return entries
+
+    def moves(self, position):
+        """Returns the list of the (move, weight) tuples of the book for a position, with the heaviest first.
+           The keys are matched with the legal moves, so a wrong record (such as a collision of hashes) is never returned."""
+        entries = self.entries(position.hash)
+        if not entries:
+            return []
+        weights = dict(entries)
+        moves = [(move, weights[move_key(move)]) for move in legal_moves(position) if move_key(move) in weights]
+        moves.sort(key=lambda item: item[1], reverse=True)
+        return moves
+
+    def pick(self, position, generator=random):
+        """Returns a book move for a position, picked at random with a probability proportional to its weight,
+           or None if the position isn't in the book.
+        - generator is the random number generator, for example a random.Random with a seed to replay the same games"""
+        moves = [(move, weight) for move, weight in self.moves(position) if weight > 0]
+        if not moves:
+            return None
+        return generator.choices([move for move, weight in moves], weights=[weight for move, weight in moves])[0]
+
+    def close(self):
+        "Close the book file"
+        if self.memory is not None:
+            self.memory.close()
+        self.file.close()
+
+
+def build_book(pgn_paths, output_path, max_plies=16, min_weight=1):
+    """Builds a book file from the games of PGN files and returns the number of records written.
+    - max_plies is the number of half-moves of each game added to the book
+    - min_weight drops the moves whose total weight is lower, such as moves played in a single lost game
+    The weights are counted in a dictionary, then the records are sorted and written in one pass."""
+    weights = {} # Total weight of each (hash, move key)
+    for pgn_path in pgn_paths:
+        with open(pgn_path, encoding="utf-8", errors="replace") as pgn_file:
+            for game in read_games(pgn_file):
+                points = RESULT_POINTS.get(game.result, RESULT_POINTS["*"])
+                try:
+                    for position, move in replay(game, max_plies):
+                        record = (position.hash, move_key(move))
+                        weights[record] = weights.get(record, 0) + points[position.side_to_move]
+                except IllegalValueException: # The rest of a game with a wrong move is skipped
+                    continue
+
+    records = sorted((hash_key, key, min(weight, MAX_WEIGHT)) for (hash_key, key), weight in weights.items() if weight >= min_weight)
+    with open(output_path, "wb") as book_file:
+        pack = RECORD.pack
+        book_file.write(b"".join(pack(*record) for record in records))
+    return len(records)
+
+
+def main(arguments=None):
+    "Read the command line to build a book or list the book moves of a position"
+    parser = argparse.ArgumentParser(description="Build or probe a binary opening book.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="build a book from PGN files")
+    build.add_argument("pgn", nargs="+", help="PGN files to read")
+    build.add_argument("--output", default="book.bin", help="path of the book file (default: book.bin)")
+    build.add_argument("--plies", type=int, default=16, help="number of half-moves of each game added to the book (default: 16)")
+    build.add_argument("--min-weight", type=int, default=1, help="drop the moves whose total weight is lower (default: 1)")
+    probe = commands.add_parser("probe", help="list the book moves of a position")
+    probe.add_argument("book", help="path of the book file")
+    probe.add_argument("--fen", default=START_FEN, help="position to look up, the starting position by default")
+    options = parser.parse_args(arguments)
+
+    if options.command == "build":
+        start = time.perf_counter()
+        count = build_book(options.pgn, options.output, options.plies, options.min_weight)
+        print(f"{count} records written to {options.output} in {time.perf_counter() - start:.2f} s")
+        return 0
+
+    book = OpeningBook(options.book)
+    position = Position.from_fen(options.fen)
+    start = time.perf_counter()
+    moves = book.moves(position)
+    seconds = time.perf_counter() - start
+    total = sum(weight for move, weight in moves)
+    for move, weight in moves:
+        print(f"{move_to_san(position, move):8} weight {weight:8} ({weight / total if total else 0:.1%})")
+    print(f"{len(moves)} book moves among {len(book)} records, found in {seconds * 1e6:.0f} µs")
+    book.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
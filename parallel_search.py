@@ -0,0 +1,154 @@
+"""parallel_search.py contains a ParallelSearch class which searches a position with several processes at once, to use every core of the machine.
+   It follows the Lazy SMP idea: every worker process searches the same position, and all of them share one transposition table
+   stored in shared memory. What a worker finds is read by the others through the table, so together they reach a depth sooner.
+   Helpers start at different depths, so they don't all search the same tree at the same time.
+   The table is shared without locks: each entry stores its hash mixed with its data, so an entry half-written by another process is just a miss.
+
+   Examples :
+       python parallel_search.py --workers 8 --depth 6                 Search the starting position to depth 6 with 8 processes
+       python parallel_search.py --scaling 1,2,4,8 --depth 6 --fen "<FEN>"  Report the time to depth and the speedup for each number of workers
+"""
+import argparse
+import multiprocessing
+import sys
+import time
+from position import * # Import position.py for the Position class
+from rules import move_to_uci # Import rules.py to print the moves
+from search import Search, SearchResult, MAX_PLY, format_score # Import search.py for the search each worker runs
+from transposition import TranspositionTable, entry_count_for # Import transposition.py for the shared table
+
+
+def _worker_main(worker_index, jobs, results, stop_job_id, keys, data):
+    """Main loop of a worker process: it waits for jobs and searches them, until it receives None.
+    - worker_index is the number of the worker. Worker 0 is the main worker, which follows the time budget.
+    - jobs is the queue of the jobs of this worker, as (job_id, position, time_limit, max_depth) tuples
+    - results is the queue shared by all the workers, on which (job_id, worker_index, best_move, summary) tuples are sent
+    - stop_job_id is a shared integer: the jobs whose id is lower or equal must stop
+    - keys and data are the shared arrays of the transposition table"""
+    engine = Search(transposition_table=TranspositionTable(keys=keys, data=data))
+    while True:
+        job = jobs.get()
+        if job is None: # The worker must close
+            break
+        job_id, position, time_limit, max_depth = job
+        engine.stop_condition = lambda: stop_job_id.value >= job_id
+        first_depth = 1 + worker_index % 2 # Half of the helpers skip the first depth, so the workers don't all search the same depth
+        result = engine.search(position, max_depth=max_depth, time_limit=time_limit if worker_index == 0 else None, first_depth=first_depth)
+        summary = {"depth": result.depth, "score": result.score, "nodes": result.nodes, "seconds": result.seconds, "pv": result.pv}
+        results.put((job_id, worker_index, result.best_move, summary))
+
+
+class ParallelSearch:
+    """The ParallelSearch class searches positions with several worker processes which share a transposition table.
+       - workers is the number of processes, usually the number of cores of the machine
+       - hash_mb is the size of the shared transposition table, in megabytes
+       The processes are started once, and kept until close is called."""
+    def __init__(self, workers=None, hash_mb=64):
+        "Allocate the shared table and start the worker processes"
+        self.worker_count = workers or multiprocessing.cpu_count()
+        entry_count = entry_count_for(hash_mb)
+        self.keys = multiprocessing.RawArray("Q", entry_count) # Shared memory, without any lock
+        self.data = multiprocessing.RawArray("Q", entry_count)
+        self.transposition_table = TranspositionTable(keys=self.keys, data=self.data) # View of the shared table from this process
+
+        self.results = multiprocessing.Queue()
+        self.stop_job_id = multiprocessing.Value("q", 0, lock=False)
+        self.last_job_id = 0
+        self.job_queues = []
+        self.processes = []
+        for worker_index in range(self.worker_count):
+            jobs = multiprocessing.Queue()
+            process = multiprocessing.Process(target=_worker_main, args=(worker_index, jobs, self.results, self.stop_job_id, self.keys, self.data), daemon=True)
+            process.start()
+            self.job_queues.append(jobs)
+            self.processes.append(process)
+
+    def clear(self):
+        "Empty the shared transposition table, for example before a new game"
+        self.transposition_table.clear()
+
+    def stop(self):
+        "Ask every worker to stop the current search as soon as possible"
+        self.stop_job_id.value = self.last_job_id
+
+    def search(self, position, max_depth=MAX_PLY - 1, time_limit=None):
+        """Searches a position with all the workers and returns a SearchResult.
+           The search ends when the main worker runs out of time or when any worker finishes max_depth. The result of the worker which
+           finished the deepest depth is kept, and nodes counts the positions visited by all the workers."""
+        start = time.perf_counter()
+        self.last_job_id += 1
+        job_id = self.last_job_id
+        for jobs in self.job_queues: # Every worker searches the same position
+            jobs.put((job_id, position, time_limit, max_depth))
+
+        summaries = []
+        while len(summaries) < self.worker_count:
+            result_job_id, worker_index, best_move, summary = self.results.get()
+            if result_job_id != job_id: # A late answer to an older search
+                continue
+            if not summaries: # The first worker which finishes stops the others
+                self.stop_job_id.value = job_id
+            summaries.append((summary["depth"], worker_index == 0, best_move, summary))
+
+        depth, is_main, best_move, summary = max(summaries, key=lambda item: (item[0], item[1])) # Deepest result, the main worker wins ties
+        result = SearchResult()
+        result.best_move = best_move
+        result.score = summary["score"]
+        result.depth = depth
+        result.pv = summary["pv"]
+        result.nodes = sum(item[3]["nodes"] for item in summaries)
+        result.seconds = time.perf_counter() - start
+        return result
+
+    def close(self):
+        "Stop the worker processes"
+        self.stop()
+        for jobs in self.job_queues:
+            jobs.put(None)
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+
+
+def measure_scaling(fen, depth, worker_counts, hash_mb):
+    """Searches a position to a fixed depth with each number of workers, and prints the time to depth and the speedup.
+       The shared table is emptied before each measure, so every run starts cold."""
+    base_seconds = None
+    for worker_count in worker_counts:
+        engine = ParallelSearch(worker_count, hash_mb)
+        result = engine.search(Position.from_fen(fen), max_depth=depth)
+        engine.close()
+        if base_seconds is None:
+            base_seconds = result.seconds
+        speedup = base_seconds / result.seconds if result.seconds > 0 else 0
+        print(f"workers {worker_count} : depth {result.depth} in {result.seconds:.3f} s, {result.nodes} nodes ({result.nodes / result.seconds:,.0f} nodes/s), "
+              f"speedup {speedup:.2f}x, efficiency {speedup / worker_count:.0%}")
+
+
+def main(arguments=None):
+    "Read the command line and run a parallel search, or measure how it scales with the number of workers"
+    parser = argparse.ArgumentParser(description="Search a position with several processes sharing a transposition table.")
+    parser.add_argument("--fen", default=START_FEN, help="position to search, the starting position by default")
+    parser.add_argument("--workers", "--threads", type=int, default=multiprocessing.cpu_count(), help="number of worker processes (default: number of cores)")
+    parser.add_argument("--depth", type=int, default=5, help="depth to search (default: 5)")
+    parser.add_argument("--movetime", type=float, default=None, help="time budget in seconds")
+    parser.add_argument("--hash", type=int, default=64, help="size of the shared transposition table in megabytes (default: 64)")
+    parser.add_argument("--scaling", default=None, help="comma-separated numbers of workers to compare, such as 1,2,4,8")
+    options = parser.parse_args(arguments)
+
+    if options.scaling:
+        measure_scaling(options.fen, options.depth, [int(count) for count in options.scaling.split(",")], options.hash)
+        return 0
+
+    engine = ParallelSearch(options.workers, options.hash)
+    result = engine.search(Position.from_fen(options.fen), max_depth=options.depth, time_limit=options.movetime)
+    engine.close()
+    print(f"workers {engine.worker_count} depth {result.depth} score {format_score(result.score)} nodes {result.nodes} time {result.seconds:.3f} s "
+          f"nps {result.nodes_per_second():,.0f} pv {' '.join(move_to_uci(move) for move in result.pv)}")
+    print(f"bestmove {move_to_uci(result.best_move) if result.best_move else '(none)'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""perft.py measures the correctness and the speed of the move generation of the rules engine.
+   Perft counts the leaf nodes of the tree of legal moves to a given depth. The counts are compared to well-known reference values,
+   so any bug in the move generation shows up as a wrong count, and the number of nodes per second tracks its speed.
+
+   Examples :
+       python perft.py --depth 4                 Count the nodes from the starting position to depth 4
+       python perft.py --fen "<FEN>" --divide 3  Count the nodes below each legal move of a position
+       python perft.py --suite                   Check every reference position and report the speed
+"""
+import argparse
+import sys
+import time
+from position import * # Import position.py for the Position class and FEN strings
+from rules import * # Import rules.py for the move generation
+
+
+# Reference positions, with the expected number of nodes for depth 1, 2, 3,...
+REFERENCE_POSITIONS = [("Starting position", START_FEN, [20, 400, 8902, 197281, 4865609]),
+                       ("Kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", [48, 2039, 97862, 4085603]),
+                       ("Rook endgame", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", [14, 191, 2812, 43238, 674624]),
+                       ("Promotions", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1", [6, 264, 9467, 422333]),
+                       ("Discovered checks", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", [44, 1486, 62379, 2103487]),
+                       ("Middlegame", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10", [46, 2079, 89890, 3894594])]
+
+
+def perft(position, depth):
+    "Returns the number of leaf nodes of the tree of legal moves of a position, to the given depth"
+    moves = legal_moves(position)
+    if depth == 1: # The leaf nodes are the legal moves themselves
+        return len(moves)
+    if depth == 0:
+        return 1
+
+    nodes = 0
+    for move in moves: # Each move is made and unmade on the same position, without copying it
+        make_move(position, move)
+        nodes += perft(position, depth - 1)
+        unmake_move(position)
+    return nodes
+
+
+def divide(position, depth):
+    "Returns a dictionary which gives the number of leaf nodes below each legal move of a position, to the given depth"
+    counts = {}
+    for move in legal_moves(position):
+        make_move(position, move)
+        counts[move_to_uci(move)] = perft(position, depth - 1)
+        unmake_move(position)
+    return counts
+
+
+def timed_perft(position, depth):
+    "Runs perft and returns a (nodes, seconds) tuple"
+    start = time.perf_counter()
+    nodes = perft(position, depth)
+    return nodes, time.perf_counter() - start
+
+
+def format_speed(nodes, seconds):
+    "Returns a readable string for a number of nodes searched in a given time"
+    nodes_per_second = nodes / seconds if seconds > 0 else 0
+    return f"{nodes} nodes in {seconds:.3f} s ({nodes_per_second:,.0f} nodes/s)"
+
+
+def run_suite(max_depth, max_nodes):
+    """Runs perft on every reference position and returns True if every count is right.
+    - max_depth is the deepest depth which is checked
+    - max_nodes skips the depths which have more expected nodes than this limit, to keep the suite quick"""
+    all_correct = True
+    total_nodes = 0
+    total_seconds = 0
+    for name, fen, expected_counts in REFERENCE_POSITIONS:
+        position = Position.from_fen(fen)
+        for depth, expected in enumerate(expected_counts[:max_depth], start=1):
+            if expected > max_nodes:
+                break
+            nodes, seconds = timed_perft(position, depth)
+            total_nodes += nodes
+            total_seconds += seconds
+            status = "ok" if nodes == expected else f"WRONG, expected {expected}"
+            if nodes != expected:
+                all_correct = False
+            print(f"{name}, depth {depth} : {format_speed(nodes, seconds)} {status}")
+
+    print(f"Total : {format_speed(total_nodes, total_seconds)}")
+    return all_correct
+
+
+def main(arguments=None):
+    "Read the command line and run perft, divide or the reference suite"
+    parser = argparse.ArgumentParser(description="Count the leaf nodes of the tree of legal moves, to check and benchmark the move generation.")
+    parser.add_argument("--fen", default=START_FEN, help="position to start from, the starting position by default")
+    parser.add_argument("--depth", type=int, default=None, help="depth of the tree (default: 3, or every reference depth with --suite)")
+    parser.add_argument("--divide", action="store_true", help="print the number of nodes below each legal move")
+    parser.add_argument("--suite", action="store_true", help="check every reference position")
+    parser.add_argument("--max-nodes", type=int, default=100000, help="with --suite, skip the depths which have more nodes than this (default: 100000)")
+    options = parser.parse_args(arguments)
+
+    if options.suite:
+        max_depth = options.depth if options.depth is not None else max(len(counts) for name, fen, counts in REFERENCE_POSITIONS)
+        return 0 if run_suite(max_depth, options.max_nodes) else 1
+
+    if options.depth is None:
+        options.depth = 3
+    position = Position.from_fen(options.fen)
+    if options.divide:
+        start = time.perf_counter()
+        counts = divide(position, options.depth)
+        seconds = time.perf_counter() - start
+        for move_name in sorted(counts):
+            print(f"{move_name}: {counts[move_name]}")
+        print(f"Moves : {len(counts)}")
+        print(format_speed(sum(counts.values()), seconds))
+    else:
+        nodes, seconds = timed_perft(position, options.depth)
+        print(f"Depth {options.depth} : {format_speed(nodes, seconds)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
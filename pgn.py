@@ -0,0 +1,227 @@
+"""pgn.py reads games written in PGN (Portable Game Notation), the text format used by chess databases, and positions written as FEN strings.
+   The games are read one by one from the lines of a file, so files of any size can be read in constant memory.
+   Comments, variations, numeric annotations and move numbers are skipped: only the headers, the moves and the result are kept.
+
+   import_games validates every move of the games with the rules and yields a MoveRecord for each of them. The validation can be shared
+   between several processes: the games are sent to them in small batches, and only a few batches are waiting at any time,
+   so the memory used stays the same whatever the size of the file.
+
+   Examples :
+       with open("games.pgn", encoding="utf-8", errors="replace") as pgn_file:
+           for game in read_games(pgn_file):
+               print(game.headers.get("White"), game.result, len(game.moves))
+
+       python pgn.py games.pgn --workers 4        Validate all the games of a file with 4 processes and report the speed
+       python pgn.py positions.fen --fen          Check a file of FEN strings, one on each line
+"""
+from collections import namedtuple, deque
+from itertools import islice
+import argparse
+import multiprocessing
+import re
+import sys
+import time
+from position import * # Import position.py for the Position class
+from rules import starting_position, move_from_san, make_move # Import rules.py to replay the moves of a game
+
+
+PgnGame = namedtuple("PgnGame", ["headers", "moves", "result"]) # headers is a dictionary, moves the list of the moves in SAN, result '1-0', '0-1', '1/2-1/2' or '*'
+MoveRecord = namedtuple("MoveRecord", ["game", "ply", "hash", "move", "side_to_move", "result"]) # Number of the game, ply of the move, hash of the position before the move, Move (None for the position the game ends in), color which plays it and result of the game
+
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+HEADER_PATTERN = re.compile(r'\[\s*(\w+)\s+"(.*)"\s*\]') # A header line, such as [White "Carlsen"]
+TOKEN_PATTERN = re.compile(r"\{[^}]*\}?|;.*|\(|\)|\$\d+|\d+\.+|[^\s(){};]+") # Comments, variations, annotations, move numbers and moves
+
+
+def read_games(lines):
+    """Yields a PgnGame for each game of an iterable of lines, such as an open file.
+       A game which doesn't end with a result is still yielded, with the result '*'."""
+    headers = {}
+    moves = []
+    result = None
+    variation_depth = 0 # Moves inside parentheses are variations, which aren't part of the game
+    in_comment = False # A comment between braces can continue on the next lines
+    for line in lines:
+        if in_comment: # Skip the rest of a comment which started on a previous line
+            if "}" not in line:
+                continue
+            line = line[line.index("}") + 1:]
+            in_comment = False
+
+        stripped = line.strip()
+        if stripped.startswith("[") and variation_depth == 0:
+            if moves or result is not None: # The headers of the next game start before the previous one gave its result
+                yield PgnGame(headers, moves, result or "*")
+                headers, moves, result = {}, [], None
+            match = HEADER_PATTERN.match(stripped)
+            if match:
+                headers[match.group(1)] = match.group(2)
+            continue
+        if stripped.startswith("%"): # Escaped line
+            continue
+
+        for token in TOKEN_PATTERN.findall(line):
+            if token.startswith("{"):
+                if not token.endswith("}"): # The comment continues on the next lines
+                    in_comment = True
+            elif token == "(":
+                variation_depth += 1
+            elif token == ")":
+                variation_depth = max(variation_depth - 1, 0)
+            elif variation_depth or token.startswith((";", "$")) or token[0].isdigit() and token.rstrip(".").isdigit() or token.lower() == "e.p.":
+                continue # Variation, end-of-line comment, annotation, move number, or the 'e.p.' some programs write after an en passant capture
+            elif token in RESULTS:
+                result = token
+                yield PgnGame(headers, moves, result)
+                headers, moves, result = {}, [], None
+            else:
+                san = token.split(".")[-1] # Some files glue the move number to the move, such as '1.e4'
+                if san:
+                    moves.append(san)
+
+    if headers or moves: # The file ends without a result
+        yield PgnGame(headers, moves, "*")
+
+
+def starting_position_of(game):
+    "Returns the position a game starts from: its FEN header if it has one, or the starting position"
+    if game.headers.get("SetUp", "1") != "0" and "FEN" in game.headers:
+        return Position.from_fen(game.headers["FEN"])
+    return starting_position()
+
+
+def replay(game, max_plies=None):
+    """Yields a (position, move) tuple for each move of a game, with the position before the move is played.
+       The same Position object is modified between two moves, so it must be copied to be kept.
+       IllegalValueException is raised on the first move which isn't legal."""
+    position = starting_position_of(game)
+    for ply, san in enumerate(game.moves):
+        if max_plies is not None and ply >= max_plies:
+            break
+        move = move_from_san(position, san)
+        yield position, move
+        make_move(position, move)
+
+
+def read_fens(lines):
+    """Yields a (line number, Position) tuple for each FEN string of an iterable of lines, such as an open file.
+       Empty lines and lines starting with '#' are skipped. The move counters can be left out, as in EPD files.
+       IllegalValueException is raised, with the line number, on the first line which isn't a valid FEN string."""
+    for line_number, line in enumerate(lines, 1):
+        fields = line.split()
+        if not fields or fields[0].startswith("#"):
+            continue
+        if len(fields) < 4:
+            raise IllegalValueException(message=f"line {line_number}: '{line.strip()}' is not a valid FEN string")
+        counters = fields[4:6] if len(fields) >= 6 and fields[4].isdigit() and fields[5].isdigit() else ["0", "1"]
+        try:
+            position = Position.from_fen(" ".join(fields[:4] + counters))
+        except (IllegalValueException, ValueError, IndexError) as error:
+            raise IllegalValueException(message=f"line {line_number}: {error}")
+        yield line_number, position
+
+
+def validate_game(game_number, game, final_position=False):
+    """Replays a game with the rules and returns a (records, error) tuple:
+       records is the list of the MoveRecords of the legal moves, and error the text of the first illegal move, or None if every move is legal.
+       With final_position, records ends with a MoveRecord whose move is None for the last position reached, if the game has any legal move."""
+    records = []
+    position = None
+    error = None
+    try:
+        for ply, (position, move) in enumerate(replay(game)):
+            records.append(MoveRecord(game_number, ply, position.hash, move, position.side_to_move, game.result))
+    except IllegalValueException as illegal:
+        error = str(illegal)
+    if final_position and position is not None: # replay changes the same Position, so it's now the position after the last legal move
+        records.append(MoveRecord(game_number, len(records), position.hash, None, position.side_to_move, game.result))
+    return records, error
+
+
+def _validate_batch(batch, final_position=False):
+    "Validates a batch of (game number, PgnGame) tuples in a worker process and returns the list of their (game number, records, error) tuples"
+    return [(game_number,) + validate_game(game_number, game, final_position) for game_number, game in batch]
+
+
+def import_games(lines, workers=1, batch_size=64, errors=None, on_game=None, final_positions=False):
+    """Yields a MoveRecord for each legal move of the games of an iterable of lines, in the order of the file.
+    - workers is the number of processes which validate the games. With 1, they are validated in this process.
+    - batch_size is the number of games sent to a process at once
+    - errors is an optional list, to which a (game number, error) tuple is added for each game with an illegal move.
+      The moves of such a game are yielded up to the illegal one.
+    - on_game is an optional function called with the number and the PgnGame of each game, when it's read
+    - final_positions adds a record whose move is None after the moves of each game, for the position the game ends in"""
+    games = enumerate(read_games(lines))
+    if on_game is not None:
+        games = _announced(games, on_game)
+    if workers <= 1:
+        for numbered_game in games:
+            yield from _records_of(_validate_batch([numbered_game], final_positions), errors)
+        return
+
+    with multiprocessing.Pool(workers) as pool:
+        pending = deque() # Batches sent to the processes, in the order of the file. There are never more than two for each process.
+        while True:
+            while len(pending) < 2 * workers:
+                batch = list(islice(games, batch_size))
+                if not batch:
+                    break
+                pending.append(pool.apply_async(_validate_batch, (batch, final_positions)))
+            if not pending:
+                break
+            yield from _records_of(pending.popleft().get(), errors)
+
+
+def _announced(games, on_game):
+    "Yields the numbered games, calling on_game with each of them first"
+    for game_number, game in games:
+        on_game(game_number, game)
+        yield game_number, game
+
+
+def _records_of(results, errors):
+    "Yields the records of a list of (game number, records, error) tuples, and adds the errors to the errors list"
+    for game_number, records, error in results:
+        yield from records
+        if error is not None and errors is not None:
+            errors.append((game_number, error))
+
+
+def main(arguments=None):
+    "Read the command line, then validate all the games or all the FEN strings of a file and report the speed"
+    parser = argparse.ArgumentParser(description="Validate the games of a PGN file, or the positions of a FEN file.")
+    parser.add_argument("path", help="PGN file, or FEN file with --fen")
+    parser.add_argument("--fen", action="store_true", help="read a file of FEN strings, one on each line")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes which validate the games (default: 1)")
+    parser.add_argument("--batch-size", type=int, default=64, help="number of games sent to a process at once (default: 64)")
+    options = parser.parse_args(arguments)
+
+    start = time.perf_counter()
+    with open(options.path, encoding="utf-8", errors="replace") as input_file:
+        if options.fen:
+            try:
+                count = sum(1 for record in read_fens(input_file))
+            except IllegalValueException as error:
+                print(error)
+                return 1
+            print(f"{count} positions read in {time.perf_counter() - start:.2f} s")
+            return 0
+
+        errors = []
+        game_count = 0
+        last_game = None
+        move_count = 0
+        for record in import_games(input_file, options.workers, options.batch_size, errors):
+            if record.game != last_game: # The records come in the order of the file, so each game starts once
+                game_count += 1
+                last_game = record.game
+            move_count += 1
+    seconds = time.perf_counter() - start
+    for game_number, error in errors[:10]:
+        print(f"game {game_number}: {error}")
+    print(f"{game_count} games with moves, {move_count} moves validated in {seconds:.2f} s ({move_count / seconds:,.0f} moves/s), {len(errors)} games with an illegal move")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
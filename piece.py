@@ -3,17 +3,44 @@ import pygame
 import os
 import numpy as np
 from customized_exceptions import * # Import customized_exceptions to access game-specific exceptions
+from position import * # Import position.py to store the state of the pieces as bitboards
+from sprites import get_piece_surface, piece_image_path, PIECE_SIZE # Import sprites.py to share the images of the pieces
+from rules import legal_moves_from # Import rules.py to find the cells a piece can move to
+from instrumentation import get_logger # Messages are sent to a logger, which is off by default
 
+logger = get_logger("piece")
 
 
 
 
+
+def _indexed_piece(cell, pieces_list):
+    """Returns the piece of pieces_list standing on a cell by looking at the square index of the board, or None.
+       The index can only be used if the pieces of the list belong to this list as their group."""
+    first_piece = pieces_list[0]
+    if type(first_piece).__name__ != "GamePiece": # If the piece is not a GamePiece object
+        raise NotGamePieceException(message=f"Objects in the pieces_list setting must be GamePiece objects, not {type(first_piece).__name__} objects.") # Raise a NotGamePieceException error
+    piece = first_piece.board.piece_index[square_index(cell[0], cell[1])] # The piece standing on the cell, whatever its group
+    if piece is not None and piece.group is pieces_list: # Only return it if it belongs to the list
+        return piece
+
+
 def identify_piece_by_position(position=(0,0), pieces_list=[], return_object=False): 
-    """Iterates over a list of game pieces, compares the position of the piece to the value of the position setting, if it matches, return the name of the piece or the piece itself.
+    """Finds the piece of a list of game pieces which stands at a position, and returns the name of the piece or the piece itself.
     - The position setting represent a tuple containing (x,y) where x and y are the positions of the piece to be identified
     - The pieces_list setting represent the group of pieces in which we must search a piece that have the position described by the position setting
-    - return_object is a boolean with False as default value. If it's False, the function only returns the name of the piece that have the described position, otherwise it returns the whole usable piece object."""
+    - return_object is a boolean with False as default value. If it's False, the function only returns the name of the piece that have the described position, otherwise it returns the whole usable piece object.
+    If the pieces of the list have this list as their group, the piece is found in constant time with the square index of the board. Otherwise, the list is scanned."""
     
+    if not pieces_list: # There is nothing to find in an empty list
+        return None
+
+    if pieces_list[0].group is pieces_list: # If the list is the group of its pieces, use the square index of the board
+        piece = _indexed_piece(position, pieces_list)
+        if piece is not None:
+            return piece if return_object else piece.name
+        return None
+
     for piece in pieces_list: # For each piece of the list
         if type(piece).__name__ != "GamePiece": # If the piece is not a GamePiece object
             raise NotGamePieceException(message=f"Objects in the pieces_list setting must be GamePiece objects, not {type(piece).__name__} objects.") # Raise a NotGamePieceException error
@@ -26,24 +53,21 @@ def identify_piece_by_position(position=(0,0), pieces_list=[], return_object=Fal
         
 
 def identify_piece_by_rect(rect=pygame.Rect(0, 0, 1, 1), pieces_list=[], return_object=False):
-    """Iterates over a list of game pieces, compares the rect of the piece to the value of the rect setting, if it matches, return the name of the piece or the piece itself.
-    - The rect is the rect of the piece we want to find
+    """Finds the piece of a list of game pieces which is under a rect, and returns the name of the piece or the piece itself.
+    - The rect is the rect of the piece we want to find. The piece is the one standing on the cell under the center of the rect.
     - The pieces_list setting represent the group of pieces in which we must search a piece that have the rect described by the rect setting
     - return_object is a boolean with False as default value. If it's False, the function only returns the name of the piece that have the described rect, otherwise it returns the whole usable piece object."""
     
-    for piece in pieces_list: # For each piece of the list
-        if type(piece).__name__ != "GamePiece": # If the piece is not a GamePiece object
-            raise NotGamePieceException(message=f"Objects in the pieces_list setting must be GamePiece objects, not {type(piece).__name__} objects.") # Raise a NotGamePieceException error
-        
-        print(f"Piece rect {piece.rect}")
-        if pygame.Rect.colliderect(piece.rect, rect): # If the rect of the piece is equal to the rect value given as setting
-            if return_object: # If we must return the whole object
-                return piece
-            
-            return piece.name # Otherwise, return only the name of the piece
+    if not pieces_list: # There is nothing to find in an empty list
+        return None
 
+    cell = pieces_list[0].board.cell_at_pixel(rect.center) # The cell under the rect is found with a division
+    if cell is None: # The rect is outside the board
+        return None
+    return identify_piece_by_position(position=cell, pieces_list=pieces_list, return_object=return_object)
 
-class GamePiece(pygame.sprite.Sprite):
+
+class GamePiece:
      """The GamePiece class allows to create a game piece with general attributes.
         - window is the window on which the piece must appear
         - board is the game board on which the piece must appear
@@ -52,38 +76,42 @@ class GamePiece(pygame.sprite.Sprite):
         - direction is a int number which represents the direction in which the piece will move. If it's 1, it will go upward, but if it's -1, it will go downward.
         - image_path is the file path leading to the image that represent the piece
         - group is the list of pieces to which the current piece belong to
+        The rules only need the type, the color and the square of a piece, which the Position keeps. A GamePiece only adds what's needed
+        to draw it, in slots instead of a dictionary, and shares its image and its tables with every other piece.
      """
+     available_names = ["pawn", "rook", "knight", "bishop", "king", "queen"] # List of available names for a game piece, shared by all the pieces
+
+     # Dictionnary of possible moves for each piece in the game, shared by all the pieces.
+     # For each piece name, we associate a list of moves, and each move has a name  of the  'move_name-max_cells_by_move' or a single letter that looks like the form of the move
+     pieces_moves = {"pawn":["vert-1", "vert-2", "angled-1"], # Pawns can move vertically 1 time, but max 2 times at the beginning of the game. They capture in angle by 1 cell.
+                     "knight":["L"], # Knights can make a 'L'-like move
+                     "bishop":["angled-any"], # Bishops can move in angle for any distance they want, hence the 'any' distance
+                     "rook":["vert-any"], # Rooks can move vertically or horizontally for any distance they want, hence the 'any' distance
+                     "king":["any-1"], # Kings can move in any direction they want, but only at a distance of 1
+                     "queen":["any-any"] # Queens can move in any direction they want and for any distance they want
+                     }
+
+     __slots__ = ("name", "color", "group", "direction", "side", "piece_type", "image", "window", "board",
+                  "pixel_x", "pixel_y", "original_grid_x", "original_grid_y", "available_moves", "moves")
+
      def __init__(self, window, board, name="pawn", color=(255,255,255), direction=1, image_path=os.path.abspath("assets/images/pawn.jpg"), group=[]):
         "Init the GamePiece object with its attributes"
-        super().__init__() # We inherit of the Sprite object from pygame.sprite
-
         group_type = type(group).__name__  # Type of the 'group' parameter
         if not type(group).__name__ == "list": # If the 'group' argument was not defined as a list
             raise IllegalValueException(message=f"'group' parameter must be of type list, not {group_type}")
         
         
-        self.available_names = ["pawn", "rook", "knight", "bishop", "king", "queen"] # List of available names for a game piece
         self.name = name # Name of the piece (pawn, rook, king,...)
         if self.name.lower() not in self.available_names: # If the current name of the piece isn't available
             raise NameNotAvailableException(message=f"Name {self.name} is not available for GamePiece objects. Available names are {self.available_names}.") # Raise a NameNotAvailableException
         self.color = color # Color of the piece
         self.group = group # The group of pieces to which the current GamePiece object belongs to
         self.direction = direction # The direction in which the piece will move
+        self.side = WHITE if direction == 1 else BLACK # The side of the piece in the bitboard position. Pieces going upward belong to the player.
+        self.piece_type = PIECE_NAMES.index(self.name.lower()) # The type of the piece in the bitboard position
 
-        self.image = pygame.image.load(image_path) # Load the image which represents the piece
-        self.image = pygame.transform.scale(self.image, (75, 70)) # Modify the dimensions of the image to 75x70
-        self.colored_image_surf = pygame.Surface(self.image.get_size()) # Surface that will host the colored image (color setting)
-        self.colored_image_surf.set_alpha(255)
-
-
-        # Fill the surface with the indicated RGB color
-        self.colored_image_surf.fill(color)
-        
-
-        # Draw the image
-        self.colored_image_surf.blit(self.image, (0,0), special_flags=pygame.BLEND_RGBA_MULT)
+        self.load_image(image_path) # Load the image which represents the piece
         
-        self.rect = self.image.get_rect() # Get the image's rect
         self.window = window # The game window on which the piece must be displayed
         self.board = board # Game board on which the piece must appear
         
@@ -97,142 +125,41 @@ class GamePiece(pygame.sprite.Sprite):
         self.original_grid_x = None
         self.original_grid_y = None
 
-        # Dictionnary of possible moves for each piece in the game.
-        # For each piece name, we associate a list of moves, and each move has a name  of the  'move_name-max_cells_by_move' or a single letter that looks like the form of the move
-        self.pieces_moves = {"pawn":["vert-1", "vert-2"], # Pawns can move vertically 1 time, but max 2 times at the beginning of the game
-                             "knight":["L"], # Knights can make a 'L'-like move
-                             "bishop":["angled-any"], # Bishops can move in angle for any distance they want, hence the 'any' distance
-                             "rook":["vert-any"], # Rooks can move vertically for any distance they want, hence the 'any' distance
-                             "king":["any-1"], # Kings can move in any direction they want, but only at a distance of 1
-                             "queen":["any-any"] # Queens can move in any direction they want and for any distance they want
-                             }  
-        
-        
         self.available_moves = self.pieces_moves[self.name] # Get the available moves for the current piece
-        print(f"Available moves for {self.name} : {self.available_moves}")
+        logger.debug("Available moves for %s : %s", self.name, self.available_moves)
 
 
         self.moves = 0 # Number of moves made by the piece
 
 
 
-     def calculate_moves(self):
-        "Calculate on which cells the piece can move to on the board"
-        possible_cells = [] # List of the cells on which the piece can move
+     def load_image(self, image_path):
+        "Get the image which represents the piece, colored with the piece's color. The surface is shared with every piece of the same name and color."
+        self.image = get_piece_surface(self.name, self.color, PIECE_SIZE, image_path) # Shared surface, loaded and colored only once per process
 
-        if self.moves == 0:
-            print(f"{self.name} made no move yet.")
-
-
-        for move in self.available_moves: # For each available move
-            current_position = self.get_position() # Get the current position of the piece
-            current_x = current_position[0] # The current x position
-            current_y = current_position[1] # The current y position
-            if move == "vert-1": # If the piece can move vertically by one cell
-                current_cell = (current_y,current_x)  # Get the cell where the piece is actually
-                print(f"{self.name}'s current cell is {current_cell}")
-                for line_y in range(1, len(self.board.grid)): # For the whole height of the grid
-                    if self.direction == 1: # If the piece can move upward
-                        print(f"Checking upward for {move}...")
-                        if line_y == current_y -1: # If the y line represents the line just before the line where the piece is
-                            for cell_x in range(len(self.board.grid[line_y])): # For every x cell in the current line
-                                if cell_x == current_x: # If the cell is just before the cell where the piece is
-                                    for piece in self.group: # For each piece of the group
-                                        if not piece.get_position() == (cell_x, line_y): # If there is no piece already present on the available cell
-                                            if not (line_y, cell_x) in possible_cells: # If the coordinates of the sell aren't already in the list
-                                                possible_cells.append((cell_x, line_y)) # Append the position of the cell to the list
-
-                    elif self.direction == -1: # If the piece can go downward
-                        print(f"Checking downward for {move}...")
-                        next = current_y + 1 # Line just after the one where the piece is located
-                        if line_y == next: # If the y line represents the line just after the line where the piece is
-                            for cell_x in range(len(self.board.grid[line_y])): # For every x cell in the current line
-                                if cell_x == current_x: # If the cell is just before the cell where the piece is
-                                    for piece in self.group: # For each piece of the group
-                                        if not piece.get_position() == (cell_x, line_y): # If there is no piece already present on the available cell
-                                            if not (line_y, cell_x) in possible_cells: # If the coordinates of the sell aren't already in the list
-                                                possible_cells.append((cell_x, line_y)) # Append the position of the cell to the list
-
-                                        
-
-
-            if move == "vert-2" and self.moves == 0: # If the piece can move vertically by two cells and she did no move yet
-                current_cell = (current_y,current_x)  # Get the cell where the piece is actually
-                print(f"{self.name}'s current cell is {current_cell}")
-                for line_y in range(2, len(self.board.grid)): # For the whole height of the grid
-                    if self.direction == 1: # If the piece can move upward
-                        print(f"Checking upward for {move}...")
-                        if line_y == current_y -2: # If the current y line is separated by one line with the current piece's line, downward
-                            for cell_x in range(len(self.board.grid[line_y])): # For every x cell in the current line
-                                if cell_x == current_x: # If the cell is just before the cell where the piece is
-                                    for piece in self.group: # For each piece of the group
-                                        if not piece.get_position() == (cell_x, line_y): # If there is no piece already present on the cell
-                                            if not (cell_x, line_y) in possible_cells: # If the coordinates of the sell aren't already in the list
-                                                possible_cells.append((cell_x, line_y))# Append the position of the cell to the list
-
-                    elif self.direction == -1: # If the piece can go downward
-                        print(f"Checking downward for {move}...")
-                        if line_y == current_y + 2:  # If the current y line is separated by one line with the current piece's line, upward
-                            for cell_x in range(len(self.board.grid[line_y])): # For every x cell in the current line
-                                for piece in self.group: # For each piece of the group
-                                    if not piece.get_position() == (cell_x, line_y): # If there is no piece already present on the cell
-                                        if not (cell_x, line_y) in possible_cells: # If the coordinates of the sell aren't already in the list
-                                            possible_cells.append((cell_x, line_y)) # Append the position of the cell to the list
-
-
-            if move == "L": # If the piece can make a L-like move
-                 current_cell = (current_y,current_x)  # Get the cell where the piece is actually
-                 print(f"{self.name}'s current cell is {current_cell}")
-                 if self.direction == 1: # If the piece can go upward
-                    if current_y -3 >= 0: # Check that the piece won't get out of the board
-                        for line_y in range(current_y, current_y-3, -1): # For any of the first three lines before the current line of the piece
-                            for cell_x in range(len(self.board.grid[line_y])): # For any cell in this line
-                                for piece in self.group: # For each piece in the same group than the current piece
-                                    if not piece.get_position() == (cell_x, line_y): # If that piece isn't currently on the cell
-                                        if not (cell_x, line_y) in possible_cells:
-                                            possible_cells.append((cell_x, line_y)) # Append the position of the cell to the list of possible cells
-
-                 if self.direction == -1: # If the piece can go downward
-                     if current_y + 3 <= len(self.board.grid) - 1: # Check that the piece won't get out of the board
-                         for line_y in range(current_y, current_y + 3, 1): # For any of the first three lines after the current line of the piece
-                             for cell_x in range(len(self.board.grid[line_y])):  # For any cell in that line
-                                 for piece in self.group: # For each piece in the same group than the current piece
-                                     if not piece.get_position() == (cell_x, line_y): # If the cell isn't currently occupied by that piece
-                                         if not (cell_x, line_y) in possible_cells:
-                                            possible_cells.append((cell_x, line_y)) # Append the position of the cell to the list                      
-                                 
-
-
-                     
-                     
-
-
-            if move == "angled-any": # # If the piece can move in angle by any number of cells
-                 current_cell = (current_y,current_x)  # Get the cell where the piece is actually
-                 print(f"{self.name}'s current cell is {current_cell}")
-
-            if move == "vert-any": # If the piece can move vertically by any number of cells
-                 current_cell = (current_y,current_x)  # Get the cell where the piece is actually
-                 print(f"{self.name}'s current cell is {current_cell}")
-
-            if move == "any-1": # If the piece can move in any direction by one cell
-                 current_cell = (current_y,current_x)  # Get the cell where the piece is actually
-                 print(f"{self.name}'s current cell is {current_cell}")
-
-            if move == "any-any": # If the piece can move in any direction by any number of cells
-                 current_cell = (current_y,current_x)  # Get the cell where the piece is actually
-                 print(f"{self.name}'s current cell is {current_cell}")
 
+     def calculate_moves(self):
+        """Calculate on which cells the piece can move to on the board.
+           Only the legal moves are kept, so the pieces of the side which isn't playing can't move."""
+        current_x, current_y = self.get_position() # Get the current position of the piece
+        moves = legal_moves_from(self.board.position, square_index(current_x, current_y)) # Legal moves of the piece, given by the rules engine
 
+        possible_cells = [] # List of the cells on which the piece can move
+        for move in moves: # For each legal move
+            cell = square_coordinates(move.to_square) # Cell on which the move ends
+            if not cell in possible_cells: # Promotions give several moves to the same cell
+                possible_cells.append(cell)
         return possible_cells # Return the list with the position of each cell to which the piece can move         
 
      def set_position(self, grid_x, grid_y):
         "Set the position of the piece on the board"
-        print(f"Moving {self.name} to {(grid_x, grid_y)}")
-        self.original_grid_x = grid_x # Set the x position
-        self.original_grid_y = grid_y # Set the y position
-        #print(f"New position for {self.name} :",  self.original_grid_x, ",", self.original_grid_y)
-        self.update_pixel_coordinates() # Update the pixel coordinates of the piece to display it on the board
+        logger.debug("Moving %s to %s", self.name, (grid_x, grid_y))
+        if self.original_grid_x is not None: # If the piece was already on the board, remove it from its previous cell
+            previous_square = square_index(self.original_grid_x, self.original_grid_y)
+            self.board.position.remove_piece(self.side, self.piece_type, previous_square)
+            self.board.piece_index[previous_square] = None
+        self.board.position.put_piece(self.side, self.piece_type, square_index(grid_x, grid_y)) # Put the piece on its new cell
+        self.show_at(grid_x, grid_y) # Show the piece on its new cell
         #self.moves += 1 
 
      def get_position(self):
@@ -273,14 +200,41 @@ class GamePiece(pygame.sprite.Sprite):
             if self.pixel_y > 532:
                 #print(f"{self.name} is out of the board")
                 self.pixel_y = 532    
-            
-            self.rect.x = self.pixel_x
-            self.rect.y = self.pixel_y
+
 
 
      def move_to(self, new_grid_x, new_grid_y):
-        "Move the piece"     
-        self.set_position(new_grid_x, new_grid_y) # Update the position of the piece  
+        """Move the piece on the screen after a move was played.
+           Unlike set_position, it doesn't modify the bitboard position, which is updated by rules.make_move."""
+        previous_square = square_index(self.original_grid_x, self.original_grid_y)
+        if self.board.piece_index[previous_square] is self: # Free the previous cell in the square index, unless another piece already took it
+            self.board.piece_index[previous_square] = None
+        self.show_at(new_grid_x, new_grid_y) # Show the piece on its new cell
+        self.moves += 1 # The piece made one more move
+
+
+     def show_at(self, grid_x, grid_y):
+        "Show the piece on a cell, and index it by this cell. The bitboard position isn't modified."
+        self.board.piece_index[square_index(grid_x, grid_y)] = self # Index the piece by its cell
+        self.original_grid_x = grid_x # Set the x position
+        self.original_grid_y = grid_y # Set the y position
+        self.update_pixel_coordinates() # Update the pixel coordinates of the piece to display it on the board
+
+
+     def remove(self):
+        "Remove the piece from the screen after it was captured. The bitboard position is updated by rules.make_move."
+        square = square_index(self.original_grid_x, self.original_grid_y)
+        if self.board.piece_index[square] is self: # The capturing piece may already be indexed on this cell
+            self.board.piece_index[square] = None
+        self.group.remove(self) # The piece doesn't belong to its group anymore
+
+
+     def promote(self, name):
+        "Turn the piece into another type of piece after a promotion"
+        self.name = name # The new name of the piece
+        self.piece_type = PIECE_NAMES.index(name) # The new type of the piece
+        self.available_moves = self.pieces_moves[self.name] # Get the available moves for the new type
+        self.load_image(piece_image_path(name)) # Get the image of the new type
             
 
         
@@ -288,7 +242,7 @@ class GamePiece(pygame.sprite.Sprite):
 
      def draw(self):
         "Draw the piece on the screen"
-        self.window.blit(self.colored_image_surf, (self.rect.x, self.rect.y)) # Draw the surface of the image at current x and y positions
+        self.window.blit(self.image, (self.pixel_x, self.pixel_y)) # Draw the surface of the image at current x and y positions
 
 
 
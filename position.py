@@ -0,0 +1,244 @@
+"""position.py contains a Position class which stores the state of the pieces on the board as bitboards.
+   A bitboard is a 64-bit integer where each bit stands for one square of the board. Bit 0 is the bottom-left square (a1)
+   and bit 63 is the top-right square (h8), so the player's pieces start on the low bits and the enemy's pieces on the high bits.
+"""
+from customized_exceptions import IllegalValueException # Raised when a FEN string can't be read
+from zobrist import PIECE_KEYS, compute_hash # Import zobrist.py to keep the hash of the position up to date
+
+# Colors of the two sides
+WHITE = 0 # The player's side, which starts at the bottom of the board and moves upward
+BLACK = 1 # The enemy's side, which starts at the top of the board and moves downward
+
+# Types of pieces. The name of each type is the name used by GamePiece objects.
+PAWN = 0
+KNIGHT = 1
+BISHOP = 2
+ROOK = 3
+QUEEN = 4
+KING = 5
+
+PIECE_NAMES = ["pawn", "knight", "bishop", "rook", "queen", "king"] # Name of each piece type, indexed by the type number
+
+# Castling rights, stored together as bit flags
+WHITE_KINGSIDE = 1
+WHITE_QUEENSIDE = 2
+BLACK_KINGSIDE = 4
+BLACK_QUEENSIDE = 8
+ALL_CASTLING_RIGHTS = WHITE_KINGSIDE | WHITE_QUEENSIDE | BLACK_KINGSIDE | BLACK_QUEENSIDE
+
+FULL_BOARD = 0xFFFFFFFFFFFFFFFF # A bitboard where every square is set
+
+PIECES = [[(color, piece_type) for piece_type in range(len(PIECE_NAMES))] for color in (WHITE, BLACK)] # Shared (color, piece_type) tuples stored in the mailbox
+
+SQUARE_BITS = [1 << square for square in range(64)] # Bit of each square, precomputed to avoid shifting again and again
+
+# FEN (Forsyth-Edwards Notation) describes a position with a single line of text
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1" # The position set up by Game.place_pieces
+FEN_PIECE_LETTERS = "pnbrqk" # Letter of each piece type in a FEN string. White pieces use capital letters.
+FEN_CASTLING_LETTERS = [(WHITE_KINGSIDE, "K"), (WHITE_QUEENSIDE, "Q"), (BLACK_KINGSIDE, "k"), (BLACK_QUEENSIDE, "q")]
+
+
+def square_index(grid_x, grid_y):
+    """Returns the square number (0 to 63) of a cell of the grid.
+    - grid_x is the column of the cell, from 0 (left) to 7 (right)
+    - grid_y is the row of the cell, from 0 (top of the window) to 7 (bottom of the window)"""
+    return (7 - grid_y) * 8 + grid_x
+
+
+def square_coordinates(square):
+    "Returns a (grid_x, grid_y) tuple with the cell of the grid which matches a square number"
+    return (square & 7, 7 - (square >> 3))
+
+
+def square_name(square):
+    "Returns the algebraic name of a square, such as 'e4'"
+    return "abcdefgh"[square & 7] + str((square >> 3) + 1)
+
+
+def parse_square(name):
+    "Returns the square number of an algebraic square name, such as 'e4'"
+    if len(name) != 2 or name[0] not in "abcdefgh" or name[1] not in "12345678": # If the name isn't a file letter followed by a rank number
+        raise IllegalValueException(message=f"{name} is not a valid square name")
+    return (int(name[1]) - 1) * 8 + "abcdefgh".index(name[0])
+
+
+def iterate_squares(bitboard):
+    "Yields the square number of each bit set in a bitboard, from the lowest to the highest"
+    while bitboard: # While there is still a bit set
+        lowest_bit = bitboard & -bitboard # Isolate the lowest bit
+        yield lowest_bit.bit_length() - 1 # Its square number is its position in the integer
+        bitboard ^= lowest_bit # Clear the bit and continue with the next one
+
+
+class Position:
+    """The Position class stores which squares are occupied and by which piece.
+       - bitboards[color][piece_type] is the bitboard of the squares held by the pieces of that color and type
+       - occupancy[color] is the bitboard of all squares held by a color
+       - all_occupancy is the bitboard of all the occupied squares of the board
+       - mailbox is a list of 64 slots which gives the (color, piece_type) tuple of the piece on each square, or None
+       - side_to_move is the color which must play the next move
+       - castling_rights holds the castling flags which are still available
+       - en_passant is the square a pawn can capture en passant on, or None
+       - halfmove_clock counts the moves since the last capture or pawn move, and fullmove_number the moves of the game
+       - hash is the Zobrist hash of the position, updated incrementally when pieces are put, removed or moved
+       - history is the undo stack of the moves made with rules.make_move, so they can be unmade
+    """
+    __slots__ = ("bitboards", "occupancy", "all_occupancy", "mailbox", "side_to_move", "castling_rights", "en_passant",
+                 "halfmove_clock", "fullmove_number", "hash", "history") # No dictionary for each position, so the copies are smaller and quicker to make
+
+    def __init__(self):
+        "Init an empty position"
+        self.bitboards = [[0] * len(PIECE_NAMES), [0] * len(PIECE_NAMES)] # One bitboard for each type of piece, for each color
+        self.occupancy = [0, 0] # Squares held by each color
+        self.all_occupancy = 0 # Squares held by any color
+        self.mailbox = [None] * 64 # Piece on each square, to find which piece stands on a square without looking at every bitboard
+
+        self.side_to_move = WHITE # The player always starts
+        self.castling_rights = 0 # No castling is possible in an empty position
+        self.en_passant = None # Square on which an en passant capture is possible
+        self.halfmove_clock = 0 # Number of moves since the last capture or pawn move, for the fifty-move rule
+        self.fullmove_number = 1 # Number of the current move, which increases after each move of the enemy
+
+        self.hash = 0 # Zobrist hash of the position. An empty board with the player to move has a hash of 0.
+        self.history = [] # Undo records of the moves made, the last one at the end
+
+    def put_piece(self, color, piece_type, square):
+        "Put a piece of the given color and type on a square"
+        bit = SQUARE_BITS[square] # Bit which represents the square
+        self.bitboards[color][piece_type] |= bit
+        self.occupancy[color] |= bit
+        self.all_occupancy |= bit
+        self.mailbox[square] = PIECES[color][piece_type]
+        self.hash ^= PIECE_KEYS[color][piece_type][square]
+
+    def remove_piece(self, color, piece_type, square):
+        "Remove a piece of the given color and type from a square"
+        bit = SQUARE_BITS[square] # Bit which represents the square
+        self.bitboards[color][piece_type] &= ~bit
+        self.occupancy[color] &= ~bit
+        self.all_occupancy &= ~bit
+        self.mailbox[square] = None
+        self.hash ^= PIECE_KEYS[color][piece_type][square]
+
+    def move_piece(self, color, piece_type, from_square, to_square):
+        "Move a piece of the given color and type from a square to another one"
+        move_bits = SQUARE_BITS[from_square] | SQUARE_BITS[to_square] # Both squares are flipped at once
+        self.bitboards[color][piece_type] ^= move_bits
+        self.occupancy[color] ^= move_bits
+        self.all_occupancy ^= move_bits
+        self.mailbox[to_square] = self.mailbox[from_square]
+        self.mailbox[from_square] = None
+        keys = PIECE_KEYS[color][piece_type]
+        self.hash ^= keys[from_square] ^ keys[to_square]
+
+    def is_free(self, square):
+        "Returns True if no piece stands on the square"
+        return not self.all_occupancy & SQUARE_BITS[square]
+
+    def squares_of(self, color):
+        "Returns the bitboard of the squares held by a color"
+        return self.occupancy[color]
+
+    def pieces_of(self, color, piece_type):
+        "Returns the bitboard of the squares held by the pieces of a color and a type"
+        return self.bitboards[color][piece_type]
+
+    def piece_at(self, square):
+        "Returns a (color, piece_type) tuple for the piece standing on a square, or None if the square is free"
+        return self.mailbox[square]
+
+    def king_square(self, color):
+        "Returns the square of the king of a color"
+        return self.bitboards[color][KING].bit_length() - 1
+
+    def copy(self):
+        "Returns an independent copy of the position"
+        position = Position.__new__(Position) # Skip __init__ since every attribute is copied below
+        position.bitboards = [self.bitboards[WHITE][:], self.bitboards[BLACK][:]]
+        position.occupancy = self.occupancy[:]
+        position.all_occupancy = self.all_occupancy
+        position.mailbox = self.mailbox[:]
+        position.side_to_move = self.side_to_move
+        position.castling_rights = self.castling_rights
+        position.en_passant = self.en_passant
+        position.halfmove_clock = self.halfmove_clock
+        position.fullmove_number = self.fullmove_number
+        position.hash = self.hash
+        position.history = self.history[:]
+        return position
+
+    def refresh_hash(self):
+        "Computes the hash again after the side to move, the castling rights or the en passant square were changed by hand"
+        self.hash = compute_hash(self)
+
+    @classmethod
+    def from_fen(cls, fen):
+        "Returns a new Position described by a FEN string"
+        fields = fen.split()
+        if len(fields) < 4: # The piece placement, side to move, castling and en passant fields are required
+            raise IllegalValueException(message=f"FEN string '{fen}' must have at least 4 fields")
+
+        position = cls()
+        rows = fields[0].split("/") # Rows of the board, from the top (rank 8) to the bottom (rank 1)
+        if len(rows) != 8:
+            raise IllegalValueException(message=f"FEN string '{fen}' must describe 8 rows")
+        for row_number, row in enumerate(rows):
+            rank = 7 - row_number
+            file = 0
+            for letter in row:
+                if letter.isdigit(): # A digit is a number of free squares
+                    file += int(letter)
+                elif letter.lower() in FEN_PIECE_LETTERS:
+                    if file > 7:
+                        raise IllegalValueException(message=f"Row '{row}' of FEN string '{fen}' is too long")
+                    color = WHITE if letter.isupper() else BLACK
+                    position.put_piece(color, FEN_PIECE_LETTERS.index(letter.lower()), rank * 8 + file)
+                    file += 1
+                else:
+                    raise IllegalValueException(message=f"Unknown letter '{letter}' in FEN string '{fen}'")
+            if file != 8:
+                raise IllegalValueException(message=f"Row '{row}' of FEN string '{fen}' doesn't have 8 squares")
+
+        if fields[1] not in ("w", "b"):
+            raise IllegalValueException(message=f"Side to move of FEN string '{fen}' must be 'w' or 'b'")
+        position.side_to_move = WHITE if fields[1] == "w" else BLACK
+
+        for castling_right, letter in FEN_CASTLING_LETTERS:
+            if letter in fields[2]:
+                position.castling_rights |= castling_right
+
+        position.en_passant = None if fields[3] == "-" else parse_square(fields[3])
+        if len(fields) > 5: # The move counters are optional
+            position.halfmove_clock = int(fields[4])
+            position.fullmove_number = int(fields[5])
+        position.refresh_hash()
+        return position
+
+    def to_fen(self):
+        "Returns the FEN string which describes the position"
+        rows = []
+        for rank in range(7, -1, -1): # From the top row to the bottom row
+            row = ""
+            free_squares = 0
+            for file in range(8):
+                piece = self.piece_at(rank * 8 + file)
+                if piece is None:
+                    free_squares += 1
+                    continue
+                if free_squares: # Write the number of free squares before the piece
+                    row += str(free_squares)
+                    free_squares = 0
+                letter = FEN_PIECE_LETTERS[piece[1]]
+                row += letter.upper() if piece[0] == WHITE else letter
+            if free_squares:
+                row += str(free_squares)
+            rows.append(row)
+
+        castling = "".join(letter for castling_right, letter in FEN_CASTLING_LETTERS if self.castling_rights & castling_right) or "-"
+        en_passant = "-" if self.en_passant is None else square_name(self.en_passant)
+        side = "w" if self.side_to_move == WHITE else "b"
+        return f"{'/'.join(rows)} {side} {castling} {en_passant} {self.halfmove_clock} {self.fullmove_number}"
+
+    def clear(self):
+        "Remove all the pieces from the position"
+        self.__init__()
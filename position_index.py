@@ -0,0 +1,324 @@
+"""position_index.py contains a PositionIndex class which finds the games which reached a position, and the moves played from it, without reading the games again.
+   The index is a directory of segment files. Each segment is a sorted list of fixed-size records, one for each move of each game:
+   the Zobrist hash of the position before the move, the number of the game, the ply, the key of the move and the score of the game for the side
+   which played the move. The position each game ends in has a record too, with the key END_OF_GAME. All the records of a position are next to
+   each other, ordered by game and ply, so a query is a binary search in each segment, read through mmap, which only touches the pages it needs,
+   and the games are read in order until enough are found.
+   Next to each segment, a .stats file holds the number of wins, draws, losses and unknown results of each move from each position of the segment,
+   so the statistics of a popular position are a few records to read instead of one for each game.
+
+   Segments are built in bulk like an LSM tree: the records are sorted in memory by runs, the runs are written to temporary files
+   and merged into a new segment. Adding games creates a new segment, and compact merges all the segments into one to keep the queries fast.
+   The headers of the games are kept in games.tsv, with the offset of each line in games.offsets, to show the games found.
+
+   Examples :
+       python position_index.py build games.pgn --directory index --workers 4      Add the games of a PGN file to the index
+       python position_index.py query --fen "<FEN>" --directory index             Show the moves played from a position and the games which reached it
+       python position_index.py compact --directory index                          Merge all the segments into one
+"""
+import argparse
+import heapq
+import mmap
+import os
+import struct
+import sys
+import time
+from itertools import islice
+from position import * # Import position.py for the Position class
+from rules import legal_moves, move_key, move_to_san # Import rules.py to turn the keys of the moves back into moves
+from pgn import import_games # Import pgn.py to read and check the games
+
+
+RECORD = struct.Struct(">QIHHB") # Hash of the position, number of the game, ply, key of the move, score of the game for the side which moved
+RECORD_SIZE = RECORD.size
+HASH = struct.Struct(">Q") # The first field of a record, read alone during the binary search
+STATS = struct.Struct(">QHIIII") # Hash of the position, key of the move, then the number of losses, draws, wins and unknown results
+STATS_SIZE = STATS.size
+END_OF_GAME = 0 # Key of the record of the position a game ends in. move_key is never 0.
+OFFSET = struct.Struct(">Q") # Offset of a line of games.tsv
+RUN_SIZE = 1000000 # Records sorted in memory before being written to a temporary run file
+READ_RECORDS = 4096 # Records read at once when a run file is merged
+
+# Score of the game for the side which played the move
+LOSS = 0
+DRAW = 1
+WIN = 2
+UNKNOWN = 3
+RESULT_SCORES = {"1-0": (WIN, LOSS), "0-1": (LOSS, WIN), "1/2-1/2": (DRAW, DRAW)} # Indexed by color, UNKNOWN for any other result
+GAME_HEADERS = ["White", "Black", "Result", "Date", "Event"] # Headers kept in games.tsv
+
+
+def _segment_paths(directory):
+    "Returns the paths of the segment files of an index, from the oldest to the newest"
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.startswith("segment-") and name.endswith(".idx"))
+
+
+def _stats_path(segment_path):
+    "Returns the path of the statistics file of a segment"
+    return segment_path[:-len(".idx")] + ".stats"
+
+
+def _first_record(memory, record_count, record_size, hash_key):
+    "Returns the number of the first record of a sorted memory map whose hash isn't lower than hash_key, by a binary search"
+    low, high = 0, record_count
+    while low < high:
+        middle = (low + high) // 2
+        if HASH.unpack_from(memory, middle * record_size)[0] < hash_key:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def _read_run(path):
+    "Yields the records of a sorted file, as tuples, reading many records at once"
+    with open(path, "rb") as run_file:
+        while True:
+            block = run_file.read(RECORD_SIZE * READ_RECORDS)
+            if not block:
+                break
+            yield from RECORD.iter_unpack(block)
+
+
+def _write_run(path, records):
+    "Writes records, already sorted, to a file"
+    pack = RECORD.pack
+    with open(path, "wb") as run_file:
+        for start in range(0, len(records), READ_RECORDS):
+            run_file.write(b"".join(pack(*record) for record in records[start:start + READ_RECORDS]))
+
+
+def _write_merged(path, paths, stats_path):
+    """Merges sorted files into a new sorted file, without loading them in memory, and returns the number of records written.
+       The statistics of the moves of each position are written to stats_path at the same time, sorted by hash and move key."""
+    count = 0
+    pack, pack_stats = RECORD.pack, STATS.pack
+    with open(path + ".tmp", "wb") as output, open(stats_path + ".tmp", "wb") as stats_output:
+        buffer = []
+        stats_buffer = []
+        current_hash = None
+        moves = {} # Counts of each move key from the position of current_hash, indexed by score
+        for record in heapq.merge(*[_read_run(run_path) for run_path in paths]):
+            buffer.append(pack(*record))
+            if len(buffer) == READ_RECORDS:
+                output.write(b"".join(buffer))
+                count += len(buffer)
+                buffer = []
+            if record[0] != current_hash: # The records of a position are all read: its statistics are complete
+                stats_buffer.extend(pack_stats(current_hash, key, *moves[key]) for key in sorted(moves))
+                if len(stats_buffer) >= READ_RECORDS:
+                    stats_output.write(b"".join(stats_buffer))
+                    stats_buffer = []
+                current_hash = record[0]
+                moves = {}
+            counts = moves.get(record[3])
+            if counts is None:
+                counts = moves[record[3]] = [0, 0, 0, 0] # Losses, draws, wins, unknown, as the score codes
+            counts[record[4]] += 1
+        stats_buffer.extend(pack_stats(current_hash, key, *moves[key]) for key in sorted(moves))
+        output.write(b"".join(buffer))
+        stats_output.write(b"".join(stats_buffer))
+        count += len(buffer)
+    os.replace(stats_path + ".tmp", stats_path)
+    os.replace(path + ".tmp", path) # The segment only appears once it's complete, after its statistics
+    return count
+
+
+def build_index(pgn_paths, directory, workers=1, run_size=RUN_SIZE):
+    """Adds the games of PGN files to an index, as a new segment, and returns a (games, records) tuple.
+    - workers is the number of processes which check the moves of the games
+    - run_size is the number of records sorted in memory at once, which bounds the memory used"""
+    os.makedirs(directory, exist_ok=True)
+    offsets_path = os.path.join(directory, "games.offsets")
+    first_game = os.path.getsize(offsets_path) // OFFSET.size if os.path.exists(offsets_path) else 0 # Games already in the index
+    segment_path = os.path.join(directory, f"segment-{len(_segment_paths(directory)) + 1:06d}.idx")
+
+    run_paths = []
+    records = []
+    game_count = 0
+    with open(os.path.join(directory, "games.tsv"), "ab") as games_file, open(offsets_path, "ab") as offsets_file:
+        def add_game(game_number, game):
+            "Write the headers of a game and the offset of its line"
+            nonlocal game_count
+            offsets_file.write(OFFSET.pack(games_file.tell()))
+            games_file.write(("\t".join(game.headers.get(name, "?").replace("\t", " ") for name in GAME_HEADERS) + "\n").encode("utf-8"))
+            game_count += 1
+
+        for pgn_path in pgn_paths:
+            with open(pgn_path, encoding="utf-8", errors="replace") as pgn_file:
+                base = first_game + game_count # Number of the first game of this file in the index
+                for record in import_games(pgn_file, workers, on_game=add_game, final_positions=True):
+                    score = RESULT_SCORES[record.result][record.side_to_move] if record.result in RESULT_SCORES else UNKNOWN
+                    key = END_OF_GAME if record.move is None else move_key(record.move)
+                    records.append((record.hash, base + record.game, record.ply, key, score))
+                    if len(records) >= run_size: # Sort this run and keep it on disk, so the memory used doesn't grow
+                        records.sort()
+                        run_paths.append(f"{segment_path}.run{len(run_paths)}")
+                        _write_run(run_paths[-1], records)
+                        records = []
+
+    records.sort()
+    run_paths.append(f"{segment_path}.run{len(run_paths)}")
+    _write_run(run_paths[-1], records)
+    count = _write_merged(segment_path, run_paths, _stats_path(segment_path))
+    for run_path in run_paths:
+        os.remove(run_path)
+    return game_count, count
+
+
+def compact(directory):
+    "Merges all the segments of an index into one, and returns the number of records"
+    paths = _segment_paths(directory)
+    if len(paths) <= 1:
+        return sum(os.path.getsize(path) // RECORD_SIZE for path in paths)
+    merged_path = os.path.join(directory, "segment-000000.merged")
+    count = _write_merged(merged_path, paths, merged_path + ".stats")
+    for path in paths:
+        os.remove(path)
+        if os.path.exists(_stats_path(path)):
+            os.remove(_stats_path(path))
+    compacted_path = os.path.join(directory, "segment-000001.idx")
+    os.replace(merged_path + ".stats", _stats_path(compacted_path))
+    os.replace(merged_path, compacted_path)
+    return count
+
+
+class PositionIndex:
+    """The PositionIndex class answers the queries on an index directory built by build_index.
+       - directory is the directory of the index"""
+    def __init__(self, directory):
+        "Open the segments and the list of the games through mmap"
+        self.directory = directory
+        self.files = []
+        self.segments = [] # (memory map, number of records, statistics memory map or None, number of statistics) of each segment
+        for path in _segment_paths(directory):
+            memory = self._map(path)
+            if memory is not None:
+                stats = self._map(_stats_path(path)) # Missing in the indexes built before the statistics were kept
+                self.segments.append((memory, len(memory) // RECORD_SIZE, stats, len(stats) // STATS_SIZE if stats is not None else 0))
+        self.games = self._map(os.path.join(directory, "games.tsv"))
+        self.offsets = self._map(os.path.join(directory, "games.offsets"))
+
+    def _map(self, path):
+        "Returns a read-only memory map of a file, or None if it's missing or empty"
+        if not os.path.exists(path) or not os.path.getsize(path):
+            return None
+        mapped_file = open(path, "rb")
+        self.files.append(mapped_file)
+        return mmap.mmap(mapped_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def _segment_records(memory, record_count, hash_key):
+        "Yields the (hash, game, ply, move key, score) records of a position in one segment, ordered by game and ply"
+        index = _first_record(memory, record_count, RECORD_SIZE, hash_key)
+        while index < record_count:
+            record = RECORD.unpack_from(memory, index * RECORD_SIZE)
+            if record[0] != hash_key:
+                break
+            yield record
+            index += 1
+
+    def records(self, hash_key):
+        "Yields the (hash, game, ply, move key, score) records of a position in every segment"
+        for memory, record_count, stats, stats_count in self.segments:
+            yield from self._segment_records(memory, record_count, hash_key)
+
+    def occurrences(self, position, limit=None):
+        """Returns the sorted list of the (game, ply) tuples where a position occurred, at most limit of them.
+           The records of each segment are already in this order, so they are merged and only the first limit ones are read."""
+        merged = heapq.merge(*[self._segment_records(memory, record_count, position.hash) for memory, record_count, stats, stats_count in self.segments])
+        return [(record[1], record[2]) for record in islice(merged, limit)]
+
+    def move_stats(self, position):
+        """Returns the statistics of the moves played from a position, the most played first, as a list of dictionaries:
+           move, count, wins, draws, losses (for the side which played the move) and score (the share of the points won, from 0 to 1)"""
+        stats = {}
+        for memory, record_count, stats_memory, stats_count in self.segments:
+            if stats_memory is None: # Older segment without statistics: count its records
+                for record in self._segment_records(memory, record_count, position.hash):
+                    counts = stats.setdefault(record[3], [0, 0, 0, 0]) # Losses, draws, wins, unknown, as the score codes
+                    counts[record[4]] += 1
+                continue
+            index = _first_record(stats_memory, stats_count, STATS_SIZE, position.hash)
+            while index < stats_count:
+                hash_key, key, *segment_counts = STATS.unpack_from(stats_memory, index * STATS_SIZE)
+                if hash_key != position.hash:
+                    break
+                counts = stats.setdefault(key, [0, 0, 0, 0])
+                for score, count in enumerate(segment_counts):
+                    counts[score] += count
+                index += 1
+        moves = {move_key(move): move for move in legal_moves(position)} # Keys which aren't legal here come from a collision of hashes, or are END_OF_GAME
+        result = []
+        for key, (losses, draws, wins, unknown) in stats.items():
+            if key not in moves:
+                continue
+            decided = wins + draws + losses
+            result.append({"move": moves[key], "count": wins + draws + losses + unknown, "wins": wins, "draws": draws, "losses": losses,
+                           "score": (wins + draws / 2) / decided if decided else None})
+        result.sort(key=lambda stat: stat["count"], reverse=True)
+        return result
+
+    def game_count(self):
+        "Returns the number of games of the index"
+        return len(self.offsets) // OFFSET.size if self.offsets is not None else 0
+
+    def game_headers(self, game):
+        "Returns a dictionary of the headers kept for a game (White, Black, Result, Date, Event)"
+        start = OFFSET.unpack_from(self.offsets, game * OFFSET.size)[0]
+        end = self.games.find(b"\n", start)
+        return dict(zip(GAME_HEADERS, self.games[start:end].decode("utf-8").split("\t")))
+
+    def close(self):
+        "Close the files of the index"
+        for memory, record_count, stats, stats_count in self.segments:
+            memory.close()
+            if stats is not None:
+                stats.close()
+        for memory in (self.games, self.offsets):
+            if memory is not None:
+                memory.close()
+        for mapped_file in self.files:
+            mapped_file.close()
+
+
+def main(arguments=None):
+    "Read the command line to build, query or compact an index"
+    parser = argparse.ArgumentParser(description="Build and query an index of the positions of a database of games.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="add the games of PGN files to the index")
+    build.add_argument("pgn", nargs="+", help="PGN files to read")
+    build.add_argument("--workers", type=int, default=1, help="number of processes which check the games (default: 1)")
+    query = commands.add_parser("query", help="show the moves played from a position and the games which reached it")
+    query.add_argument("--fen", default=START_FEN, help="position to look up, the starting position by default")
+    query.add_argument("--games", type=int, default=10, help="number of games to show (default: 10)")
+    compact_command = commands.add_parser("compact", help="merge all the segments into one")
+    for command in (build, query, compact_command):
+        command.add_argument("--directory", default="position_index", help="directory of the index (default: position_index)")
+    options = parser.parse_args(arguments)
+
+    start = time.perf_counter()
+    if options.command == "build":
+        games, records = build_index(options.pgn, options.directory, options.workers)
+        print(f"{games} games and {records} positions added in {time.perf_counter() - start:.2f} s")
+    elif options.command == "compact":
+        print(f"{compact(options.directory)} positions in one segment, merged in {time.perf_counter() - start:.2f} s")
+    else:
+        index = PositionIndex(options.directory)
+        position = Position.from_fen(options.fen)
+        stats = index.move_stats(position)
+        occurrences = index.occurrences(position, options.games)
+        seconds = time.perf_counter() - start
+        for stat in stats:
+            score = "-" if stat["score"] is None else f"{stat['score']:.0%}"
+            print(f"{move_to_san(position, stat['move']):8} {stat['count']:8} games  +{stat['wins']} ={stat['draws']} -{stat['losses']}  score {score}")
+        for game, ply in occurrences:
+            headers = index.game_headers(game)
+            print(f"game {game}, ply {ply}: {headers['White']} - {headers['Black']} {headers['Result']} ({headers['Event']}, {headers['Date']})")
+        print(f"answered in {seconds * 1000:.1f} ms from {len(index.segments)} segments and {index.game_count()} games")
+        index.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,467 @@
+"""rules.py contains the rules of chess: it lists the legal moves of a position and applies a move to a position.
+   It only works on Position objects and doesn't import pygame or tkinter, so it can be used without any window or display,
+   for example to analyse thousands of positions on a server.
+"""
+from collections import namedtuple
+from position import * # Import position.py for the Position class, colors and piece types
+from attacks import * # Import attacks.py for the precomputed attack tables
+from zobrist import CASTLING_KEYS, EN_PASSANT_KEYS, SIDE_KEY # Import zobrist.py to update the hash of the position incrementally
+from movegen import PAWN_PUSH, PIECE_MOVE_TYPES, generate_targets # Import movegen.py to find the targets of each piece
+from instrumentation import metrics # Import instrumentation.py to count the move generations
+
+
+# Flags of a move, which can be combined
+CAPTURE = 1 # The move takes an enemy piece
+DOUBLE_PUSH = 2 # A pawn moves by two cells from its starting rank
+EN_PASSANT = 4 # A pawn takes an enemy pawn en passant
+CASTLING = 8 # The king castles, and the rook moves with it
+
+# A move from a square to another one. promotion is the piece type a pawn becomes on the last rank, or None.
+# Moves are never created during the move generation: each move is created once and shared, found in a table by its code,
+# a small int which packs its squares, its promotion and its flags (see encode_move). A list of moves is then only a list of references.
+Move = namedtuple("Move", ["from_square", "to_square", "promotion", "flags"])
+
+# Record pushed on the undo stack of a position by make_move, with everything make_move can't find again from the new position.
+# piece_type is the type of the moving piece, captured_type the type of the captured piece or None.
+UndoRecord = namedtuple("UndoRecord", ["move", "piece_type", "captured_type", "castling_rights", "en_passant", "halfmove_clock", "hash"])
+
+PROMOTION_RANKS = [0xFF00000000000000, 0x00000000000000FF] # Ranks on which the pawns of each color are promoted, indexed by color
+PROMOTION_TYPES = [QUEEN, ROOK, BISHOP, KNIGHT] # Piece types a pawn can become
+
+# For each castling right: (king's square, king's target, rook's square, rook's target, cells which must be free, cells which mustn't be attacked)
+CASTLING_MOVES = {WHITE_KINGSIDE: (4, 6, 7, 5, SQUARE_BITS[5] | SQUARE_BITS[6], [4, 5, 6]),
+                  WHITE_QUEENSIDE: (4, 2, 0, 3, SQUARE_BITS[1] | SQUARE_BITS[2] | SQUARE_BITS[3], [4, 3, 2]),
+                  BLACK_KINGSIDE: (60, 62, 63, 61, SQUARE_BITS[61] | SQUARE_BITS[62], [60, 61, 62]),
+                  BLACK_QUEENSIDE: (60, 58, 56, 59, SQUARE_BITS[57] | SQUARE_BITS[58] | SQUARE_BITS[59], [60, 59, 58])}
+CASTLING_ROOK_MOVES = {king_target: (rook_square, rook_target) for king_square, king_target, rook_square, rook_target, free_cells, safe_cells in CASTLING_MOVES.values()} # Rook's move, indexed by the king's target
+CASTLING_SIDES = [[WHITE_KINGSIDE, WHITE_QUEENSIDE], [BLACK_KINGSIDE, BLACK_QUEENSIDE]] # Castling rights of each color
+
+# Castling rights which remain after a piece leaves or reaches a square. Moving the king or a rook, or capturing a rook, loses a right.
+CASTLING_RIGHTS_KEPT = [ALL_CASTLING_RIGHTS] * 64
+CASTLING_RIGHTS_KEPT[4] = ALL_CASTLING_RIGHTS & ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLING_RIGHTS_KEPT[7] = ALL_CASTLING_RIGHTS & ~WHITE_KINGSIDE
+CASTLING_RIGHTS_KEPT[0] = ALL_CASTLING_RIGHTS & ~WHITE_QUEENSIDE
+CASTLING_RIGHTS_KEPT[60] = ALL_CASTLING_RIGHTS & ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+CASTLING_RIGHTS_KEPT[63] = ALL_CASTLING_RIGHTS & ~BLACK_KINGSIDE
+CASTLING_RIGHTS_KEPT[56] = ALL_CASTLING_RIGHTS & ~BLACK_QUEENSIDE
+
+
+def encode_move(from_square, to_square, promotion=None, flags=0):
+    "Returns the code of a move: the from square (6 bits), the to square (6 bits), the promotion type + 1 (3 bits, 0 without promotion) and the flags (4 bits)"
+    return from_square | (to_square << 6) | ((0 if promotion is None else promotion + 1) << 12) | (flags << 15)
+
+
+_MOVES = {} # Shared Move of each code, created the first time it's needed
+
+
+def decode_move(code):
+    "Returns the shared Move of a code given by encode_move"
+    move = _MOVES.get(code)
+    if move is None:
+        promotion = (code >> 12) & 7
+        move = _MOVES[code] = Move(code & 63, (code >> 6) & 63, promotion - 1 if promotion else None, code >> 15)
+    return move
+
+
+def move_code(move):
+    "Returns the code of a Move, which packs it in an int of 19 bits"
+    return encode_move(move.from_square, move.to_square, move.promotion, move.flags)
+
+
+# The quiet moves and the captures between any two squares, created at once since they are most of the moves generated, indexed by from square and to square
+QUIET_MOVES = [[decode_move(encode_move(from_square, to_square)) for to_square in range(64)] for from_square in range(64)]
+CAPTURE_MOVES = [[decode_move(encode_move(from_square, to_square, None, CAPTURE)) for to_square in range(64)] for from_square in range(64)]
+
+STARTING_ROW = [ROOK, KNIGHT, BISHOP, QUEEN, KING, BISHOP, KNIGHT, ROOK] # Piece types of the first row, from left to right
+
+
+def starting_position():
+    "Returns a new Position with the pieces placed like at the beginning of a game"
+    position = Position()
+    for file, piece_type in enumerate(STARTING_ROW): # For each column of the board
+        position.put_piece(WHITE, piece_type, file)
+        position.put_piece(WHITE, PAWN, 8 + file)
+        position.put_piece(BLACK, PAWN, 48 + file)
+        position.put_piece(BLACK, piece_type, 56 + file)
+    position.castling_rights = ALL_CASTLING_RIGHTS
+    position.refresh_hash()
+    return position
+
+
+def is_square_attacked(position, square, by_color):
+    "Returns True if a piece of the color by_color attacks the square"
+    pieces = position.bitboards[by_color] # Bitboards of the attacking side
+    if KNIGHT_ATTACKS[square] & pieces[KNIGHT]:
+        return True
+    if KING_ATTACKS[square] & pieces[KING]:
+        return True
+    if PAWN_ATTACKS[by_color ^ 1][square] & pieces[PAWN]: # A pawn attacks the square if a pawn of the other color on the square would attack it
+        return True
+    occupancy = position.all_occupancy
+    if bishop_attacks(square, occupancy) & (pieces[BISHOP] | pieces[QUEEN]):
+        return True
+    if rook_attacks(square, occupancy) & (pieces[ROOK] | pieces[QUEEN]):
+        return True
+    return False
+
+
+def is_in_check(position, color):
+    "Returns True if the king of the color is attacked"
+    return is_square_attacked(position, position.king_square(color), color ^ 1)
+
+
+def generate_moves(position):
+    """Returns the list of the pseudo-legal moves of the side to move.
+       Pseudo-legal moves follow the way each piece moves, but may leave the king in check."""
+    metrics.count("move_generations")
+    color = position.side_to_move
+    enemy_squares = position.occupancy[color ^ 1]
+    moves = []
+
+    for piece_type in range(len(PIECE_NAMES)): # For each type of piece
+        move_types = PIECE_MOVE_TYPES[piece_type]
+        for from_square in iterate_squares(position.bitboards[color][piece_type]): # For each piece of this type
+            targets = generate_targets(position, from_square, color, move_types)
+
+            if piece_type == PAWN:
+                if position.en_passant is not None and PAWN_ATTACKS[color][from_square] & SQUARE_BITS[position.en_passant]:
+                    moves.append(decode_move(encode_move(from_square, position.en_passant, None, CAPTURE | EN_PASSANT)))
+
+                for to_square in iterate_squares(targets):
+                    flags = CAPTURE if enemy_squares & SQUARE_BITS[to_square] else 0
+                    if PROMOTION_RANKS[color] & SQUARE_BITS[to_square]: # If the pawn reaches the last rank, it can become any of the promotion types
+                        for promotion in PROMOTION_TYPES:
+                            moves.append(decode_move(encode_move(from_square, to_square, promotion, flags)))
+                    else:
+                        if abs(to_square - from_square) == 16:
+                            moves.append(decode_move(encode_move(from_square, to_square, None, DOUBLE_PUSH)))
+                        else:
+                            moves.append((CAPTURE_MOVES if flags else QUIET_MOVES)[from_square][to_square])
+            else:
+                quiet_moves, capture_moves = QUIET_MOVES[from_square], CAPTURE_MOVES[from_square]
+                for to_square in iterate_squares(targets):
+                    moves.append(capture_moves[to_square] if enemy_squares & SQUARE_BITS[to_square] else quiet_moves[to_square])
+
+    for castling_right in CASTLING_SIDES[color]: # For each way the side can castle
+        if position.castling_rights & castling_right:
+            king_square, king_target, rook_square, rook_target, free_cells, safe_cells = CASTLING_MOVES[castling_right]
+            if position.all_occupancy & free_cells: # Castling needs free cells between the king and the rook
+                continue
+            if any(is_square_attacked(position, cell, color ^ 1) for cell in safe_cells): # The king can't castle out of, through or into check
+                continue
+            moves.append(decode_move(encode_move(king_square, king_target, None, CASTLING)))
+
+    return moves
+
+
+def make_move(position, move):
+    """Apply a move to a position. The move must be one of the moves generated for this position.
+       The position is updated incrementally, its hash included, and an undo record is pushed on its history so unmake_move can revert the move."""
+    color = position.side_to_move
+    enemy = color ^ 1
+    from_square, to_square, promotion, flags = move
+    piece_type = position.mailbox[from_square][1] # Type of the moving piece
+    previous_hash = position.hash
+    previous_castling_rights = position.castling_rights
+    previous_en_passant = position.en_passant
+
+    captured_type = None
+    if flags & EN_PASSANT: # The captured pawn stands behind the target square
+        captured_type = PAWN
+        position.remove_piece(enemy, PAWN, to_square - PAWN_PUSH[color])
+    elif flags & CAPTURE:
+        captured_type = position.mailbox[to_square][1]
+        position.remove_piece(enemy, captured_type, to_square)
+
+    position.history.append(UndoRecord(move, piece_type, captured_type, previous_castling_rights, previous_en_passant, position.halfmove_clock, previous_hash))
+
+    if promotion is not None: # The pawn is replaced by the new piece on the last rank
+        position.remove_piece(color, PAWN, from_square)
+        position.put_piece(color, promotion, to_square)
+    else:
+        position.move_piece(color, piece_type, from_square, to_square)
+
+    if flags & CASTLING: # The rook jumps over the king
+        rook_square, rook_target = CASTLING_ROOK_MOVES[to_square]
+        position.move_piece(color, ROOK, rook_square, rook_target)
+
+    position.castling_rights = previous_castling_rights & CASTLING_RIGHTS_KEPT[from_square] & CASTLING_RIGHTS_KEPT[to_square]
+    position.en_passant = from_square + PAWN_PUSH[color] if flags & DOUBLE_PUSH else None
+
+    # Update the parts of the hash which don't depend on the pieces
+    hash_key = position.hash ^ SIDE_KEY ^ CASTLING_KEYS[previous_castling_rights] ^ CASTLING_KEYS[position.castling_rights]
+    if previous_en_passant is not None:
+        hash_key ^= EN_PASSANT_KEYS[previous_en_passant & 7]
+    if position.en_passant is not None:
+        hash_key ^= EN_PASSANT_KEYS[position.en_passant & 7]
+    position.hash = hash_key
+
+    if piece_type == PAWN or captured_type is not None:
+        position.halfmove_clock = 0
+    else:
+        position.halfmove_clock += 1
+    if color == BLACK:
+        position.fullmove_number += 1
+    position.side_to_move = enemy
+
+
+def unmake_move(position):
+    "Revert the last move made with make_move, using the undo record on top of the history of the position"
+    move, piece_type, captured_type, castling_rights, en_passant, halfmove_clock, hash_key = position.history.pop()
+    from_square, to_square, promotion, flags = move
+    color = position.side_to_move ^ 1 # The side which made the move
+    position.side_to_move = color
+    if color == BLACK:
+        position.fullmove_number -= 1
+
+    if flags & CASTLING: # Put the rook back in its corner
+        rook_square, rook_target = CASTLING_ROOK_MOVES[to_square]
+        position.move_piece(color, ROOK, rook_target, rook_square)
+
+    if promotion is not None: # The promoted piece becomes a pawn again
+        position.remove_piece(color, promotion, to_square)
+        position.put_piece(color, PAWN, from_square)
+    else:
+        position.move_piece(color, piece_type, to_square, from_square)
+
+    if flags & EN_PASSANT:
+        position.put_piece(color ^ 1, PAWN, to_square - PAWN_PUSH[color])
+    elif captured_type is not None:
+        position.put_piece(color ^ 1, captured_type, to_square)
+
+    position.castling_rights = castling_rights
+    position.en_passant = en_passant
+    position.halfmove_clock = halfmove_clock
+    position.hash = hash_key # The saved hash replaces the one changed by the pieces put back
+
+
+def repetition_count(position):
+    "Returns how many times the current position occurred, counting the positions of the history since the last capture or pawn move"
+    count = 1
+    history = position.history
+    for distance in range(2, min(position.halfmove_clock, len(history)) + 1, 2): # Only the positions with the same side to move can be the same
+        if history[-distance].hash == position.hash:
+            count += 1
+    return count
+
+
+def is_legal(position, move):
+    "Returns True if a move given by generate_moves doesn't leave the king of the side to move in check. The move is made, tested and unmade."
+    color = position.side_to_move
+    make_move(position, move)
+    legal = not is_in_check(position, color)
+    unmake_move(position)
+    return legal
+
+
+# The attack maps aren't kept up to date by make_move and unmake_move. Keeping the attacks of each piece in the undo record, and
+# recomputing the moved pieces and the sliding pieces whose rays crossed a changed square, gives the same maps, but it costs more than
+# it saves: the perft suite is 3 to 6% faster, while the search is 15 to 25% slower, since most of the moves it makes lead to quiescence
+# nodes which never look at a king move. Building the union of each color at each move made it slower still (perft 20% slower).
+# So the checks and the pins come from the sniper scan of MoveFilter, and the map of the enemy is only computed for the king moves.
+def attacked_squares(position, color):
+    """Returns the bitboard of the squares attacked by the pieces of a color. The sliding pieces see through the king of the other color,
+       so the king can't escape a check by stepping back along the line of the attack.
+       The map is computed from the pieces each time (see the note above)."""
+    pieces = position.bitboards[color]
+    occupancy = position.all_occupancy & ~position.bitboards[color ^ 1][KING]
+    attacks = KING_ATTACKS[position.king_square(color)] if pieces[KING] else 0
+    pawn_attacks = PAWN_ATTACKS[color]
+    for square in iterate_squares(pieces[PAWN]):
+        attacks |= pawn_attacks[square]
+    for square in iterate_squares(pieces[KNIGHT]):
+        attacks |= KNIGHT_ATTACKS[square]
+    for square in iterate_squares(pieces[BISHOP] | pieces[QUEEN]):
+        attacks |= bishop_attacks(square, occupancy)
+    for square in iterate_squares(pieces[ROOK] | pieces[QUEEN]):
+        attacks |= rook_attacks(square, occupancy)
+    return attacks
+
+
+class MoveFilter:
+    """The MoveFilter class tells which moves given by generate_moves are legal, without making them.
+       The enemy pieces which give check and the pieces pinned against the king are found once, then each move costs a few bit tests:
+       - the king can't go to a square attacked by the enemy (see attacked_squares), whose map is computed at the first king move tested
+       - in double check, only the king can move
+       - in check, the other pieces must capture the checking piece or stand between it and the king
+       - a pinned piece must stay on the line which goes through its king and the enemy piece pinning it
+       En passant captures, which can remove two pieces from the same row, are still made and tested with is_legal.
+       - position is the Position whose moves are filtered. The filter must not be used once a move was made on it."""
+    __slots__ = ("position", "king_square", "checkers", "evasions", "pinned", "pin_lines", "enemy_attacks")
+
+    def __init__(self, position):
+        "Find the checking pieces and the pinned pieces of the side to move"
+        color = position.side_to_move
+        enemy = position.bitboards[color ^ 1]
+        king_square = position.king_square(color)
+        checkers = (KNIGHT_ATTACKS[king_square] & enemy[KNIGHT]) | (PAWN_ATTACKS[color][king_square] & enemy[PAWN])
+        pinned = 0
+        pin_lines = {} # Line on which each pinned piece can move, indexed by its square
+        snipers = (rook_attacks(king_square, 0) & (enemy[ROOK] | enemy[QUEEN])) | (bishop_attacks(king_square, 0) & (enemy[BISHOP] | enemy[QUEEN])) # Sliders aiming at the king through any piece
+        for square in iterate_squares(snipers):
+            blockers = BETWEEN[king_square][square] & position.all_occupancy
+            if not blockers: # Nothing stands between them: the king is in check
+                checkers |= SQUARE_BITS[square]
+            elif not blockers & (blockers - 1) and blockers & position.occupancy[color]: # A single piece of the side to move stands between them: it's pinned
+                pinned |= blockers
+                pin_lines[blockers.bit_length() - 1] = LINE[king_square][square]
+
+        self.position = position
+        self.king_square = king_square
+        self.checkers = checkers # Bitboard of the enemy pieces giving check
+        self.evasions = checkers | BETWEEN[king_square][checkers.bit_length() - 1] if checkers else 0 # Squares where a piece stops a single check
+        self.pinned = pinned # Bitboard of the pinned pieces of the side to move
+        self.pin_lines = pin_lines
+        self.enemy_attacks = None # Squares attacked by the enemy, only needed for the king moves
+
+    def is_legal(self, move):
+        "Returns True if a move given by generate_moves for the position doesn't leave the king in check"
+        if move.from_square == self.king_square: # Castling already checks the cells the king crosses
+            if move.flags & CASTLING:
+                return True
+            if self.enemy_attacks is None:
+                self.enemy_attacks = attacked_squares(self.position, self.position.side_to_move ^ 1)
+            return not self.enemy_attacks & SQUARE_BITS[move.to_square]
+        checkers = self.checkers
+        if checkers & (checkers - 1): # Double check
+            return False
+        if move.flags & EN_PASSANT:
+            return is_legal(self.position, move)
+        to_bit = SQUARE_BITS[move.to_square]
+        if checkers and not self.evasions & to_bit:
+            return False
+        if self.pinned & SQUARE_BITS[move.from_square] and not self.pin_lines[move.from_square] & to_bit:
+            return False
+        return True
+
+
+def legal_moves(position):
+    "Returns the list of the legal moves of the side to move, which don't leave its king in check"
+    move_filter = MoveFilter(position)
+    return [move for move in generate_moves(position) if move_filter.is_legal(move)]
+
+
+def has_insufficient_material(position):
+    "Returns True if neither side can checkmate: only the kings are left, with at most one knight or one bishop"
+    for color in (WHITE, BLACK):
+        bitboards = position.bitboards[color]
+        if bitboards[PAWN] or bitboards[ROOK] or bitboards[QUEEN]:
+            return False
+    minor_pieces = sum(bin(position.bitboards[color][piece_type]).count("1") for color in (WHITE, BLACK) for piece_type in (KNIGHT, BISHOP))
+    return minor_pieces <= 1
+
+
+def game_result(position, moves=None):
+    """Returns a (result, reason) tuple if the game is over, or None if it goes on.
+       result is '1-0', '0-1' or '1/2-1/2', and reason is 'checkmate', 'stalemate', 'fifty-move rule', 'threefold repetition' or 'insufficient material'.
+    - moves is the list of the legal moves of the position, if it's already known"""
+    if moves is None:
+        moves = legal_moves(position)
+    if not moves:
+        if is_in_check(position, position.side_to_move):
+            return ("0-1" if position.side_to_move == WHITE else "1-0"), "checkmate"
+        return "1/2-1/2", "stalemate"
+    if position.halfmove_clock >= 100:
+        return "1/2-1/2", "fifty-move rule"
+    if repetition_count(position) >= 3:
+        return "1/2-1/2", "threefold repetition"
+    if has_insufficient_material(position):
+        return "1/2-1/2", "insufficient material"
+    return None
+
+
+def legal_moves_from(position, square):
+    "Returns the list of the legal moves of the piece standing on a square"
+    return [move for move in legal_moves(position) if move.from_square == square]
+
+
+def find_move(position, from_square, to_square, promotion=QUEEN):
+    "Returns the legal move going from a square to another one, or None if there is none. Promotions use the promotion setting."
+    for move in legal_moves_from(position, from_square):
+        if move.to_square == to_square and move.promotion in (None, promotion):
+            return move
+
+
+def move_key(move):
+    "Returns a 16-bit number which identifies a move: its squares and its promotion. It is never 0, since a move can't stay on the same square."
+    return move.from_square | (move.to_square << 6) | ((0 if move.promotion is None else move.promotion + 1) << 12)
+
+
+def move_to_uci(move):
+    "Returns the coordinate notation of a move, such as 'e2e4' or 'e7e8q', as used by the UCI protocol"
+    promotion = "" if move.promotion is None else FEN_PIECE_LETTERS[move.promotion]
+    return square_name(move.from_square) + square_name(move.to_square) + promotion
+
+
+def move_from_uci(position, text):
+    """Returns the legal move of a position written in coordinate notation, such as 'e2e4' or 'e7e8q'.
+       IllegalValueException is raised if it isn't a legal move."""
+    if len(text) not in (4, 5) or (len(text) == 5 and text[4] not in "nbrq"):
+        raise IllegalValueException(message=f"{text} is not a valid move")
+    from_square, to_square = parse_square(text[0:2]), parse_square(text[2:4])
+    promotion = FEN_PIECE_LETTERS.index(text[4]) if len(text) == 5 else None
+    for move in generate_moves(position):
+        if move.from_square == from_square and move.to_square == to_square and move.promotion == promotion and is_legal(position, move):
+            return move
+    raise IllegalValueException(message=f"{text} is not a legal move in this position")
+
+
+def move_to_san(position, move):
+    "Returns the standard algebraic notation of a legal move of a position, such as 'Nf3', 'exd5', 'O-O' or 'e8=Q+', as written in PGN files"
+    piece_type = position.mailbox[move.from_square][1]
+    if move.flags & CASTLING:
+        san = "O-O" if move.to_square > move.from_square else "O-O-O"
+    elif piece_type == PAWN:
+        san = square_name(move.from_square)[0] + "x" if move.flags & CAPTURE else ""
+        san += square_name(move.to_square)
+        if move.promotion is not None:
+            san += "=" + FEN_PIECE_LETTERS[move.promotion].upper()
+    else:
+        san = FEN_PIECE_LETTERS[piece_type].upper()
+        rivals = [other.from_square for other in legal_moves(position) # Other pieces of the same type which can go to the same square
+                  if other.to_square == move.to_square and other.from_square != move.from_square and position.mailbox[other.from_square][1] == piece_type]
+        if rivals:
+            name = square_name(move.from_square)
+            if all(rival & 7 != move.from_square & 7 for rival in rivals): # The file is enough
+                san += name[0]
+            elif all(rival >> 3 != move.from_square >> 3 for rival in rivals): # The rank is enough
+                san += name[1]
+            else:
+                san += name
+        san += ("x" if move.flags & CAPTURE else "") + square_name(move.to_square)
+
+    make_move(position, move)
+    if is_in_check(position, position.side_to_move):
+        san += "#" if not legal_moves(position) else "+"
+    unmake_move(position)
+    return san
+
+
+def move_from_san(position, san):
+    """Returns the legal move of a position written in standard algebraic notation, such as 'Nf3', 'exd5', 'O-O' or 'e8=Q'.
+       Check signs and annotations ('+', '#', '!', '?') are ignored. IllegalValueException is raised if no legal move, or more than one, matches."""
+    text = san.rstrip("+#!?")
+    moves = generate_moves(position) # Only the moves matching the notation are checked for legality, which is much faster than listing the legal moves
+    if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        kingside = len(text) == 3
+        candidates = [move for move in moves if move.flags & CASTLING and (move.to_square > move.from_square) == kingside]
+    else:
+        promotion = None
+        if "=" in text:
+            text, letter = text.split("=", 1)
+            promotion = FEN_PIECE_LETTERS.index(letter.lower()) if len(letter) == 1 and letter.lower() in FEN_PIECE_LETTERS[1:5] else -1
+        piece_type = FEN_PIECE_LETTERS.index(text[0].lower()) if text[:1] in ("N", "B", "R", "Q", "K") else PAWN
+        if piece_type != PAWN:
+            text = text[1:]
+        text = text.replace("x", "")
+        if len(text) < 2:
+            raise IllegalValueException(message=f"{san} is not a valid move")
+        to_square = parse_square(text[-2:])
+        origin = text[:-2] # Optional file and/or rank of the piece which moves
+        candidates = [move for move in moves
+                      if move.to_square == to_square and move.promotion == promotion and position.mailbox[move.from_square][1] == piece_type
+                      and all(character in square_name(move.from_square) for character in origin)]
+    candidates = [move for move in candidates if is_legal(position, move)]
+    if len(candidates) != 1:
+        raise IllegalValueException(message=f"{san} is not a legal move in this position" if not candidates else f"{san} is ambiguous in this position")
+    return candidates[0]
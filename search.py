@@ -0,0 +1,340 @@
+"""search.py contains a Search class which finds the best move of a position, to let the computer play the enemy's pieces.
+   It uses a negamax alpha-beta search with iterative deepening: it searches to depth 1, then 2, then 3,... until the time budget
+   or the depth limit is reached, and always keeps the best move of the last finished depth.
+   Moves are ordered so the best ones are searched first (transposition table move, captures, killer moves, history heuristic),
+   and a quiescence search resolves the captures at the leaves, so the evaluation is never done in the middle of an exchange.
+
+   Example :
+       python search.py --fen "<FEN>" --movetime 2   Search a position for 2 seconds and print each depth
+"""
+import argparse
+import sys
+import time
+from position import * # Import position.py for the Position class
+from rules import * # Import rules.py for the move generation
+from evaluation import evaluate, PIECE_VALUES # Import evaluation.py to score the positions at the leaves
+from transposition import * # Import transposition.py to remember the positions already searched
+from tablebase import Tablebases, WIN, LOSS # Import tablebase.py for the results of the endgame tablebases
+from instrumentation import metrics # Import instrumentation.py to count the nodes searched
+
+
+MATE_SCORE = 100000 # Score of a checkmate. A mate in n plies scores MATE_SCORE - n.
+INFINITE_SCORE = 1000000 # Bigger than any score
+MAX_PLY = 128 # Deepest ply the search can reach
+TIME_CHECK_NODES = 256 # The clock and the stop requests are checked every this many nodes
+
+CAPTURE_ORDER = 1000000 # Order bonus of the captures, which are searched before the quiet moves
+KILLER_ORDER = 900000 # Order bonus of the killer moves, searched right after the captures
+
+
+class SearchStopped(Exception):
+    "An exception raised inside the search when the time budget is over or a stop was requested"
+
+
+class SearchResult:
+    """The SearchResult class holds the result of a search.
+       - best_move is the best move found, or None if the position has no legal move
+       - score is its score in centipawns, seen from the side to move
+       - depth is the last depth fully searched
+       - nodes is the number of positions visited, and seconds the time spent
+       - pv is the principal variation: the best move followed by the expected replies
+       - iterations is the list of the reports of each depth, as given to the on_iteration callback"""
+    def __init__(self):
+        "Init an empty result"
+        self.best_move = None
+        self.score = 0
+        self.depth = 0
+        self.nodes = 0
+        self.seconds = 0.0
+        self.pv = []
+        self.iterations = []
+
+    def nodes_per_second(self):
+        "Returns the speed of the search"
+        return self.nodes / self.seconds if self.seconds > 0 else 0
+
+
+class Search:
+    """The Search class finds the best move of a position.
+       - transposition_table is the TranspositionTable to use. A new table of hash_mb megabytes is created if it's None.
+       - tablebases is an optional tablebase.Tablebases object, which gives the exact score of the endgames it covers
+       The tables of the search (transposition table, killer moves, history) are kept between searches, so they stay warm during a game."""
+    def __init__(self, transposition_table=None, hash_mb=16, tablebases=None):
+        "Init the search and its tables"
+        self.transposition_table = transposition_table if transposition_table is not None else TranspositionTable(hash_mb)
+        self.tablebases = tablebases
+        self.killers = [[None, None] for ply in range(MAX_PLY)] # Two quiet moves which caused a cutoff at each ply
+        self.history = [[[0] * 64 for from_square in range(64)] for color in (WHITE, BLACK)] # Bonus of the quiet moves which caused cutoffs, indexed by color, from square and to square
+        self.nodes = 0 # Positions visited by the current search
+        self.stop_requested = False # Set to True from outside to stop the search as soon as possible
+        self.stop_condition = None # Optional function without arguments, checked with the clock, which returns True when the search must stop
+        self.deadline = None # Time at which the search must stop
+        self.root_moves = None # Legal moves searched at the root
+
+    def stop(self):
+        "Ask the search to stop. The best move of the last finished depth is returned."
+        self.stop_requested = True
+
+    def search(self, position, max_depth=MAX_PLY - 1, time_limit=None, on_iteration=None, first_depth=1):
+        """Searches a position and returns a SearchResult.
+        - position is the Position to search. It is modified during the search, and restored at the end.
+        - max_depth is the deepest depth to search
+        - time_limit is the time budget in seconds, or None to only stop at max_depth
+        - on_iteration is called with a dictionary reporting each finished depth (depth, score, nodes, seconds, nps, pv)
+        - first_depth is the first depth of the iterative deepening. Helpers of a parallel search start deeper, so they don't all search the same depth."""
+        start = time.perf_counter()
+        self.deadline = start + time_limit if time_limit is not None else None
+        self.stop_requested = False
+        self.nodes = 0
+        self.killers = [[None, None] for ply in range(MAX_PLY)]
+        self.transposition_table.new_search()
+        result = SearchResult()
+        self.root_moves = legal_moves(position)
+        if not self.root_moves: # Checkmate or stalemate: there is nothing to search
+            return result
+        result.best_move = self.root_moves[0] # A legal move is always available, even if the first depth is stopped
+
+        history_length = len(position.history)
+        for depth in range(min(first_depth, max_depth), max_depth + 1):
+            try:
+                score = self.negamax(position, depth, -INFINITE_SCORE, INFINITE_SCORE, 0)
+            except SearchStopped: # The depth couldn't be finished, so the previous depth gives the result
+                while len(position.history) > history_length: # Unmake the moves of the interrupted search
+                    unmake_move(position)
+                break
+
+            result.depth = depth
+            result.score = score
+            result.pv = self.principal_variation(position, depth)
+            if result.pv:
+                result.best_move = result.pv[0]
+            result.nodes = self.nodes
+            result.seconds = time.perf_counter() - start
+            report = {"depth": depth, "score": score, "nodes": self.nodes, "seconds": result.seconds,
+                      "nps": result.nodes_per_second(), "pv": [move_to_uci(move) for move in result.pv]}
+            result.iterations.append(report)
+            if on_iteration is not None:
+                on_iteration(report)
+
+            if abs(score) >= MATE_SCORE - MAX_PLY: # A mate was found, searching deeper won't change the move
+                break
+            if self.deadline is not None and time.perf_counter() - start > (self.deadline - start) / 2: # The next depth would probably not finish in time
+                break
+
+        result.nodes = self.nodes
+        result.seconds = time.perf_counter() - start
+        metrics.count("nodes_searched", self.nodes)
+        metrics.record("search", result.seconds)
+        return result
+
+    def check_time(self):
+        "Raise SearchStopped if the search must stop"
+        if self.stop_requested or (self.deadline is not None and time.perf_counter() >= self.deadline):
+            raise SearchStopped()
+        if self.stop_condition is not None and self.stop_condition():
+            raise SearchStopped()
+
+    def order_moves(self, position, moves, tt_move_key, ply):
+        "Sorts the moves so the most promising ones come first"
+        color = position.side_to_move
+        mailbox = position.mailbox
+        killers = self.killers[ply]
+        history = self.history[color]
+        scores = {}
+        for move in moves:
+            if tt_move_key and move_key(move) == tt_move_key: # The best move of a previous search is tried first
+                order = 2 * CAPTURE_ORDER
+            elif move.flags & CAPTURE: # Most valuable victim, least valuable attacker
+                victim = PAWN if move.flags & EN_PASSANT else mailbox[move.to_square][1]
+                order = CAPTURE_ORDER + 10 * PIECE_VALUES[victim] - mailbox[move.from_square][1]
+            elif move.promotion is not None:
+                order = CAPTURE_ORDER + PIECE_VALUES[move.promotion]
+            elif move == killers[0] or move == killers[1]:
+                order = KILLER_ORDER
+            else:
+                order = history[move.from_square][move.to_square]
+            scores[move] = order
+        moves.sort(key=scores.__getitem__, reverse=True)
+        return moves
+
+    def negamax(self, position, depth, alpha, beta, ply):
+        "Returns the score of a position searched to a depth, between the alpha and beta bounds"
+        if ply > 0 and self.tablebases is not None and position.all_occupancy.bit_count() <= 3: # The tablebases know the exact result
+            probe_result = self.tablebases.probe(position)
+            if probe_result is not None:
+                result, distance = probe_result
+                if result == WIN:
+                    return MATE_SCORE - ply - distance
+                if result == LOSS:
+                    return -MATE_SCORE + ply + distance
+                return 0
+
+        if depth <= 0:
+            return self.quiescence(position, alpha, beta, ply)
+
+        self.nodes += 1
+        if self.nodes % TIME_CHECK_NODES == 0:
+            self.check_time()
+
+        if ply > 0 and (position.halfmove_clock >= 100 or repetition_count(position) > 1): # Draw by the fifty-move rule or by repetition
+            return 0
+        if ply >= MAX_PLY - 1: # The tables indexed by ply, such as the killers, end here
+            return evaluate(position)
+
+        original_alpha = alpha
+        hash_key = position.hash
+        entry = self.transposition_table.probe(hash_key)
+        tt_move_key = 0
+        if entry is not None:
+            tt_move_key, entry_depth, entry_score, bound = entry
+            if ply > 0 and entry_depth >= depth:
+                entry_score = self.score_from_table(entry_score, ply)
+                if bound == EXACT:
+                    return entry_score
+                if bound == LOWER_BOUND and entry_score >= beta:
+                    return entry_score
+                if bound == UPPER_BOUND and entry_score <= alpha:
+                    return entry_score
+
+        color = position.side_to_move
+        move_filter = MoveFilter(position) # Finds the checks and the pins once, so the illegal moves are skipped without being made
+        in_check = move_filter.checkers != 0
+        if in_check and ply + depth < MAX_PLY - 1: # Search one ply deeper when in check, so the search doesn't stop in the middle of a mating attack
+            depth += 1
+
+        moves = self.root_moves[:] if ply == 0 else generate_moves(position)
+        self.order_moves(position, moves, tt_move_key, ply)
+
+        best_score = -INFINITE_SCORE
+        best_move = None
+        legal_move_count = 0
+        for move in moves:
+            if not move_filter.is_legal(move): # The move would leave the king in check
+                continue
+            make_move(position, move)
+            legal_move_count += 1
+            score = -self.negamax(position, depth - 1, -beta, -alpha, ply + 1)
+            unmake_move(position)
+
+            if score > best_score:
+                best_score = score
+                best_move = move
+            if score > alpha:
+                alpha = score
+            if alpha >= beta: # The opponent won't allow this position: stop searching its moves
+                if not move.flags & CAPTURE and move.promotion is None: # Remember the quiet move which caused the cutoff
+                    killers = self.killers[ply]
+                    if killers[0] != move:
+                        killers[1] = killers[0]
+                        killers[0] = move
+                    self.history[color][move.from_square][move.to_square] += depth * depth
+                break
+
+        if legal_move_count == 0: # Checkmate or stalemate
+            return -MATE_SCORE + ply if in_check else 0
+
+        if best_score <= original_alpha:
+            bound = UPPER_BOUND
+        elif best_score >= beta:
+            bound = LOWER_BOUND
+        else:
+            bound = EXACT
+        self.transposition_table.store(hash_key, move_key(best_move), depth, self.score_to_table(best_score, ply), bound)
+        return best_score
+
+    def quiescence(self, position, alpha, beta, ply):
+        "Returns the score of a position once the captures are resolved, between the alpha and beta bounds"
+        self.nodes += 1
+        if self.nodes % TIME_CHECK_NODES == 0:
+            self.check_time()
+
+        stand_pat = evaluate(position) # The side to move can usually avoid capturing, so the evaluation is a lower bound
+        if stand_pat >= beta or ply >= MAX_PLY - 1:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+
+        captures = [move for move in generate_moves(position) if move.flags & CAPTURE or move.promotion == QUEEN]
+        if not captures:
+            return alpha
+        move_filter = MoveFilter(position)
+        self.order_moves(position, captures, 0, ply)
+        for move in captures:
+            if not move_filter.is_legal(move): # The move would leave the king in check
+                continue
+            make_move(position, move)
+            score = -self.quiescence(position, -beta, -alpha, ply + 1)
+            unmake_move(position)
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    def score_to_table(self, score, ply):
+        "Mate scores are stored as a distance from the stored position, not from the root"
+        if score >= MATE_SCORE - MAX_PLY:
+            return score + ply
+        if score <= -MATE_SCORE + MAX_PLY:
+            return score - ply
+        return score
+
+    def score_from_table(self, score, ply):
+        "Mate scores read from the table are turned back into a distance from the root"
+        if score >= MATE_SCORE - MAX_PLY:
+            return score - ply
+        if score <= -MATE_SCORE + MAX_PLY:
+            return score + ply
+        return score
+
+    def principal_variation(self, position, depth):
+        "Returns the list of the best moves found by following the transposition table from the position"
+        pv = []
+        for ply in range(depth):
+            entry = self.transposition_table.probe(position.hash)
+            if entry is None or not entry[0]:
+                break
+            move = next((move for move in legal_moves(position) if move_key(move) == entry[0]), None)
+            if move is None:
+                break
+            pv.append(move)
+            make_move(position, move)
+            if repetition_count(position) > 1: # Don't follow a cycle of the table
+                break
+        for move in pv:
+            unmake_move(position)
+        return pv
+
+
+def format_score(score):
+    "Returns a readable score: centipawns, or the number of moves before a mate"
+    if abs(score) >= MATE_SCORE - MAX_PLY:
+        moves_to_mate = (MATE_SCORE - abs(score) + 1) // 2
+        return f"mate {moves_to_mate if score > 0 else -moves_to_mate}"
+    return f"cp {score}"
+
+
+def main(arguments=None):
+    "Read the command line, search a position and print a report for each depth"
+    parser = argparse.ArgumentParser(description="Search a position and report the speed and the time to reach each depth.")
+    parser.add_argument("--fen", default=START_FEN, help="position to search, the starting position by default")
+    parser.add_argument("--depth", type=int, default=MAX_PLY - 1, help="deepest depth to search")
+    parser.add_argument("--movetime", type=float, default=None, help="time budget in seconds")
+    parser.add_argument("--hash", type=int, default=16, help="size of the transposition table in megabytes (default: 16)")
+    parser.add_argument("--tablebases", default=None, help="directory of the endgame tablebases generated by tablebase.py")
+    options = parser.parse_args(arguments)
+    if options.movetime is None and options.depth == MAX_PLY - 1: # Without any limit, search for a few seconds
+        options.movetime = 5.0
+
+    def print_iteration(report):
+        print(f"depth {report['depth']} score {format_score(report['score'])} nodes {report['nodes']} time {report['seconds']:.3f} s nps {report['nps']:,.0f} pv {' '.join(report['pv'])}")
+
+    engine = Search(hash_mb=options.hash, tablebases=Tablebases(options.tablebases) if options.tablebases else None)
+    result = engine.search(Position.from_fen(options.fen), max_depth=options.depth, time_limit=options.movetime, on_iteration=print_iteration)
+    print(f"bestmove {move_to_uci(result.best_move) if result.best_move else '(none)'}")
+    print(f"transposition table : {engine.transposition_table.stats()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
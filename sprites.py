@@ -0,0 +1,94 @@
+"""sprites.py contains a shared cache for the images of the pieces.
+   Each image file of assets/images is loaded only once per process, and each colored version of a piece is built only once
+   for a given size. All GamePiece objects with the same name and color share the same surface, even across replays.
+"""
+import os
+import pygame
+from instrumentation import metrics # Import instrumentation.py to count the images loaded
+
+
+IMAGES_DIRECTORY = os.path.abspath("assets/images") # Directory which contains one image for each piece name
+PIECE_SIZE = (75, 70) # Default size of the image of a piece
+
+_loaded_images = {} # Images loaded from disk, indexed by file path
+_piece_surfaces = {} # Colored surfaces, indexed by (name, color, size)
+_atlas = None # Single surface which holds every colored piece when the atlas is used
+_atlas_contents = None # (names, colors, size) packed in the atlas, to avoid building the same atlas twice
+
+
+def piece_image_path(name):
+    "Returns the path of the image file of a piece name"
+    return os.path.join(IMAGES_DIRECTORY, f"{name}.jpg")
+
+
+def load_image(image_path):
+    "Returns the surface of an image file, which is read from disk only the first time"
+    image = _loaded_images.get(image_path)
+    if image is None: # If the image wasn't loaded yet
+        image = pygame.image.load(image_path)
+        metrics.count("image_loads") # Each file should only be loaded once
+        _loaded_images[image_path] = image
+    return image
+
+
+def _colorize(image, color):
+    "Returns a new surface with the image multiplied by an RGB color"
+    colored_image_surf = pygame.Surface(image.get_size()) # Surface that will host the colored image
+    colored_image_surf.fill(color) # Fill the surface with the color
+    colored_image_surf.blit(image, (0,0), special_flags=pygame.BLEND_RGBA_MULT) # Draw the image on it
+    if pygame.display.get_surface() is not None: # Surfaces in the format of the window are faster to draw
+        colored_image_surf = colored_image_surf.convert()
+    return colored_image_surf
+
+
+def get_piece_surface(name, color, size=PIECE_SIZE, image_path=None):
+    """Returns the shared colored surface of a piece.
+    - name is the name of the piece ('pawn', 'king',...)
+    - color is the RGB tuple with which the piece is drawn
+    - size is the (width, height) of the surface
+    - image_path is the image to use the first time this combination is built. By default, it is the image of assets/images with the piece's name."""
+    key = (name, tuple(color), tuple(size))
+    surface = _piece_surfaces.get(key)
+    if surface is None: # The colored surface is built once for each name, color and size
+        image = load_image(image_path or piece_image_path(name))
+        surface = _colorize(pygame.transform.scale(image, size), color)
+        _piece_surfaces[key] = surface
+        metrics.count("piece_surfaces_built")
+    return surface
+
+
+def build_atlas(names, colors, size=PIECE_SIZE):
+    """Packs the colored surfaces of every name and color into a single atlas surface.
+       The shared surfaces become subsurfaces of the atlas, so all the pieces are stored in one block of memory.
+    - names is the list of piece names
+    - colors is the list of RGB colors
+    Returns the atlas surface."""
+    global _atlas, _atlas_contents
+    contents = (tuple(names), tuple(tuple(color) for color in colors), tuple(size))
+    if _atlas is not None and _atlas_contents == contents: # The same atlas was already built, for example by a previous game
+        return _atlas
+
+    width, height = size
+    atlas = pygame.Surface((width * len(names), height * len(colors)))
+    for row, color in enumerate(colors): # One row of the atlas for each color
+        for column, name in enumerate(names): # One column for each piece name
+            atlas.blit(get_piece_surface(name, color, size), (column * width, row * height))
+    if pygame.display.get_surface() is not None: # Surfaces in the format of the window are faster to draw
+        atlas = atlas.convert()
+
+    for row, color in enumerate(colors):
+        for column, name in enumerate(names):
+            rect = pygame.Rect(column * width, row * height, width, height)
+            _piece_surfaces[(name, tuple(color), tuple(size))] = atlas.subsurface(rect) # Replace the separate surface by a part of the atlas
+    _atlas = atlas
+    _atlas_contents = contents
+    return atlas
+
+
+def clear_cache():
+    "Forgets all the loaded images and colored surfaces"
+    global _atlas, _atlas_contents
+    _loaded_images.clear()
+    _piece_surfaces.clear()
+    _atlas = None
+    _atlas_contents = None
@@ -0,0 +1,381 @@
+"""tablebase.py generates and reads endgame tablebases: files which give the exact result of every position of a small endgame,
+   so the computer plays those endgames perfectly and instantly instead of searching deep trees.
+
+   The tablebases are built by retrograde analysis: the checkmates are found first, then the positions one move before a checkmate,
+   then two moves before, and so on, walking the moves backward until no new position is solved. The positions never solved are draws.
+   The tables cover the endgames with a king on each side and one more piece for the strong side: KQK, KRK and KPK. The strong side
+   is stored as white, and a position where black is the strong side is flipped upside down with the colors swapped before probing.
+
+   Each position has a perfect index ((side_to_move * 64 + strong_king) * 64 + weak_king) * 64 + piece_square, and each table is two files:
+   - <name>.wdl stores the result for the side to move (win, draw or loss) on 2 bits per position, 4 positions in a byte
+   - <name>.dtm stores the distance to mate in plies on 1 byte per position, 0 for the draws
+   Both files are read through mmap, so a probe only loads the pages it reads.
+
+   Examples :
+       python tablebase.py generate                     Generate KQK, KRK and KPK in the tablebases directory, with one process per core
+       python tablebase.py probe --fen "<FEN>"          Print the exact result of a position and of each of its moves
+"""
+import argparse
+import mmap
+import multiprocessing
+import os
+import sys
+import time
+from array import array
+from position import * # Import position.py for colors, piece types and square helpers
+from attacks import KING_ATTACKS, PAWN_ATTACKS, rook_attacks, queen_attacks # Import attacks.py for the moves of the pieces
+
+
+TABLEBASE_DIRECTORY = "tablebases" # Directory of the tablebase files
+
+# Results stored in the .wdl files, for the side to move
+DRAW = 0
+WIN = 1
+LOSS = 2
+INVALID = 3 # The index doesn't stand for a legal position
+
+ENDGAMES = {"KQK": QUEEN, "KRK": ROOK, "KPK": PAWN} # Type of the strong side's piece of each table, in the order they must be generated
+PROMOTION_TABLES = ("KQK", "KRK") # Tables probed by KPK for its promotions, which must be generated before it
+POSITION_COUNT = 2 * 64 * 64 * 64 # Number of indexes of a table
+BLOCK_SIZE = 64 * 64 # Indexes sharing a side to move and a strong king square, scanned together by one worker
+MAX_DTM = 255 # Longest distance to mate which can be stored, in plies
+
+
+def table_index(side_to_move, strong_king, weak_king, piece_square):
+    "Returns the perfect index of a position of a table, with the strong side playing white"
+    return ((side_to_move * 64 + strong_king) * 64 + weak_king) * 64 + piece_square
+
+
+def _piece_attacks(piece_type, square, occupancy):
+    "Returns the squares attacked by the strong side's piece"
+    if piece_type == QUEEN:
+        return queen_attacks(square, occupancy)
+    if piece_type == ROOK:
+        return rook_attacks(square, occupancy)
+    return PAWN_ATTACKS[WHITE][square]
+
+
+def _is_valid(piece_type, side_to_move, strong_king, weak_king, piece_square):
+    "Returns True if an index stands for a legal position: three different squares, no pawn on the last ranks, and the side which just moved not in check"
+    if strong_king == weak_king or piece_square in (strong_king, weak_king):
+        return False
+    if piece_type == PAWN and piece_square >> 3 in (0, 7):
+        return False
+    if KING_ATTACKS[strong_king] & SQUARE_BITS[weak_king]: # The kings can't stand next to each other
+        return False
+    occupancy = SQUARE_BITS[strong_king] | SQUARE_BITS[weak_king] | SQUARE_BITS[piece_square]
+    if side_to_move == WHITE and _piece_attacks(piece_type, piece_square, occupancy) & SQUARE_BITS[weak_king]: # The weak king is in check while the strong side must play
+        return False
+    return True
+
+
+def _successors(piece_type, side_to_move, strong_king, weak_king, piece_square):
+    """Returns the moves of a valid position as an (in_table, outside, in_check) tuple:
+    - in_table is the list of the indexes of the positions reached by the moves which stay in the table
+    - outside is the list of the (table name, index) tuples of the positions reached by promotions, with None as the table name
+      for the positions which are always draws (a king alone against a king and a bishop or a knight, or two kings alone)
+    - in_check tells if the side to move is in check"""
+    in_table = []
+    outside = []
+    strong_king_bit, weak_king_bit, piece_bit = SQUARE_BITS[strong_king], SQUARE_BITS[weak_king], SQUARE_BITS[piece_square]
+    occupancy = strong_king_bit | weak_king_bit | piece_bit
+    if side_to_move == WHITE:
+        for target in iterate_squares(KING_ATTACKS[strong_king] & ~piece_bit & ~KING_ATTACKS[weak_king]):
+            in_table.append(table_index(BLACK, target, weak_king, piece_square))
+        if piece_type == PAWN:
+            target = piece_square + 8
+            if not occupancy & SQUARE_BITS[target]:
+                if target >> 3 == 7: # Promotion: a queen or a rook leaves the table, a bishop or a knight can't win
+                    outside.append(("KQK", table_index(BLACK, strong_king, weak_king, target)))
+                    outside.append(("KRK", table_index(BLACK, strong_king, weak_king, target)))
+                    outside.append((None, 0))
+                else:
+                    in_table.append(table_index(BLACK, strong_king, weak_king, target))
+                    if piece_square >> 3 == 1 and not occupancy & SQUARE_BITS[target + 8]: # Two squares from the starting rank
+                        in_table.append(table_index(BLACK, strong_king, weak_king, target + 8))
+        else:
+            for target in iterate_squares(_piece_attacks(piece_type, piece_square, occupancy) & ~strong_king_bit & ~weak_king_bit):
+                in_table.append(table_index(BLACK, strong_king, weak_king, target))
+        return in_table, outside, False
+
+    in_check = bool(_piece_attacks(piece_type, piece_square, occupancy) & weak_king_bit)
+    blockers = strong_king_bit | piece_bit # The weak king no longer blocks the squares behind it once it moves
+    for target in iterate_squares(KING_ATTACKS[weak_king] & ~KING_ATTACKS[strong_king]):
+        if target == piece_square: # The weak king takes the piece, if it isn't protected by the strong king
+            outside.append((None, 0))
+        elif not _piece_attacks(piece_type, piece_square, blockers) & SQUARE_BITS[target]:
+            in_table.append(table_index(WHITE, strong_king, target, piece_square))
+    return in_table, outside, in_check
+
+
+def _predecessors(piece_type, index):
+    "Yields the indexes of the positions which reach a position by a move which stays in the table, by walking the moves backward"
+    side_to_move, strong_king, weak_king, piece_square = index >> 18, (index >> 12) & 63, (index >> 6) & 63, index & 63
+    occupancy = SQUARE_BITS[strong_king] | SQUARE_BITS[weak_king] | SQUARE_BITS[piece_square]
+    if side_to_move == WHITE: # The weak king just moved
+        for origin in iterate_squares(KING_ATTACKS[weak_king] & ~occupancy):
+            yield table_index(BLACK, strong_king, origin, piece_square)
+        return
+    for origin in iterate_squares(KING_ATTACKS[strong_king] & ~occupancy): # The strong king just moved
+        yield table_index(WHITE, origin, weak_king, piece_square)
+    if piece_type == PAWN:
+        origin = piece_square - 8
+        if origin >> 3 >= 1 and not occupancy & SQUARE_BITS[origin]:
+            yield table_index(WHITE, strong_king, weak_king, origin)
+            if piece_square >> 3 == 3 and not occupancy & SQUARE_BITS[origin - 8]: # Two squares from the starting rank
+                yield table_index(WHITE, strong_king, weak_king, origin - 8)
+    else:
+        for origin in iterate_squares(_piece_attacks(piece_type, piece_square, occupancy) & ~occupancy):
+            yield table_index(WHITE, strong_king, weak_king, origin)
+
+
+def _scan_block(arguments):
+    """Scans the positions of a block of indexes, in a worker process, and returns a (first_index, valid, move_counts, outcomes) tuple:
+    - valid and move_counts are bytes giving for each position if it's valid and how many of its moves stay in the table
+    - outcomes is the list of the (index, kind, distance) tuples of the positions whose result is already known in part:
+      'mate' and 'stalemate' for the positions without any move, 'win' for a promotion into a won position, 'draw' for a move into a draw,
+      and 'loss' for a promotion into a lost position, which counts as a move still to refute."""
+    name, side_to_move, strong_king, directory = arguments
+    piece_type = ENDGAMES[name]
+    tablebases = Tablebases(directory) if piece_type == PAWN else None # KPK needs KQK and KRK for the promotions
+    first_index = table_index(side_to_move, strong_king, 0, 0)
+    valid = bytearray(BLOCK_SIZE)
+    move_counts = array("H", bytes(2 * BLOCK_SIZE))
+    outcomes = []
+    for weak_king in range(64):
+        for piece_square in range(64):
+            if not _is_valid(piece_type, side_to_move, strong_king, weak_king, piece_square):
+                continue
+            offset = weak_king * 64 + piece_square
+            valid[offset] = 1
+            in_table, outside, in_check = _successors(piece_type, side_to_move, strong_king, weak_king, piece_square)
+            move_counts[offset] = len(in_table)
+            index = first_index + offset
+            if not in_table and not outside:
+                outcomes.append((index, "mate" if in_check else "stalemate", 0))
+            for table_name, child_index in outside:
+                result, distance = (DRAW, 0) if table_name is None else tablebases.probe_index(table_name, child_index)
+                if result == LOSS: # The opponent is lost after this move
+                    outcomes.append((index, "win", distance + 1))
+                elif result == WIN:
+                    outcomes.append((index, "loss", distance))
+                else:
+                    outcomes.append((index, "draw", 0))
+    return first_index, bytes(valid), move_counts.tobytes(), outcomes
+
+
+def missing_tables(names, directory=TABLEBASE_DIRECTORY):
+    "Returns the names of a list of tables whose files aren't in a directory"
+    return [name for name in names if not all(os.path.exists(os.path.join(directory, name + extension)) for extension in (".wdl", ".dtm"))]
+
+
+def generate_table(name, directory=TABLEBASE_DIRECTORY, workers=None):
+    """Generates the table of an endgame and writes its two files. Returns the number of (wins, draws, losses) found.
+    - name is the name of the table, a key of ENDGAMES. KPK needs the files of KQK and KRK: FileNotFoundError is raised without them.
+    - workers is the number of processes which scan the positions, the number of cores by default"""
+    piece_type = ENDGAMES[name]
+    missing = missing_tables(PROMOTION_TABLES, directory) if piece_type == PAWN else []
+    if missing: # Checked before starting, so the workers don't fail in the middle of the scan
+        raise FileNotFoundError(f"{name} needs the tables of its promotions, generate {' and '.join(missing)} first in {directory}")
+    valid = bytearray(POSITION_COUNT)
+    move_counts = array("H", bytes(2 * POSITION_COUNT)) # Moves of each position not refuted yet
+    results = bytearray(POSITION_COUNT) # DRAW until the position is solved
+    distances = bytearray(POSITION_COUNT) # Distance to mate of the solved positions, in plies
+    never_lost = bytearray(POSITION_COUNT) # Positions which have a move into a draw or a win, so they can't be lost
+    solved_at = {} # Indexes solved at each distance, to walk backward from
+    promotion_wins = {} # Indexes having a promotion into a lost position of another table, at each distance
+    refuted_at = {} # Indexes having a promotion into a won position of another table, at each distance
+
+    # First pass, shared between the processes: list the moves of every position
+    blocks = [(name, side_to_move, strong_king, directory) for side_to_move in (WHITE, BLACK) for strong_king in range(64)]
+    with multiprocessing.Pool(workers) as pool:
+        for first_index, block_valid, block_counts, outcomes in pool.imap_unordered(_scan_block, blocks):
+            valid[first_index:first_index + BLOCK_SIZE] = block_valid
+            move_counts[first_index:first_index + BLOCK_SIZE] = array("H", block_counts)
+            for index, kind, distance in outcomes:
+                if kind == "mate":
+                    results[index] = LOSS
+                    solved_at.setdefault(0, []).append(index)
+                elif kind == "win": # Solved when its distance is reached, unless a shorter win is found first
+                    never_lost[index] = 1
+                    promotion_wins.setdefault(distance, []).append(index)
+                elif kind == "loss": # One more move to refute, when its distance is reached
+                    move_counts[index] += 1
+                    refuted_at.setdefault(distance, []).append(index)
+                elif kind == "draw":
+                    never_lost[index] = 1
+
+    def solve(index, result, distance):
+        "Store the result of a position and remember to walk backward from it"
+        results[index] = result
+        distances[index] = min(distance, MAX_DTM)
+        solved_at.setdefault(distance, []).append(index)
+
+    def refute(index, distance):
+        "Count one more move of a position into a won position, found at a distance. The position is lost once all its moves are refuted."
+        move_counts[index] -= 1
+        if move_counts[index] == 0 and not never_lost[index]:
+            solve(index, LOSS, distance + 1)
+
+    # Second pass: walk backward from the solved positions, one distance at a time. The positions never solved are draws.
+    distance = 0
+    while solved_at or promotion_wins or refuted_at:
+        for index in promotion_wins.pop(distance, []):
+            if results[index] == DRAW:
+                solve(index, WIN, distance)
+        for index in refuted_at.pop(distance, []):
+            if results[index] == DRAW:
+                refute(index, distance)
+        for index in solved_at.pop(distance, []):
+            won = results[index] == WIN
+            for parent in _predecessors(piece_type, index):
+                if not valid[parent] or results[parent] != DRAW:
+                    continue
+                if won:
+                    refute(parent, distance)
+                else: # The parent can move into a lost position: it wins
+                    solve(parent, WIN, distance + 1)
+        distance += 1
+
+    # Write the files: the results packed 4 in a byte, then the distances
+    packed = bytearray(POSITION_COUNT // 4)
+    counts = {WIN: 0, DRAW: 0, LOSS: 0}
+    for index in range(POSITION_COUNT):
+        result = results[index] if valid[index] else INVALID
+        if result != INVALID:
+            counts[result] += 1
+        packed[index >> 2] |= result << ((index & 3) * 2)
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, name + ".wdl"), "wb") as wdl_file:
+        wdl_file.write(packed)
+    with open(os.path.join(directory, name + ".dtm"), "wb") as dtm_file:
+        dtm_file.write(distances)
+    return counts[WIN], counts[DRAW], counts[LOSS]
+
+
+class Tablebases:
+    """The Tablebases class reads the tablebase files of a directory through mmap.
+       - directory is the directory of the files. The tables whose files are missing are simply not probed."""
+    def __init__(self, directory=TABLEBASE_DIRECTORY):
+        "Init the tablebases. The files are opened the first time they are needed."
+        self.directory = directory
+        self.tables = {} # (wdl, dtm) memory maps of each table, or None if its files are missing
+        self.files = []
+
+    def _table(self, name):
+        "Returns the (wdl, dtm) memory maps of a table, or None if its files are missing"
+        if name not in self.tables:
+            paths = [os.path.join(self.directory, name + extension) for extension in (".wdl", ".dtm")]
+            if all(os.path.exists(path) for path in paths):
+                maps = []
+                for path in paths:
+                    table_file = open(path, "rb")
+                    self.files.append(table_file)
+                    maps.append(mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ))
+                self.tables[name] = tuple(maps)
+            else:
+                self.tables[name] = None
+        return self.tables[name]
+
+    def probe_index(self, name, index):
+        "Returns the (result, distance to mate in plies) tuple of an index of a table, or None if the table is missing"
+        table = self._table(name)
+        if table is None:
+            return None
+        wdl, dtm = table
+        return (wdl[index >> 2] >> ((index & 3) * 2)) & 3, dtm[index]
+
+    def probe(self, position):
+        """Returns the exact (result, distance to mate in plies) of a position for the side to move, or None if no table covers it.
+           result is WIN, DRAW or LOSS. The fifty-move rule is ignored. The tables don't know castling, so a position which can still castle
+           isn't covered, and neither is an illegal position."""
+        if position.castling_rights:
+            return None
+        occupancy = position.all_occupancy
+        piece_count = occupancy.bit_count()
+        if piece_count == 2: # Two kings alone
+            return DRAW, 0
+        if piece_count != 3:
+            return None
+        for color in (WHITE, BLACK):
+            for piece_type in (PAWN, KNIGHT, BISHOP, ROOK, QUEEN):
+                if position.bitboards[color][piece_type]:
+                    strong_color, strong_type = color, piece_type
+        if strong_type in (KNIGHT, BISHOP): # A single minor piece can't mate
+            return DRAW, 0
+        flip = 0 if strong_color == WHITE else 56 # Black as the strong side is flipped upside down, with the colors swapped
+        index = table_index(position.side_to_move ^ strong_color, position.king_square(strong_color) ^ flip,
+                            position.king_square(1 - strong_color) ^ flip, (position.bitboards[strong_color][strong_type].bit_length() - 1) ^ flip)
+        name = "K" + FEN_PIECE_LETTERS[strong_type].upper() + "K"
+        probe_result = self.probe_index(name, index)
+        if probe_result is None or probe_result[0] == INVALID: # Such as the side which just moved left in check
+            return None
+        return probe_result
+
+    def close(self):
+        "Close the files of the tables"
+        for table in self.tables.values():
+            if table is not None:
+                for memory in table:
+                    memory.close()
+        for table_file in self.files:
+            table_file.close()
+        self.tables = {}
+        self.files = []
+
+
+def describe(position, probe_result):
+    "Returns a short text describing a probe result, such as 'white mates in 7 moves', 'draw', or 'unknown' for a position no table covers"
+    if probe_result is None:
+        return "unknown"
+    result, distance = probe_result
+    if result == DRAW:
+        return "draw"
+    winner = position.side_to_move if result == WIN else 1 - position.side_to_move
+    return f"{'white' if winner == WHITE else 'black'} mates in {(distance + 1) // 2} moves"
+
+
+def main(arguments=None):
+    "Read the command line to generate the tables or probe a position"
+    parser = argparse.ArgumentParser(description="Generate or probe the endgame tablebases.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    generate = commands.add_parser("generate", help="generate the tables")
+    generate.add_argument("--endgames", nargs="+", default=list(ENDGAMES), choices=list(ENDGAMES), help="tables to generate (default: all)")
+    generate.add_argument("--directory", default=TABLEBASE_DIRECTORY, help="directory of the files (default: tablebases)")
+    generate.add_argument("--workers", type=int, default=None, help="number of processes (default: number of cores)")
+    probe = commands.add_parser("probe", help="print the exact result of a position")
+    probe.add_argument("--fen", required=True, help="position to probe")
+    probe.add_argument("--directory", default=TABLEBASE_DIRECTORY, help="directory of the files (default: tablebases)")
+    options = parser.parse_args(arguments)
+
+    if options.command == "generate":
+        requested = set(options.endgames)
+        if "KPK" in requested: # The promotions of KPK are probed in KQK and KRK, so the missing ones are generated too
+            requested.update(missing_tables(PROMOTION_TABLES, options.directory))
+        for name in [name for name in ENDGAMES if name in requested]: # In the order of ENDGAMES, dependencies first
+            start = time.perf_counter()
+            wins, draws, losses = generate_table(name, options.directory, options.workers)
+            print(f"{name}: {wins} wins, {draws} draws, {losses} losses for the side to move, generated in {time.perf_counter() - start:.1f} s")
+        return 0
+
+    from rules import legal_moves, make_move, unmake_move, move_to_san # Imported here, generating the tables doesn't need them
+    tablebases = Tablebases(options.directory)
+    position = Position.from_fen(options.fen)
+    probe_result = tablebases.probe(position)
+    if probe_result is None:
+        print("No table covers this position")
+        return 1
+    print(describe(position, probe_result))
+    for move in legal_moves(position): # Show the result of each move, from the side to move
+        san = move_to_san(position, move)
+        make_move(position, move)
+        child = tablebases.probe(position)
+        unmake_move(position)
+        if child is not None: # The result of the move is the result of the position reached, seen from the other side
+            print(f"  {san:8} {describe(position, (child[0], child[1] + 1) if child[0] == DRAW else ({WIN: LOSS, LOSS: WIN}[child[0]], child[1] + 1))}")
+    tablebases.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,397 @@
+"""tournament.py plays games between two settings of the computer, without any window, to check if a change makes it stronger or faster.
+   The games are played in parallel by a pool of processes. Each opening is played twice, once with each side, from the positions of an
+   openings file (FEN strings, or the end of the games of a PGN file), or by default from different positions reached by a few random moves
+   from the starting position: engines limited by depth play the same game again from the same position, and copies of a game would make
+   the error bar and the SPRT look surer than they are. Each move is searched with a time budget
+   or a depth limit, and the games end with the rules: checkmate, stalemate, fifty-move rule, threefold repetition or insufficient material.
+
+   Every finished game is appended to a PGN file at once, so a long run can be followed and its games kept if it's stopped.
+   The report gives the Elo difference of the first engine, with its 95% error bar, and the log-likelihood ratio of an SPRT
+   (sequential probability ratio test), which stops the tournament as soon as the games tell whether the difference is
+   closer to elo0 or to elo1, with the error rates alpha and beta.
+
+   An engine is written name:setting=value,... with the settings hash (megabytes), depth, movetime (seconds) and tablebases (directory).
+   An engine with a depth and no movetime searches to its depth without any time limit. --movetime only applies to the engines which give neither.
+
+   Examples :
+       python tournament.py --engine big:hash=64 --engine small:hash=1 --games 1000 --movetime 0.1 --workers 8
+       python tournament.py --engine deep:depth=5 --engine shallow:depth=4 --openings openings.fen --sprt 0,10
+"""
+from collections import namedtuple
+import argparse
+import math
+import multiprocessing
+import random
+import sys
+import time
+from position import * # Import position.py for the Position class
+from rules import * # Import rules.py to play the moves and end the games
+from search import Search, MAX_PLY # Import search.py for the engines
+from transposition import TranspositionTable, entry_count_for # Import transposition.py to keep the table of each engine in a worker process
+from tablebase import Tablebases # Import tablebase.py for the engines which use the tablebases
+from pgn import read_games, read_fens, starting_position_of # Import pgn.py to read the openings
+
+
+Engine = namedtuple("Engine", ["name", "hash_mb", "depth", "movetime", "tablebases"]) # Settings of an engine. depth, movetime and tablebases can be None.
+GameOutcome = namedtuple("GameOutcome", ["number", "white", "black", "fen", "moves", "result", "reason", "nodes", "seconds"]) # nodes and seconds are dictionaries indexed by engine name
+
+MAX_PLIES = 400 # A game which lasts longer is adjudicated as a draw
+RANDOM_OPENING_PLIES = 6 # Random moves played from the starting position to make each opening, without an openings file
+DEFAULT_MOVETIME = 0.1 # Time budget of each move in seconds, for an engine without depth or movetime when no movetime is given
+ENGINE_SETTINGS = {"hash": ("hash_mb", int), "depth": ("depth", int), "movetime": ("movetime", float), "tablebases": ("tablebases", str)}
+
+
+def parse_engine(text):
+    "Returns the Engine described by a text such as 'new:hash=32,depth=6'. IllegalValueException is raised for an unknown setting."
+    name, _, settings = text.partition(":")
+    values = {"hash_mb": 16, "depth": None, "movetime": None, "tablebases": None}
+    for setting in filter(None, settings.split(",")):
+        key, _, value = setting.partition("=")
+        if key not in ENGINE_SETTINGS:
+            raise IllegalValueException(message=f"unknown engine setting '{key}', expected one of {', '.join(ENGINE_SETTINGS)}")
+        field, convert = ENGINE_SETTINGS[key]
+        values[field] = convert(value)
+    return Engine(name or "engine", **values)
+
+
+def load_openings(path):
+    """Returns the list of the FEN strings of the openings of a file: each FEN string of a FEN or EPD file,
+       or the position reached at the end of each game of a PGN file."""
+    with open(path, encoding="utf-8", errors="replace") as openings_file:
+        if not path.lower().endswith(".pgn"):
+            return [position.to_fen() for line_number, position in read_fens(openings_file)]
+        openings = []
+        for game in read_games(openings_file):
+            position = starting_position_of(game)
+            for san in game.moves:
+                make_move(position, move_from_san(position, san))
+            openings.append(position.to_fen())
+        return openings
+
+
+def random_openings(count, plies=RANDOM_OPENING_PLIES, seed=0):
+    """Returns the FEN strings of up to count different positions reached by playing plies random legal moves from the starting position.
+       The positions where the game is already over are left out. Fewer positions are returned if there aren't enough of them."""
+    generator = random.Random(seed)
+    openings = []
+    seen = set()
+    for attempt in range(count * 20): # Few plies have few positions, so the search for new ones gives up at some point
+        if len(openings) >= count:
+            break
+        position = starting_position()
+        for ply in range(plies):
+            moves = legal_moves(position)
+            if not moves:
+                break
+            make_move(position, generator.choice(moves))
+        fen = position.to_fen()
+        if fen not in seen and game_result(position) is None:
+            seen.add(fen)
+            openings.append(fen)
+    return openings
+
+
+def is_deterministic(engine):
+    "Returns True if an engine always plays the same move in the same position: it searches to a depth, without any time budget"
+    return engine.depth is not None and engine.movetime is None
+
+
+_tables = {} # Transposition table of each engine in a worker process, allocated once and cleared before each game
+_tablebases = {} # Tablebases of each directory in a worker process
+
+
+def _engine_search(engine):
+    "Returns a new Search for an engine, with its cleared transposition table, in a worker process"
+    table = _tables.get(engine.name)
+    if table is None or table.entry_count != entry_count_for(engine.hash_mb):
+        table = _tables[engine.name] = TranspositionTable(engine.hash_mb)
+    else:
+        table.clear() # Each game starts with empty tables, so the order of the games doesn't matter
+    tablebases = None
+    if engine.tablebases:
+        tablebases = _tablebases.get(engine.tablebases)
+        if tablebases is None:
+            tablebases = _tablebases[engine.tablebases] = Tablebases(engine.tablebases)
+    return Search(transposition_table=table, tablebases=tablebases)
+
+
+def play_game(number, fen, white, black, movetime=None, max_plies=MAX_PLIES):
+    """Plays a game between two engines from a FEN string and returns its GameOutcome.
+    - movetime is the time budget of each move in seconds, used for an engine which gives neither a depth nor a movetime (DEFAULT_MOVETIME if it's None)"""
+    position = Position.from_fen(fen)
+    engines = {WHITE: white, BLACK: black}
+    searches = {WHITE: _engine_search(white), BLACK: _engine_search(black)}
+    nodes = {white.name: 0, black.name: 0}
+    seconds = {white.name: 0.0, black.name: 0.0}
+    moves = []
+    while True:
+        outcome = game_result(position)
+        if outcome is not None:
+            result, reason = outcome
+            break
+        if len(moves) >= max_plies:
+            result, reason = "1/2-1/2", "adjudicated after the ply limit"
+            break
+        engine = engines[position.side_to_move]
+        time_limit = engine.movetime
+        if time_limit is None and engine.depth is None: # Without any limit, the search would never end
+            time_limit = movetime if movetime is not None else DEFAULT_MOVETIME
+        search_result = searches[position.side_to_move].search(position, max_depth=engine.depth or MAX_PLY - 1, time_limit=time_limit)
+        nodes[engine.name] += search_result.nodes
+        seconds[engine.name] += search_result.seconds
+        moves.append(move_to_san(position, search_result.best_move))
+        make_move(position, search_result.best_move)
+    return GameOutcome(number, white.name, black.name, fen, moves, result, reason, nodes, seconds)
+
+
+def _play_game(arguments):
+    "Plays the game of a tuple of arguments of play_game, in a worker process"
+    return play_game(*arguments)
+
+
+def elo_difference(score):
+    "Returns the Elo difference given by a score between 0 and 1, which is infinite for 0 and 1"
+    if score <= 0:
+        return -math.inf
+    if score >= 1:
+        return math.inf
+    return 400 * math.log10(score / (1 - score))
+
+
+def elo_expected_score(elo):
+    "Returns the expected score of a player with an Elo difference"
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+def score_variance(wins, draws, losses):
+    "Returns the (score, variance of the score of one game) tuple of a result"
+    games = wins + draws + losses
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    return score, variance
+
+
+def elo_error_bar(wins, draws, losses, z=1.96):
+    """Returns the (elo, margin) tuple of a result: the Elo difference and the half-width of its confidence interval, 95% by default.
+       The score is kept half a game away from 0 and 1, so a result without any loss or any win, common after the first games,
+       still gives a finite Elo difference. The margin is infinite when the interval reaches a score of 0 or 1, which has no Elo
+       difference, or when the games tell nothing about the spread of the results (no game, or only draws)."""
+    games = wins + draws + losses
+    if games == 0:
+        return 0.0, math.inf
+    edge = 0.5 / games
+    score = min(max((wins + draws / 2) / games, edge), 1 - edge)
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    deviation = math.sqrt(variance / games)
+    low, high = score - z * deviation, score + z * deviation
+    if deviation == 0 or low <= edge or high >= 1 - edge:
+        return elo_difference(score), math.inf
+    return elo_difference(score), (elo_difference(high) - elo_difference(low)) / 2
+
+
+def likelihood_of_superiority(wins, losses):
+    "Returns the probability that the first engine is stronger, from its wins and losses"
+    if wins + losses == 0:
+        return 0.5
+    return 0.5 * (1 + math.erf((wins - losses) / math.sqrt(2 * (wins + losses))))
+
+
+def sprt_llr(wins, draws, losses, elo0, elo1):
+    """Returns the log-likelihood ratio of the hypothesis 'the difference is elo1' against 'the difference is elo0',
+       with the normal approximation of the score used by most engine testing frameworks"""
+    games = wins + draws + losses
+    if games == 0:
+        return 0.0
+    score, variance = score_variance(wins, draws, losses)
+    if variance == 0:
+        return 0.0
+    score0, score1 = elo_expected_score(elo0), elo_expected_score(elo1)
+    return games * (score1 - score0) * (2 * score - score0 - score1) / (2 * variance)
+
+
+def sprt_bounds(alpha, beta):
+    "Returns the (lower, upper) bounds of the log-likelihood ratio, below which elo0 is accepted and above which elo1 is accepted"
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+
+class Tournament:
+    """The Tournament class keeps the results of the games between two engines, from the point of view of the first one.
+       - engines is the (first, second) tuple of Engines
+       - sprt is None, or the (elo0, elo1, alpha, beta) tuple of the test"""
+    def __init__(self, engines, sprt=None):
+        "Init the tournament without any game"
+        self.engines = engines
+        self.sprt = sprt
+        self.wins = self.draws = self.losses = 0
+        self.reasons = {} # Number of games ended by each reason
+        self.nodes = {engine.name: 0 for engine in engines}
+        self.seconds = {engine.name: 0.0 for engine in engines}
+
+    def add(self, outcome):
+        "Adds the result of a game"
+        first = self.engines[0].name
+        if outcome.result == "1/2-1/2":
+            self.draws += 1
+        elif (outcome.result == "1-0") == (outcome.white == first):
+            self.wins += 1
+        else:
+            self.losses += 1
+        self.reasons[outcome.reason] = self.reasons.get(outcome.reason, 0) + 1
+        for name in outcome.nodes:
+            self.nodes[name] += outcome.nodes[name]
+            self.seconds[name] += outcome.seconds[name]
+
+    def games(self):
+        "Returns the number of games played"
+        return self.wins + self.draws + self.losses
+
+    def llr(self):
+        "Returns the log-likelihood ratio of the SPRT"
+        elo0, elo1, alpha, beta = self.sprt
+        return sprt_llr(self.wins, self.draws, self.losses, elo0, elo1)
+
+    def decision(self):
+        "Returns 'H1' if the SPRT accepted elo1, 'H0' if it accepted elo0, or None if more games are needed"
+        if self.sprt is None or not self.games():
+            return None
+        lower, upper = sprt_bounds(*self.sprt[2:])
+        llr = self.llr()
+        if llr >= upper:
+            return "H1"
+        if llr <= lower:
+            return "H0"
+        return None
+
+    def report(self):
+        "Returns the results as a line of text"
+        first, second = (engine.name for engine in self.engines)
+        line = f"{first} vs {second}: {self.games()} games, +{self.wins} ={self.draws} -{self.losses}"
+        if self.games():
+            elo, margin = elo_error_bar(self.wins, self.draws, self.losses)
+            line += f", Elo {elo:+.1f} +/- {margin:.1f}" if math.isfinite(margin) else f", Elo {elo:+.1f} +/- unbounded"
+            line += f", LOS {likelihood_of_superiority(self.wins, self.losses):.1%}"
+        if self.sprt is not None:
+            lower, upper = sprt_bounds(*self.sprt[2:])
+            line += f", LLR {self.llr():.2f} ({lower:.2f}, {upper:.2f}) [{self.sprt[0]:g}, {self.sprt[1]:g}]"
+        return line
+
+    def speed_report(self):
+        "Returns the speed of each engine as a line of text"
+        return ", ".join(f"{name} {self.nodes[name] / self.seconds[name]:,.0f} nodes/s" if self.seconds[name] else f"{name} -" for name in self.nodes)
+
+
+def write_game(pgn_file, outcome):
+    "Appends a finished game to an open PGN file, and flushes it so it can be read during the tournament"
+    headers = [("Event", "Tournament"), ("Round", str(outcome.number + 1)), ("White", outcome.white), ("Black", outcome.black),
+               ("Result", outcome.result), ("Termination", outcome.reason)]
+    if outcome.fen != START_FEN:
+        headers += [("SetUp", "1"), ("FEN", outcome.fen)]
+    position = Position.from_fen(outcome.fen)
+    tokens = []
+    for ply, san in enumerate(outcome.moves):
+        if position.side_to_move == WHITE or ply == 0:
+            tokens.append(f"{position.fullmove_number}." if position.side_to_move == WHITE else f"{position.fullmove_number}...")
+        tokens.append(san)
+        make_move(position, move_from_san(position, san))
+    tokens.append(outcome.result)
+    lines, line = [], ""
+    for token in tokens: # Lines of at most 80 characters
+        if line and len(line) + len(token) >= 80:
+            lines.append(line)
+            line = token
+        else:
+            line = f"{line} {token}" if line else token
+    lines.append(line)
+    pgn_file.write("".join(f'[{name} "{value}"]\n' for name, value in headers) + "\n" + "\n".join(lines) + "\n\n")
+    pgn_file.flush()
+
+
+def game_arguments(engines, openings, games, movetime, max_plies):
+    "Yields the arguments of play_game for each game: each opening is played twice, with the first engine as white, then as black"
+    for number in range(games):
+        first, second = engines if number % 2 == 0 else engines[::-1]
+        yield number, openings[number // 2 % len(openings)], first, second, movetime, max_plies
+
+
+def run_tournament(engines, openings=None, games=100, workers=None, movetime=None, max_plies=MAX_PLIES, sprt=None, pgn_path=None, on_game=None,
+                   random_plies=RANDOM_OPENING_PLIES, seed=0):
+    """Plays a tournament between two engines and returns the Tournament with the results.
+    - openings is the list of the FEN strings of the openings. If it's None, one opening for each pair of games is made by playing
+      random_plies random moves from the starting position, with the seed given, or only the starting position is played if random_plies is 0.
+    - games is the largest number of games. The tournament stops sooner if the SPRT reaches a decision.
+    - workers is the number of processes which play the games, the number of cores of the machine if it's None
+    - movetime is the time budget of each move in seconds for the engines which give neither a depth nor a movetime
+    - pgn_path is the PGN file to which each game is appended when it's finished
+    - on_game is called with the Tournament and the GameOutcome after each game"""
+    tournament = Tournament(engines, sprt)
+    if openings is None:
+        openings = random_openings((games + 1) // 2, random_plies, seed) if random_plies > 0 else [START_FEN]
+    arguments = game_arguments(engines, openings, games, movetime, max_plies)
+    pgn_file = open(pgn_path, "a", encoding="utf-8") if pgn_path else None
+    try:
+        with multiprocessing.Pool(workers or multiprocessing.cpu_count()) as pool:
+            for outcome in pool.imap_unordered(_play_game, arguments):
+                tournament.add(outcome)
+                if pgn_file is not None:
+                    write_game(pgn_file, outcome)
+                if on_game is not None:
+                    on_game(tournament, outcome)
+                if tournament.decision() is not None: # The games still being played are stopped with the pool
+                    break
+    finally:
+        if pgn_file is not None:
+            pgn_file.close()
+    return tournament
+
+
+def main(arguments=None):
+    "Read the command line, play the tournament and print the results after each game"
+    parser = argparse.ArgumentParser(description="Play games between two settings of the computer, without any window, and compare their strength.")
+    parser.add_argument("--engine", action="append", required=True, help="engine as name:setting=value,... with hash, depth, movetime and tablebases, given twice")
+    parser.add_argument("--games", type=int, default=100, help="largest number of games (default: 100)")
+    parser.add_argument("--movetime", type=float, default=None, help=f"time budget of each move in seconds, for the engines without a depth or a movetime of their own (default: {DEFAULT_MOVETIME})")
+    parser.add_argument("--openings", default=None, help="FEN, EPD or PGN file of the openings, random openings by default")
+    parser.add_argument("--random-plies", type=int, default=RANDOM_OPENING_PLIES, help=f"random moves played from the starting position to make each opening, without --openings, 0 for the starting position only (default: {RANDOM_OPENING_PLIES})")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random openings (default: 0)")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes which play the games (default: number of cores)")
+    parser.add_argument("--max-plies", type=int, default=MAX_PLIES, help=f"plies after which a game is a draw (default: {MAX_PLIES})")
+    parser.add_argument("--sprt", default=None, metavar="ELO0,ELO1", help="stop as soon as an SPRT between these Elo differences reaches a decision")
+    parser.add_argument("--alpha", type=float, default=0.05, help="false positive rate of the SPRT (default: 0.05)")
+    parser.add_argument("--beta", type=float, default=0.05, help="false negative rate of the SPRT (default: 0.05)")
+    parser.add_argument("--pgn", default="tournament.pgn", help="PGN file to which the games are appended (default: tournament.pgn)")
+    options = parser.parse_args(arguments)
+    if len(options.engine) != 2:
+        parser.error("--engine must be given twice")
+    engines = tuple(parse_engine(text) for text in options.engine)
+    if engines[0].name == engines[1].name:
+        parser.error("the engines must have different names")
+    sprt = None
+    if options.sprt is not None:
+        elo0, elo1 = (float(value) for value in options.sprt.split(","))
+        sprt = (elo0, elo1, options.alpha, options.beta)
+    if options.openings:
+        openings = load_openings(options.openings)
+    elif options.random_plies > 0:
+        openings = random_openings((options.games + 1) // 2, options.random_plies, options.seed)
+    else:
+        openings = [START_FEN]
+    if options.games > 2 * len(openings) and all(is_deterministic(engine) for engine in engines):
+        print(f"warning: {len(openings)} openings for {options.games} games between engines limited by depth: the games of an opening are played "
+              "again move for move, and the error bar, the LOS and the SPRT count the copies as new games. Give more openings or a movetime.", file=sys.stderr)
+
+    start = time.perf_counter()
+    def print_game(tournament, outcome):
+        print(f"game {outcome.number + 1}: {outcome.white} - {outcome.black} {outcome.result} ({outcome.reason}, {len(outcome.moves)} plies)")
+        print(tournament.report(), flush=True)
+
+    tournament = run_tournament(engines, openings, options.games, options.workers, options.movetime, options.max_plies, sprt, options.pgn, print_game)
+    print(f"{tournament.games()} games in {time.perf_counter() - start:.1f} s, speed: {tournament.speed_report()}")
+    print("endings: " + ", ".join(f"{reason} {count}" for reason, count in sorted(tournament.reasons.items())))
+    decision = tournament.decision()
+    if decision is not None:
+        print(f"SPRT: {'elo1' if decision == 'H1' else 'elo0'} accepted ({decision})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
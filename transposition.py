@@ -0,0 +1,140 @@
+"""transposition.py contains a TranspositionTable class which remembers the results of the search for positions already met.
+   The same position is often reached through different move orders. The table stores, for the hash of each position, the best move,
+   the depth of the search, the score and the type of bound of the score, so the search can reuse them instead of searching again.
+
+   The table is a fixed number of entries stored in two preallocated arrays of 64-bit integers, so its memory use never grows.
+   Entries are grouped by two in buckets. When a bucket is full, the entry which was searched the least deeply is replaced,
+   and entries left by older searches are replaced first (aging).
+"""
+from array import array
+
+
+# Types of bound of a stored score
+EXACT = 0 # The score is the exact score of the position
+LOWER_BOUND = 1 # The real score is at least this score (the search failed high)
+UPPER_BOUND = 2 # The real score is at most this score (the search failed low)
+
+ENTRY_SIZE = 16 # Bytes used by one entry: a 64-bit key and 64 bits of data
+BUCKET_SIZE = 2 # Number of entries in a bucket
+AGE_WEIGHT = 4 # How many plies of depth one search of age is worth when choosing which entry to replace
+SCORE_OFFSET = 1 << 31 # Scores are stored as unsigned 32-bit numbers
+
+
+def entry_count_for(size_mb):
+    "Returns the number of entries of a table of size_mb megabytes: the largest power of two which fits in the size"
+    entry_count = BUCKET_SIZE
+    while entry_count * 2 * ENTRY_SIZE <= size_mb * 1024 * 1024:
+        entry_count *= 2
+    return entry_count
+
+
+class TranspositionTable:
+    """The TranspositionTable class stores search results indexed by the Zobrist hash of the positions.
+       - size_mb is the size of the table in megabytes
+       - keys and data are optional preallocated sequences of 64-bit integers, for example in shared memory. They must have the same length,
+         which must be a power of two. By default, new arrays of size_mb megabytes are created.
+    """
+    def __init__(self, size_mb=16, keys=None, data=None):
+        "Init the table with all its entries empty"
+        if keys is None: # Allocate the arrays once
+            entry_count = entry_count_for(size_mb)
+            keys = array("Q", bytes(8 * entry_count))
+            data = array("Q", bytes(8 * entry_count))
+
+        self.keys = keys # Hash of each entry, mixed with its data so a half-written entry is never accepted
+        self.data = data # Packed move, depth, bound, age and score of each entry
+        self.entry_count = len(keys)
+        self.bucket_mask = (self.entry_count - 1) & ~(BUCKET_SIZE - 1) # Turns a hash into the index of the first entry of its bucket
+        self.age = 0 # Number of the current search, from 0 to 63
+
+        # Counters, to measure how useful the table is
+        self.hits = 0 # Probes which found the position
+        self.misses = 0 # Probes which didn't find the position
+        self.collisions = 0 # Misses for which the bucket was full of other positions
+        self.stores = 0 # Results stored
+        self.replacements = 0 # Results which replaced another position
+
+    def size_mb(self):
+        "Returns the memory used by the entries, in megabytes"
+        return self.entry_count * ENTRY_SIZE / (1024 * 1024)
+
+    def new_search(self):
+        "Tell the table a new search starts, so the entries of the previous searches become older"
+        self.age = (self.age + 1) & 63
+
+    def clear(self):
+        "Empty every entry and reset the counters"
+        for entries in (self.keys, self.data): # Overwrite the memory of both arrays with zeros at once
+            memory = memoryview(entries).cast("B")
+            memory[:] = bytes(len(memory))
+        self.age = 0
+        self.hits = self.misses = self.collisions = self.stores = self.replacements = 0
+
+    def probe(self, hash_key):
+        """Returns a (move_key, depth, score, bound) tuple stored for a position, or None if the position isn't in the table.
+           move_key is the key given by rules.move_key, or 0 if no best move is known."""
+        index = hash_key & self.bucket_mask
+        keys, data = self.keys, self.data
+        full = True # Becomes False if an empty entry is met
+        for slot in range(index, index + BUCKET_SIZE):
+            entry_data = data[slot]
+            if keys[slot] ^ entry_data == hash_key and entry_data: # The key is stored mixed with the data
+                self.hits += 1
+                return (entry_data & 0xFFFF, (entry_data >> 16) & 0xFF, (entry_data >> 32) - SCORE_OFFSET, (entry_data >> 24) & 3)
+            if not entry_data:
+                full = False
+        self.misses += 1
+        if full:
+            self.collisions += 1
+        return None
+
+    def store(self, hash_key, move_key, depth, score, bound):
+        """Stores the result of a search.
+        - hash_key is the Zobrist hash of the position
+        - move_key is the key of the best move given by rules.move_key, or 0
+        - depth is the depth of the search, score its score and bound the type of bound of the score"""
+        depth = min(max(depth, 0), 255) # The depth is stored on 8 bits
+        index = hash_key & self.bucket_mask
+        keys, data = self.keys, self.data
+        age = self.age
+
+        victim = index # Entry which will be replaced
+        victim_value = None
+        for slot in range(index, index + BUCKET_SIZE):
+            entry_data = data[slot]
+            if not entry_data: # An empty entry is used first
+                victim = slot
+                break
+            if keys[slot] ^ entry_data == hash_key: # The same position is replaced, but its best move is kept if the new result has none
+                if not move_key:
+                    move_key = entry_data & 0xFFFF
+                if bound != EXACT and age == (entry_data >> 26) & 63 and depth < ((entry_data >> 16) & 0xFF): # Keep a deeper result of the same search
+                    return
+                victim = slot
+                break
+            entry_depth = (entry_data >> 16) & 0xFF
+            relative_age = (age - ((entry_data >> 26) & 63)) & 63 # How many searches ago the entry was stored
+            value = entry_depth - AGE_WEIGHT * relative_age # Shallow and old entries are worth the least
+            if victim_value is None or value < victim_value:
+                victim = slot
+                victim_value = value
+        else:
+            self.replacements += 1
+
+        entry_data = (move_key & 0xFFFF) | (depth << 16) | (bound << 24) | (age << 26) | ((score + SCORE_OFFSET) << 32)
+        data[victim] = entry_data
+        keys[victim] = hash_key ^ entry_data
+        self.stores += 1
+
+    def hashfull(self):
+        "Returns the number of entries in a thousand which are used by the current search, sampled on the first thousand entries"
+        sample = min(1000, self.entry_count)
+        used = sum(1 for index in range(sample) if self.data[index] and (self.data[index] >> 26) & 63 == self.age)
+        return used * 1000 // sample
+
+    def stats(self):
+        "Returns a dictionary with the counters of the table"
+        probes = self.hits + self.misses
+        return {"size_mb": self.size_mb(), "entries": self.entry_count, "hits": self.hits, "misses": self.misses,
+                "collisions": self.collisions, "stores": self.stores, "replacements": self.replacements,
+                "hit_rate": self.hits / probes if probes else 0.0, "hashfull": self.hashfull()}
@@ -0,0 +1,260 @@
+"""uci.py lets the computer play through the UCI protocol (Universal Chess Interface), on the standard input and output,
+   so it can be used by tournament managers and analysis programs, such as cutechess-cli, Arena or a chess GUI.
+   A thread reads the commands as soon as they arrive, while the search runs in another thread: "stop" and "isready"
+   are answered in the middle of a search, and a search stops a few milliseconds after "stop".
+   With "go ponder", the engine searches on the opponent's time without any limit. "ponderhit" starts its time budget,
+   and its best move is sent at once if the search already finished.
+
+   Supported commands : uci, isready, ucinewgame, setoption (Hash, Threads), position (startpos or fen, then moves),
+   go (depth, movetime, wtime, btime, winc, binc, movestogo, infinite, ponder), ponderhit, stop, quit, and d to print the FEN of the current position.
+   With more than one thread, the search is a ParallelSearch, whose processes share the transposition table.
+
+   Examples :
+       python uci.py                  Speak UCI on the standard input and output
+       python main.py --uci           Same, from the entry point of the game, without opening any window
+"""
+import argparse
+import queue
+import sys
+import threading
+from position import * # Import position.py for the Position class
+from rules import * # Import rules.py to play the moves of the position command
+from search import Search, MAX_PLY, format_score # Import search.py for the search with one thread
+from parallel_search import ParallelSearch # Import parallel_search.py for the search with several processes
+
+
+ENGINE_NAME = "Chess !"
+ENGINE_AUTHOR = "the Chess ! authors"
+DEFAULT_HASH_MB = 16
+MAX_HASH_MB = 4096
+MAX_THREADS = 256
+DEFAULT_MOVES_TO_GO = 30 # Moves left until the next time control, when go doesn't give movestogo
+MOVE_OVERHEAD = 50 # Milliseconds kept for the communication with the interface, so the engine never loses on time
+STOP_RETRY = 0.005 # Seconds between two stop requests sent to a search which didn't stop yet
+GO_PARAMETERS = ("depth", "movetime", "wtime", "btime", "winc", "binc", "movestogo") # Parameters of go followed by a number
+
+
+def read_commands(lines, commands):
+    "Puts each line of an iterable of lines, such as the standard input, on a queue, then None at the end of the input"
+    for line in lines:
+        commands.put(line)
+    commands.put(None)
+
+
+def parse_go(tokens):
+    "Returns a dictionary of the parameters of a go command: the numbers of GO_PARAMETERS, and infinite and ponder if they are given"
+    parameters = {}
+    for index, token in enumerate(tokens):
+        if token in GO_PARAMETERS and index + 1 < len(tokens):
+            parameters[token] = int(tokens[index + 1])
+        elif token in ("infinite", "ponder"):
+            parameters[token] = True
+    return parameters
+
+
+def time_budget(parameters, color):
+    "Returns the time budget of a search in seconds, from the parameters of go and the side to move, or None to search without any time limit"
+    if "movetime" in parameters:
+        return max(parameters["movetime"] - MOVE_OVERHEAD, 1) / 1000
+    remaining = parameters.get("wtime" if color == WHITE else "btime")
+    if remaining is None or parameters.get("infinite"):
+        return None
+    increment = parameters.get("winc" if color == WHITE else "binc", 0)
+    budget = remaining / parameters.get("movestogo", DEFAULT_MOVES_TO_GO) + increment * 3 / 4 # The search rarely uses all of it, since it doesn't start a depth it can't finish
+    return max(min(budget, remaining - MOVE_OVERHEAD), 1) / 1000
+
+
+def format_info(report):
+    "Returns the info line of a report of a finished depth"
+    return (f"info depth {report['depth']} score {format_score(report['score'])} nodes {report['nodes']} nps {report['nps']:.0f} "
+            f"time {report['seconds'] * 1000:.0f} pv {' '.join(report['pv'])}")
+
+
+class UciEngine:
+    """The UciEngine class answers the commands of the UCI protocol.
+       - output is the file on which the answers are written
+       - hash_mb and threads are the first values of the Hash and Threads options"""
+    def __init__(self, output=sys.stdout, hash_mb=DEFAULT_HASH_MB, threads=1):
+        "Init the engine with the starting position. The search is created when it's first needed."
+        self.output = output
+        self.output_lock = threading.Lock() # The answers of the search thread and of the commands mustn't be mixed
+        self.hash_mb = hash_mb
+        self.threads = threads
+        self.engine = None # Search or ParallelSearch, created by get_engine
+        self.position = starting_position()
+        self.search_thread = None # Thread running the current search, if any
+        self.release_event = threading.Event() # Set by stop, quit and ponderhit, so an infinite or ponder search which ended gives its move
+        self.ponder_time_limit = None # Time budget of the ponder search, which starts at ponderhit
+        self.ponder_timer = None # Timer which stops the search once the time budget after ponderhit is over
+
+    def send(self, line):
+        "Writes an answer to the interface"
+        with self.output_lock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    def get_engine(self):
+        "Returns the search, created with the current options"
+        if self.engine is None:
+            self.engine = ParallelSearch(self.threads, self.hash_mb) if self.threads > 1 else Search(hash_mb=self.hash_mb)
+        return self.engine
+
+    def close_engine(self):
+        "Stops the search and closes its processes, so it's created again with new options"
+        self.stop()
+        if isinstance(self.engine, ParallelSearch):
+            self.engine.close()
+        self.engine = None
+
+    def handle(self, line):
+        "Answers a command. Returns False if the engine must quit."
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, arguments = tokens[0], tokens[1:]
+        if command == "uci":
+            self.send(f"id name {ENGINE_NAME}")
+            self.send(f"id author {ENGINE_AUTHOR}")
+            self.send(f"option name Hash type spin default {DEFAULT_HASH_MB} min 1 max {MAX_HASH_MB}")
+            self.send(f"option name Threads type spin default 1 min 1 max {MAX_THREADS}")
+            self.send("option name Ponder type check default false")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "setoption":
+            self.set_option(arguments)
+        elif command == "ucinewgame":
+            self.stop()
+            if self.engine is not None:
+                self.engine.transposition_table.clear()
+        elif command == "position":
+            self.set_position(arguments)
+        elif command == "go":
+            self.go(parse_go(arguments))
+        elif command == "stop":
+            self.stop()
+        elif command == "ponderhit":
+            self.ponderhit()
+        elif command == "d":
+            self.send(self.position.to_fen())
+        elif command == "quit":
+            self.close_engine()
+            return False
+        else:
+            self.send(f"info string unknown command {command}")
+        return True
+
+    def set_option(self, arguments):
+        "Sets an option from the arguments of setoption: name <name> value <value>"
+        text = " ".join(arguments)
+        name, _, value = text.partition(" value ")
+        name = name.replace("name", "", 1).strip().lower()
+        try:
+            if name == "hash":
+                self.hash_mb = min(max(int(value), 1), MAX_HASH_MB)
+            elif name == "threads":
+                self.threads = min(max(int(value), 1), MAX_THREADS)
+            elif name == "ponder": # The interface decides when to ponder with go ponder, so there is nothing to change
+                return
+            else:
+                self.send(f"info string unknown option {name}")
+                return
+        except ValueError:
+            self.send(f"info string invalid value {value} for option {name}")
+            return
+        self.close_engine() # The search is created again with the new option at the next go
+
+    def set_position(self, arguments):
+        "Sets the current position from the arguments of position: startpos or fen <FEN>, then optionally moves <move>..."
+        moves_index = arguments.index("moves") if "moves" in arguments else len(arguments)
+        try:
+            if arguments and arguments[0] == "fen":
+                position = Position.from_fen(" ".join(arguments[1:moves_index]))
+            else:
+                position = starting_position()
+            for text in arguments[moves_index + 1:]:
+                make_move(position, move_from_uci(position, text))
+        except (IllegalValueException, ValueError, IndexError) as error:
+            self.send(f"info string invalid position: {error}")
+            return
+        self.position = position
+
+    def go(self, parameters):
+        "Starts searching the current position in the search thread"
+        self.stop()
+        self.release_event.clear()
+        engine = self.get_engine()
+        time_limit = time_budget(parameters, self.position.side_to_move)
+        max_depth = min(parameters.get("depth", MAX_PLY - 1), MAX_PLY - 1)
+        wait = parameters.get("infinite", False) or parameters.get("ponder", False) # The best move is only sent after stop or ponderhit
+        if parameters.get("ponder"):
+            self.ponder_time_limit, time_limit = time_limit, None
+        self.search_thread = threading.Thread(target=self.search, args=(engine, self.position.copy(), max_depth, time_limit, wait), daemon=True)
+        self.search_thread.start()
+
+    def ponderhit(self):
+        "The opponent played the expected move: the ponder search follows its time budget from now on"
+        self.release_event.set()
+        if self.search_thread is not None and self.ponder_time_limit is not None:
+            self.ponder_timer = threading.Timer(self.ponder_time_limit, self.engine.stop)
+            self.ponder_timer.start()
+        self.ponder_time_limit = None
+
+    def search(self, engine, position, max_depth, time_limit, wait):
+        "Searches a position and sends the best move, in the search thread"
+        if isinstance(engine, ParallelSearch): # The workers don't report each depth, so only the last one is sent
+            result = engine.search(position, max_depth=max_depth, time_limit=time_limit)
+            if result.depth:
+                self.send(format_info({"depth": result.depth, "score": result.score, "nodes": result.nodes, "seconds": result.seconds,
+                                       "nps": result.nodes_per_second(), "pv": [move_to_uci(move) for move in result.pv]}))
+        else:
+            result = engine.search(position, max_depth=max_depth, time_limit=time_limit, on_iteration=lambda report: self.send(format_info(report)))
+        if wait: # The best move of an infinite or ponder search is only sent after stop or ponderhit, even if the search ended sooner
+            self.release_event.wait()
+        line = f"bestmove {move_to_uci(result.best_move) if result.best_move is not None else '0000'}"
+        if len(result.pv) >= 2: # The expected reply, on which the interface can ask the engine to ponder
+            line += f" ponder {move_to_uci(result.pv[1])}"
+        self.send(line)
+
+    def stop(self):
+        "Stops the current search, if any, and waits for its best move to be sent"
+        self.release_event.set()
+        if self.ponder_timer is not None: # It mustn't stop the next search
+            self.ponder_timer.cancel()
+            self.ponder_timer = None
+        self.ponder_time_limit = None
+        if self.search_thread is not None:
+            while self.search_thread.is_alive(): # Asked again until the thread ends, in case the search hadn't started yet when it was first asked
+                self.engine.stop()
+                self.search_thread.join(STOP_RETRY)
+            self.search_thread = None
+
+    def run(self, lines=None):
+        """Reads the commands of an iterable of lines in a background thread, and answers them until quit or the end of the input.
+           The standard input is read by default, through its own file object: a process started by ParallelSearch closes sys.stdin,
+           which would wait forever for the lock held by the reading thread."""
+        if lines is None:
+            lines = open(sys.stdin.fileno(), encoding="utf-8", closefd=False)
+        commands = queue.Queue()
+        threading.Thread(target=read_commands, args=(lines, commands), daemon=True).start()
+        while True:
+            line = commands.get()
+            if line is None: # The interface closed the input
+                self.close_engine()
+                break
+            if not self.handle(line):
+                break
+
+
+def main(arguments=None):
+    "Read the command line and speak UCI on the standard input and output"
+    parser = argparse.ArgumentParser(description="Play through the UCI protocol on the standard input and output.")
+    parser.add_argument("--hash", type=int, default=DEFAULT_HASH_MB, help=f"first size of the transposition table in megabytes (default: {DEFAULT_HASH_MB})")
+    parser.add_argument("--threads", type=int, default=1, help="first number of search threads (default: 1)")
+    options = parser.parse_args(arguments)
+    UciEngine(hash_mb=options.hash, threads=options.threads).run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
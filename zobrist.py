@@ -0,0 +1,30 @@
+"""zobrist.py contains the random keys used to compute the Zobrist hash of a position.
+   The hash of a position is the XOR of one key for each piece on its square, plus keys for the castling rights, the en passant
+   file and the side to move. Since XOR can be undone by itself, the hash is updated incrementally when a piece moves.
+   The keys come from a fixed seed, so a position always has the same hash, which allows hashes to be saved to files.
+"""
+import random
+
+
+_generator = random.Random(20240601) # Fixed seed, so the keys are the same in every process
+
+PIECE_KEYS = [[[_generator.getrandbits(64) for square in range(64)] for piece_type in range(6)] for color in range(2)] # Key of each piece on each square, indexed by color, piece type and square
+CASTLING_KEYS = [_generator.getrandbits(64) for castling_rights in range(16)] # Key of each combination of castling rights
+EN_PASSANT_KEYS = [_generator.getrandbits(64) for file in range(8)] # Key of each file on which an en passant capture is possible
+SIDE_KEY = _generator.getrandbits(64) # Key added when the enemy must play
+
+CASTLING_KEYS[0] = 0 # A position without castling rights and with the player to move only hashes its pieces
+
+
+def compute_hash(position):
+    "Computes the Zobrist hash of a position from scratch"
+    hash_key = 0
+    for square, piece in enumerate(position.mailbox): # For each square of the board
+        if piece is not None:
+            hash_key ^= PIECE_KEYS[piece[0]][piece[1]][square]
+    hash_key ^= CASTLING_KEYS[position.castling_rights]
+    if position.en_passant is not None:
+        hash_key ^= EN_PASSANT_KEYS[position.en_passant & 7]
+    if position.side_to_move == 1: # The enemy must play
+        hash_key ^= SIDE_KEY
+    return hash_key